@@ -1,8 +1,9 @@
 from email.policy import default
 from django.db import models
 from cdd_client import CddClient
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from cdd.constants import ADMINISTRATIVE_LEVEL_TYPE
+from administrativelevels.tree import administrative_level_tree
 
 
 # Create your models here.
@@ -154,3 +155,11 @@ def update_or_create_amd_couch(sender, instance, **kwargs):
 
 
 post_save.connect(update_or_create_amd_couch, sender=AdministrativeLevel)
+
+
+def invalidate_administrative_level_tree(sender, instance, **kwargs):
+    administrative_level_tree.invalidate()
+
+
+post_save.connect(invalidate_administrative_level_tree, sender=AdministrativeLevel)
+post_delete.connect(invalidate_administrative_level_tree, sender=AdministrativeLevel)
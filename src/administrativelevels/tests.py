@@ -0,0 +1,100 @@
+from django.test import SimpleTestCase
+
+from administrativelevels.tree import (
+    AdministrativeLevelTree,
+    AdministrativeLevelTreeCache,
+)
+from process_manager.tests import FakeCouchDBTestCase
+
+
+def get_doc(administrative_id, parent_id, level, name=None):
+    return {
+        "type": "administrative_level",
+        "administrative_id": administrative_id,
+        "parent_id": parent_id,
+        "administrative_level": level,
+        "name": name or f"{level} {administrative_id}",
+    }
+
+
+DOCS = [
+    get_doc("10", None, "Region"),
+    get_doc("11", "10", "Prefecture"),
+    get_doc("12", "11", "Commune"),
+    get_doc("13", "12", "Canton"),
+    get_doc(1, "13", "Village"),
+    get_doc("2", "13", "Village"),
+    get_doc("20", None, "Region"),
+    # Its parent is unknown, so it is a root
+    get_doc("3", "99", "Village"),
+]
+
+
+class TestAdministrativeLevelTree(SimpleTestCase):
+    def setUp(self):
+        self.tree = AdministrativeLevelTree(DOCS)
+
+    def test_lookups(self):
+        self.assertEqual(len(self.tree), 8)
+        self.assertIn("1", self.tree)
+        self.assertIn(2, self.tree)
+        self.assertNotIn("99", self.tree)
+        self.assertEqual(self.tree.get("1")["name"], "Village 1")
+        self.assertIsNone(self.tree.get("99"))
+        self.assertEqual(self.tree.get_parent(1)["administrative_id"], "13")
+        self.assertIsNone(self.tree.get_parent("10"))
+        self.assertEqual(self.tree.get_depth("1"), 4)
+
+    def test_ancestors(self):
+        self.assertEqual(self.tree.get_ancestor_ids("1"), ["10", "11", "12", "13"])
+        self.assertEqual(self.tree.get_ancestor("2", "commune")["name"], "Commune 12")
+        self.assertEqual(self.tree.get_region("2")["administrative_id"], "10")
+        self.assertIsNone(self.tree.get_region("3"))
+        self.assertEqual(self.tree.get_ancestor_ids("3"), [])
+
+    def test_descendants(self):
+        self.assertEqual(
+            [doc["administrative_id"] for doc in self.tree.get_children(None)],
+            ["10", "20", "3"],
+        )
+        self.assertEqual(
+            [
+                doc["administrative_id"]
+                for doc in self.tree.get_descendants("11", "village")
+            ],
+            [1, "2"],
+        )
+        self.assertEqual(len(self.tree.get_descendants("10", include_self=True)), 6)
+        self.assertEqual(
+            [doc["administrative_id"] for doc in self.tree.get_by_level("Region")],
+            ["10", "20"],
+        )
+
+    def test_documents_are_copied(self):
+        self.tree.get("1")["name"] = "Edited"
+        self.assertEqual(self.tree.get("1")["name"], "Village 1")
+
+
+class TestAdministrativeLevelTreeCache(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.nsc.get_db("administrative_levels")
+        self.nsc.bulk_upsert(self.db, DOCS[:2])
+
+    def test_reloaded_when_the_database_changes(self):
+        cache = AdministrativeLevelTreeCache(check_interval=0)
+        tree = cache.get()
+        self.assertEqual(len(tree), 2)
+        self.assertIs(cache.get(), tree)
+
+        self.nsc.bulk_upsert(self.db, DOCS[2:4])
+        self.assertEqual(len(cache.get()), 4)
+
+    def test_kept_until_the_next_check(self):
+        cache = AdministrativeLevelTreeCache(check_interval=60)
+        tree = cache.get()
+        self.nsc.bulk_upsert(self.db, DOCS[2:4])
+        self.assertIs(cache.get(), tree)
+
+        cache.invalidate()
+        self.assertEqual(len(cache.get()), 4)
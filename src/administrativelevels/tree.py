@@ -0,0 +1,187 @@
+# In-memory tree of the documents of the administrative_levels CouchDB database,
+# loaded with a single _find and shared by the threads of a process. Every level
+# keeps its parent, children, depth and the ids of its ancestors, so the parent,
+# ancestor, descendant and region lookups are dictionary reads instead of chains
+# of Mango queries. The tree is reloaded when the update_seq of the database
+# changes (checked at most every NO_SQL_DESIGN_CACHE_CHECK_INTERVAL seconds, so
+# that the writes of other processes are seen) and dropped when an
+# AdministrativeLevel is saved or deleted.
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from no_sql_client import NoSQLClient
+
+REGION = "Region"
+VILLAGE = "Village"
+
+
+def get_key(administrative_id):
+    return str(administrative_id) if administrative_id not in (None, "") else None
+
+
+class AdministrativeLevelTree:
+    def __init__(self, docs, update_seq=None):
+        self.update_seq = update_seq  # of the database the documents were read at
+        self.docs = {}  # administrative_id -> document
+        self.children = {}  # parent administrative_id (None for the roots) -> ids
+        for doc in docs:
+            key = get_key(doc.get("administrative_id"))
+            if key is not None:
+                self.docs[key] = doc
+        for key, doc in self.docs.items():
+            parent = get_key(doc.get("parent_id"))
+            if parent not in self.docs:
+                parent = None
+            self.children.setdefault(parent, []).append(key)
+
+        # Ancestors from the root down to the parent, computed top-down so that
+        # each level reuses the ancestors of its parent
+        self.ancestors = {}
+        pending = [(key, ()) for key in self.children.get(None, [])]
+        while pending:
+            key, ancestors = pending.pop()
+            self.ancestors[key] = ancestors
+            pending.extend(
+                (child, ancestors + (key,))
+                for child in self.children.get(key, [])
+                if child not in self.ancestors
+            )
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, administrative_id):
+        return get_key(administrative_id) in self.docs
+
+    def get(self, administrative_id):
+        """
+        Return a copy of the document of the administrative level, or None
+        """
+        doc = self.docs.get(get_key(administrative_id))
+        return dict(doc) if doc is not None else None
+
+    def get_depth(self, administrative_id):
+        ancestors = self.ancestors.get(get_key(administrative_id))
+        return len(ancestors) if ancestors is not None else None
+
+    def get_parent(self, administrative_id):
+        ancestors = self.ancestors.get(get_key(administrative_id))
+        return self.get(ancestors[-1]) if ancestors else None
+
+    def get_ancestor_ids(self, administrative_id):
+        """
+        Return the administrative_ids of the ancestors, from the root down to the
+        parent
+        """
+        return [
+            self.docs[key]["administrative_id"]
+            for key in self.ancestors.get(get_key(administrative_id), ())
+        ]
+
+    def get_ancestors(self, administrative_id):
+        return [
+            self.get(key) for key in self.ancestors.get(get_key(administrative_id), ())
+        ]
+
+    def get_ancestor(self, administrative_id, level):
+        """
+        Return the ancestor of the given level (administrative_level) or None
+        """
+        for key in reversed(self.ancestors.get(get_key(administrative_id), ())):
+            if self.docs[key].get("administrative_level", "").lower() == level.lower():
+                return self.get(key)
+        return None
+
+    def get_region(self, administrative_id):
+        return self.get_ancestor(administrative_id, REGION)
+
+    def get_children(self, parent_id):
+        """
+        Return the children of the administrative level, the roots for None
+        """
+        return [self.get(key) for key in self.children.get(get_key(parent_id), [])]
+
+    def get_descendants(self, administrative_id, level=None, include_self=False):
+        """
+        Return the descendants of the administrative level, only the ones of the
+        given level (administrative_level) if any
+        """
+        keys = [get_key(administrative_id)] if include_self else []
+        pending = deque(self.children.get(get_key(administrative_id), []))
+        while pending:
+            key = pending.popleft()
+            keys.append(key)
+            pending.extend(self.children.get(key, []))
+        return [
+            self.get(key)
+            for key in keys
+            if key in self.docs
+            and (
+                level is None
+                or self.docs[key].get("administrative_level", "").lower()
+                == level.lower()
+            )
+        ]
+
+    def get_by_level(self, level):
+        return [
+            self.get(key)
+            for key, doc in self.docs.items()
+            if doc.get("administrative_level", "").lower() == level.lower()
+        ]
+
+
+class AdministrativeLevelTreeCache:
+    def __init__(self, db_name="administrative_levels", check_interval=None):
+        self.db_name = db_name
+        self.check_interval = check_interval
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._update_seq = None
+        self._checked_at = 0
+
+    def get(self):
+        """
+        Return the tree, loaded again if the database changed since
+        """
+        nsc = NoSQLClient()
+        db = nsc.get_db(self.db_name)
+        check_interval = (
+            self.check_interval
+            if self.check_interval is not None
+            else settings.NO_SQL_DESIGN_CACHE_CHECK_INTERVAL
+        )
+        with self._lock:
+            if (
+                self._tree is not None
+                and time.monotonic() - self._checked_at < check_interval
+            ):
+                return self._tree
+            # The sequence is read before the documents, a write in between makes
+            # the next check load them again
+            update_seq = db.metadata().get("update_seq")
+            if self._tree is None or update_seq != self._update_seq:
+                self._tree = AdministrativeLevelTree(
+                    nsc.find_documents(db, {"type": "administrative_level"}),
+                    update_seq,
+                )
+                self._update_seq = update_seq
+            self._checked_at = time.monotonic()
+            return self._tree
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+
+
+administrative_level_tree = AdministrativeLevelTreeCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=administrative_level_tree.reset)
@@ -0,0 +1,21 @@
+# Handlers of the changes of the facilitator databases, run by the follow_changes
+# command (see process_manager.changes).
+from authentication.models import Facilitator
+from process_manager.changes import register
+from process_manager.enums import ChangeEventEnum
+
+
+@register(ChangeEventEnum.DOCUMENT_UPDATED)
+def update_facilitator_villages(events):
+    """
+    Keep the FacilitatorVillage rows in step with the administrative levels of the
+    facilitator documents
+    """
+    docs = {}  # db_name -> latest facilitator document
+    for event in events:
+        if event.doc.get("type") == "facilitator":
+            docs[event.db_name] = event.doc
+    for facilitator in Facilitator.objects.filter(no_sql_db_name__in=docs):
+        facilitator.set_villages(
+            docs[facilitator.no_sql_db_name].get("administrative_levels") or []
+        )
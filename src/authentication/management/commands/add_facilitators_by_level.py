@@ -92,6 +92,7 @@ class Command(BaseCommand):
                 }
             ]
             facilitator_doc.save()
+            facilitator.set_villages(facilitator_doc["administrative_levels"])
 
             added += 1
             self.stdout.write(
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import Facilitator
+from dashboard.sync_runner import run_concurrently
+from no_sql_client import NoSQLClient
+
+
+def read_facilitator_document(facilitator):
+    nsc = NoSQLClient()
+    docs = nsc.find_documents(
+        nsc.get_db(facilitator.no_sql_db_name),
+        {"type": "facilitator"},
+        fields=["administrative_levels"],
+    )
+    return docs[0] if docs else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the facilitator villages used by the locality filters from the"
+        " facilitator documents. The facilitator forms and the follow_changes"
+        " command keep them current afterwards."
+    )
+    error_messages = {
+        "concurrency": "--concurrency must be positive.",
+        "failed": "Some facilitator databases couldn't be read, run the command again to retry them.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.NO_SQL_CONCURRENCY,
+            help="Number of facilitator databases read at the same time",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["concurrency"] < 1:
+            raise CommandError(self.error_messages["concurrency"])
+
+        rebuilt = 0
+        failed = 0
+        for facilitator, future in run_concurrently(
+            read_facilitator_document,
+            list(Facilitator.objects.all()),
+            kwargs["concurrency"],
+        ):
+            try:
+                doc = future.result()
+            except Exception as e:
+                self.stdout.write(
+                    self.style.WARNING(f"{facilitator.no_sql_db_name}: {e}")
+                )
+                failed += 1
+                continue
+            facilitator.set_villages((doc or {}).get("administrative_levels") or [])
+            rebuilt += 1
+
+        self.stdout.write(f"{rebuilt} rebuilt, {failed} failed facilitator(s)")
+        if failed:
+            raise CommandError(self.error_messages["failed"])
+        self.stdout.write(
+            self.style.SUCCESS("Successfully rebuilt the facilitator villages")
+        )
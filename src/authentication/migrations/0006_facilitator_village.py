@@ -0,0 +1,50 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authentication", "0005_alter_facilitator_code"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacilitatorVillage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("administrative_id", models.CharField(max_length=50)),
+                ("name", models.CharField(blank=True, max_length=255)),
+                (
+                    "facilitator",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="villages",
+                        to="authentication.facilitator",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="facilitatorvillage",
+            index=models.Index(
+                fields=["administrative_id"], name="authenticat_adminis_06e340_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="facilitatorvillage",
+            constraint=models.UniqueConstraint(
+                fields=("facilitator", "administrative_id"),
+                name="unique_facilitator_village",
+            ),
+        ),
+    ]
@@ -2,7 +2,7 @@ import secrets
 import time
 
 from django.contrib.auth.hashers import make_password
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
 from no_sql_client import NoSQLClient
@@ -176,6 +176,27 @@ class Facilitator(models.Model):
         except Exception as e:
             return None
 
+    def set_villages(self, administrative_levels):
+        """
+        Replace the FacilitatorVillage rows of the facilitator by the
+        administrative levels of its facilitator document
+        """
+        villages = {
+            str(administrative_level["id"]): administrative_level.get("name") or ""
+            for administrative_level in administrative_levels
+            if administrative_level.get("id") not in (None, "")
+        }
+        with transaction.atomic():
+            FacilitatorVillage.objects.filter(facilitator=self).delete()
+            FacilitatorVillage.objects.bulk_create(
+                [
+                    FacilitatorVillage(
+                        facilitator=self, administrative_id=administrative_id, name=name
+                    )
+                    for administrative_id, name in villages.items()
+                ]
+            )
+
     def get_type(self):
         if self.develop_mode and self.training_mode:
             return "develop-training"
@@ -189,3 +210,30 @@ class Facilitator(models.Model):
     class Meta:
         verbose_name = _("Facilitator")
         verbose_name_plural = _("Facilitators")
+
+
+class FacilitatorVillage(models.Model):
+    """
+    Administrative level assigned to a facilitator, a copy of the
+    administrative_levels of its facilitator document indexed by administrative_id
+    """
+
+    facilitator = models.ForeignKey(
+        Facilitator, on_delete=models.CASCADE, related_name="villages"
+    )
+    administrative_id = models.CharField(max_length=50)
+    name = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["facilitator", "administrative_id"],
+                name="unique_facilitator_village",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["administrative_id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.facilitator} {self.administrative_id}"
@@ -1,3 +1,136 @@
-# from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+
+from authentication.change_handlers import update_facilitator_villages
+from authentication.models import FacilitatorVillage
+from dashboard.diagnostics.tests import ADMINISTRATIVE_LEVELS
+from process_manager.changes import ChangeEvent
+from process_manager.enums import ChangeEventEnum
+from process_manager.tests import FakeCouchDBTestCase
+
+
+def get_villages(facilitator):
+    return sorted(
+        facilitator.villages.values_list("administrative_id", "name"),
+    )
+
+
+class TestFacilitatorVillages(FakeCouchDBTestCase):
+    def test_set_villages(self):
+        facilitator, _ = self.create_facilitator()
+        facilitator.set_villages(
+            [
+                {"id": 1, "name": "Old name"},
+                {"id": "1", "name": "Village 1"},
+                {"id": "2"},
+                {"id": ""},
+                {"name": "No id"},
+            ]
+        )
+        self.assertEqual(get_villages(facilitator), [("1", "Village 1"), ("2", "")])
+
+        facilitator.set_villages([{"id": "3", "name": "Village 3"}])
+        self.assertEqual(get_villages(facilitator), [("3", "Village 3")])
+
+    def test_change_handler(self):
+        facilitator, _ = self.create_facilitator()
+        other, _ = self.create_facilitator("other")
+        other.set_villages([{"id": "3"}])
+        events = [
+            ChangeEvent(
+                ChangeEventEnum.DOCUMENT_UPDATED,
+                facilitator.no_sql_db_name,
+                "facilitator",
+                "1-a",
+                {"type": "facilitator", "administrative_levels": [{"id": "1"}]},
+            ),
+            ChangeEvent(
+                ChangeEventEnum.DOCUMENT_UPDATED,
+                facilitator.no_sql_db_name,
+                "facilitator",
+                "2-b",
+                {"type": "facilitator", "administrative_levels": [{"id": "2"}]},
+            ),
+            ChangeEvent(
+                ChangeEventEnum.DOCUMENT_UPDATED,
+                other.no_sql_db_name,
+                "task",
+                "3-c",
+                {"type": "task", "administrative_levels": [{"id": "1"}]},
+            ),
+        ]
+        update_facilitator_villages(events)
+        # Only the latest facilitator document counts
+        self.assertEqual(get_villages(facilitator), [("2", "")])
+        self.assertEqual(get_villages(other), [("3", "")])
+
+    def test_rebuild_command(self):
+        facilitator, _ = self.create_facilitator(
+            administrative_levels=[{"id": "1", "name": "Village 1"}]
+        )
+        facilitator.set_villages([{"id": "3"}])
+        other, _ = self.create_facilitator("other")
+        other.set_villages([{"id": "2"}])
+
+        call_command("rebuild_facilitator_villages", stdout=StringIO())
+        self.assertEqual(get_villages(facilitator), [("1", "Village 1")])
+        self.assertFalse(other.villages.exists())
+
+    def test_rebuild_command_fails_without_database(self):
+        facilitator, _ = self.create_facilitator()
+        facilitator.set_villages([{"id": "1"}])
+        self.nsc.delete_db(facilitator.no_sql_db_name)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_facilitator_villages", stdout=StringIO())
+        self.assertEqual(FacilitatorVillage.objects.count(), 1)
+
+
+class TestFacilitatorListFilter(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.nsc.bulk_upsert(
+            self.nsc.get_db("administrative_levels"),
+            [
+                {
+                    "type": "administrative_level",
+                    "administrative_id": administrative_id,
+                    "parent_id": parent_id,
+                    "administrative_level": level,
+                    "name": name,
+                }
+                for administrative_id, parent_id, level, name in ADMINISTRATIVE_LEVELS
+            ],
+        )
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "", "admin")
+        )
+        first, _ = self.create_facilitator("first")
+        first.set_villages([{"id": "1"}, {"id": "2"}])
+        second, _ = self.create_facilitator("second")
+        second.set_villages([{"id": "2"}])
+        self.create_facilitator("third")
+
+    def get_usernames(self, **params):
+        response = self.client.get(
+            reverse("dashboard:facilitators:facilitators_list"), params
+        )
+        return sorted(
+            facilitator.username for facilitator in response.context["facilitators"]
+        )
+
+    def test_locality(self):
+        self.assertEqual(
+            self.get_usernames(id_region="10", type_field="region"),
+            ["first", "second"],
+        )
+        self.assertEqual(
+            self.get_usernames(id_village="1", type_field="village"), ["first"]
+        )
+
+    def test_mismatched_level(self):
+        self.assertEqual(self.get_usernames(id_region="13", type_field="region"), [])
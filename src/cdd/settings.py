@@ -70,6 +70,7 @@ THIRD_PARTY_APPS = [
 INSTALLED_APPS += CREATED_APPS + THIRD_PARTY_APPS + LOCAL_INSTALLED_APPS
 
 MIDDLEWARE = LOCAL_MIDDLEWARE + [
+    "dashboard.middleware.NoSQLInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",  # tries to determine user's language using URL language prefix
@@ -201,6 +202,40 @@ NO_SQL_PASS = env("NO_SQL_PASS")
 
 NO_SQL_URL = env("NO_SQL_URL")
 
+# Maximum number of keep-alive connections kept open to CouchDB per process
+NO_SQL_POOL_MAXSIZE = env.int("NO_SQL_POOL_MAXSIZE", 10)
+
+# Timeout in seconds for CouchDB requests (no timeout if empty)
+NO_SQL_TIMEOUT = env.float("NO_SQL_TIMEOUT", None)
+
+# Maximum number of documents and bytes sent or read in one bulk request
+NO_SQL_BULK_SIZE = env.int("NO_SQL_BULK_SIZE", 500)
+
+NO_SQL_BULK_MAX_BYTES = env.int("NO_SQL_BULK_MAX_BYTES", 4 * 1024 * 1024)
+
+# Maximum number of CouchDB requests in flight when fanning out over databases
+NO_SQL_CONCURRENCY = env.int("NO_SQL_CONCURRENCY", 10)
+
+# Log a warning when a request runs the same CouchDB selector more than this
+NO_SQL_REPEATED_QUERY_THRESHOLD = env.int("NO_SQL_REPEATED_QUERY_THRESHOLD", 10)
+
+# In-process cache of the process_design documents: maximum number of documents and
+# number of seconds between two checks of the update_seq of the database
+NO_SQL_DESIGN_CACHE_SIZE = env.int("NO_SQL_DESIGN_CACHE_SIZE", 1000)
+NO_SQL_DESIGN_CACHE_CHECK_INTERVAL = env.float(
+    "NO_SQL_DESIGN_CACHE_CHECK_INTERVAL", 5.0
+)
+
+# Outbox of the process design writes: number of attempts before a message is left
+# aside, and maximum number of seconds between two attempts
+OUTBOX_MAX_ATTEMPTS = env.int("OUTBOX_MAX_ATTEMPTS", 10)
+OUTBOX_MAX_BACKOFF = env.int("OUTBOX_MAX_BACKOFF", 600)
+
+if "debug_toolbar" in LOCAL_INSTALLED_APPS:
+    from debug_toolbar.settings import PANELS_DEFAULTS
+
+    DEBUG_TOOLBAR_PANELS = PANELS_DEFAULTS + ["dashboard.panels.NoSQLPanel"]
+
 
 REST_FRAMEWORK = {
     # https://github.com/tfranzel/drf-spectacular
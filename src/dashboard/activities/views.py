@@ -12,6 +12,8 @@ from process_manager.models import Phase, Activity, Project, Task
 from dashboard.activities.forms import ActivityForm, UpdateActivityForm
 from dashboard.mixins import AJAXRequestMixin, PageMixin, JSONResponseMixin
 from no_sql_client import NoSQLClient
+from process_manager.cache import process_design_cache
+from dashboard.propagation import enqueue_propagation, get_deletions, get_updates
 
 from authentication.permissions import (
     CDDSpecialistPermissionRequiredMixin,
@@ -133,27 +135,19 @@ def delete(request, id):
     all_task = Task.objects.filter(activity_id=activity.id).all()
     phase_id = activity.phase.id
     if request.method == "POST":
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        for task in all_task:
-            task_document = nsc_database.get_query_result({"_id": task.couch_id})[0]
-            if task_document:
-                nsc.delete_document(nsc_database, task.couch_id)
-
-        new_document = nsc_database.get_query_result({"_id": activity.couch_id})[0]
-        if new_document:
-            nsc.delete_document(nsc_database, activity.couch_id)
-            activity.delete()
-            activities = list(
-                Activity.objects.filter(phase_id=phase_id).order_by("order")
-            )
-            phase = Phase.objects.get(id=phase_id)
-
-            return render(
-                request,
-                "phases/phase_detail.html",
-                context={"phase": phase, "activities": activities},
-            )
+        deleted = get_deletions(activity, *all_task)
+        # The documents of the activity and its tasks and their copies in the
+        # facilitator databases are deleted by the outbox drainer
+        activity.delete()
+        enqueue_propagation(deleted)
+        activities = list(Activity.objects.filter(phase_id=phase_id).order_by("order"))
+        phase = Phase.objects.get(id=phase_id)
+
+        return render(
+            request,
+            "phases/phase_detail.html",
+            context={"phase": phase, "activities": activities},
+        )
 
     return render(
         request, "activities/activity_confirm_delete.html", {"activity": activity}
@@ -188,8 +182,7 @@ class UpdateActivityView(
             self.activity = self.get_object()
             self.activity_db_name = "process_design"
             self.activity_db = nsc.get_db(self.activity_db_name)
-            query_result = self.activity_db.get_query_result({"type": "activity"})[:]
-            self.doc = self.activity_db[query_result[0]["_id"]]
+            self.doc = process_design_cache.get(self.activity.couch_id)
         except Exception:
             raise Http404
         return super().dispatch(request, *args, **kwargs)
@@ -229,15 +222,6 @@ class UpdateActivityView(
         # activity.total_tasks = data['total_tasks']
         # activity.order = data['order']
         activity.save()
-        doc = {
-            "name": data["name"],
-            "description": data["description"],
-            "sql_id": activity.id,
-        }
-        nsc = NoSQLClient()
-        query_result = self.activity_db.get_query_result({"_id": activity.couch_id})[:]
-        self.doc = self.activity_db[query_result[0]["_id"]]
-        nsc.update_doc(self.activity_db, self.doc["_id"], doc)
         phase = Phase.objects.get(id=activity.phase_id)
         activities = list(
             Activity.objects.filter(phase_id=activity.phase_id).order_by("order")
@@ -284,18 +268,7 @@ def changeOrderUp(request, id):
                         activityPrev.order = activityPrev.order + 1
             activityPrev.save()
             activity.save()
-            doc = {"order": activity.order}
-            docPrev = {"order": activityPrev.order}
-            nsc = NoSQLClient()
-            activity_db = nsc.get_db("process_design")
-            query_result = activity_db.get_query_result({"_id": activity.couch_id})[:]
-            query_result_prev = activity_db.get_query_result(
-                {"_id": activityPrev.couch_id}
-            )[:]
-            docu = activity_db[query_result[0]["_id"]]
-            docPrevU = activity_db[query_result_prev[0]["_id"]]
-            nsc.update_doc(activity_db, docu["_id"], doc)
-            nsc.update_doc(activity_db, docPrevU["_id"], docPrev)
+            enqueue_propagation(updated=get_updates(activity, activityPrev))
         else:
             if activity.order > 0:
                 if activity.order == 1:
@@ -303,14 +276,7 @@ def changeOrderUp(request, id):
                 else:
                     activity.order = activity.order - 1
                     activity.save()
-                    doc = {"order": activity.order}
-                    nsc = NoSQLClient()
-                    activity_db = nsc.get_db("process_design")
-                    query_result = activity_db.get_query_result(
-                        {"_id": activity.couch_id}
-                    )[:]
-                    docu = activity_db[query_result[0]["_id"]]
-                    nsc.update_doc(activity_db, docu["_id"], doc)
+                    enqueue_propagation(updated=get_updates(activity))
 
     phase = Phase.objects.get(id=activity.phase.id)
     activities = list(Activity.objects.filter(phase_id=phase.id).order_by("order"))
@@ -338,30 +304,12 @@ def changeOrderDown(request, id):
                     activityNext.order = activityNext.order - 1
             activityNext.save()
             activity.save()
-            doc = {"order": activity.order}
-            docNext = {"order": activityNext.order}
-            nsc = NoSQLClient()
-            activity_db = nsc.get_db("process_design")
-            query_result = activity_db.get_query_result({"_id": activity.couch_id})[:]
-            query_result_next = activity_db.get_query_result(
-                {"_id": activityNext.couch_id}
-            )[:]
-            docu = activity_db[query_result[0]["_id"]]
-            docNextU = activity_db[query_result_next[0]["_id"]]
-            nsc.update_doc(activity_db, docu["_id"], doc)
-            nsc.update_doc(activity_db, docNextU["_id"], docNext)
+            enqueue_propagation(updated=get_updates(activity, activityNext))
         else:
             if activity.order < activity_count:
                 activity.order = activity.order + 1
                 activity.save()
-                doc = {"order": activity.order}
-                nsc = NoSQLClient()
-                activity_db = nsc.get_db("process_design")
-                query_result = activity_db.get_query_result({"_id": activity.couch_id})[
-                    :
-                ]
-                docu = activity_db[query_result[0]["_id"]]
-                nsc.update_doc(activity_db, docu["_id"], doc)
+                enqueue_propagation(updated=get_updates(activity))
 
     phase = Phase.objects.get(id=activity.phase.id)
     activities = list(Activity.objects.filter(phase_id=phase.id).order_by("order"))
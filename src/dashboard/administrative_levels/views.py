@@ -2,10 +2,8 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic
 
 from dashboard.mixins import AJAXRequestMixin, JSONResponseMixin
-from dashboard.utils import (
-    get_child_administrative_levels,
-    get_parent_administrative_level,
-)
+from administrativelevels.tree import administrative_level_tree
+from dashboard.utils import get_child_administrative_levels
 from no_sql_client import NoSQLClient
 
 
@@ -39,17 +37,8 @@ class GetAncestorAdministrativeLevelsView(
         administrative_id = request.GET.get("administrative_id", None)
         ancestors = []
         if administrative_id:
-            nsc = NoSQLClient()
-            administrative_levels_db = nsc.get_db("administrative_levels")
-            has_parent = True
-            while has_parent:
-                parent = get_parent_administrative_level(
-                    administrative_levels_db, administrative_id
-                )
-                if parent:
-                    administrative_id = parent["administrative_id"]
-                    ancestors.insert(0, administrative_id)
-                else:
-                    has_parent = False
+            ancestors = administrative_level_tree.get().get_ancestor_ids(
+                administrative_id
+            )
 
         return self.render_to_json_response(ancestors, safe=False)
@@ -0,0 +1,156 @@
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from process_manager.models import Task, TaskProgress
+from process_manager.tests import FakeCouchDBTestCase
+
+# Region 10 > prefecture 11 > commune 12 > canton 13 > villages 1, 2 and 3
+ADMINISTRATIVE_LEVELS = [
+    ("10", None, "Region", "SAVANES"),
+    ("11", "10", "Prefecture", "Prefecture"),
+    ("12", "11", "Commune", "Commune"),
+    ("13", "12", "Canton", "Canton"),
+    ("1", "13", "Village", "Village 1"),
+    ("2", "13", "Village", "Village 2"),
+    ("3", "13", "Village", "Village 3"),
+]
+
+
+class DiagnosticsTestCase(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.nsc.bulk_upsert(
+            self.nsc.get_db("administrative_levels"),
+            [
+                {
+                    "type": "administrative_level",
+                    "administrative_id": administrative_id,
+                    "parent_id": parent_id,
+                    "administrative_level": level,
+                    "name": name,
+                }
+                for administrative_id, parent_id, level, name in ADMINISTRATIVE_LEVELS
+            ],
+        )
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "", "admin")
+        )
+        self.create_process(tasks=2)
+        self.tasks = list(Task.objects.order_by("id"))
+
+    def create_progress(self, facilitator, village_id, task, completed=0):
+        return TaskProgress.objects.create(
+            facilitator=facilitator,
+            village_id=village_id,
+            canton_id="13",
+            commune_id="12",
+            prefecture_id="11",
+            region_id="10",
+            project=task.project,
+            phase=task.phase,
+            activity=task.activity,
+            task=task,
+            doc_id=f"{facilitator.id}:{village_id}:{task.id}",
+            completed=completed,
+        )
+
+    def get(self, url, **params):
+        return self.client.get(url, params, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+
+
+class TestLocalityTotals(DiagnosticsTestCase):
+    def setUp(self):
+        super().setUp()
+        first, _ = self.create_facilitator("first")
+        first.set_villages([{"id": "1"}, {"id": "2"}])
+        second, _ = self.create_facilitator("second")
+        second.set_villages([{"id": "1"}])
+        for i, task in enumerate(self.tasks):
+            self.create_progress(first, "1", task, completed=i)
+        self.create_progress(second, "1", self.tasks[0])
+        # Left in a village taken away from the facilitator
+        self.create_progress(first, "3", self.tasks[0], completed=1)
+
+    def test_locality(self):
+        response = self.get(
+            reverse("dashboard:diagnostics:get_tasks_diagnostics_view"),
+            type="region",
+            sql_id="10",
+        )
+        data = response.json()
+        self.assertEqual(
+            [
+                data[field]
+                for field in (
+                    "nbr_tasks",
+                    "nbr_tasks_completed",
+                    "nbr_facilitators",
+                    "nbr_villages",
+                    "region",
+                )
+            ],
+            [3, 1, 2, 3, "SAVANES"],
+        )
+
+    def test_village_without_tasks(self):
+        data = self.get(
+            reverse("dashboard:diagnostics:get_tasks_diagnostics_view"),
+            type="village",
+            sql_id="2",
+        ).json()
+        self.assertEqual(
+            (data["nbr_tasks"], data["nbr_facilitators"], data["nbr_villages"]),
+            (0, 1, 1),
+        )
+
+    def test_totals(self):
+        data = self.get(
+            reverse("dashboard:diagnostics:get_tasks_diagnostics_totals")
+        ).json()
+        self.assertEqual(data["levels"]["region"], {"10": [3, 1, 2, 3, "10"]})
+        self.assertEqual(data["levels"]["canton"], {"13": [3, 1, 2, 3, "10"]})
+        self.assertEqual(
+            data["levels"]["village"],
+            {"1": [3, 1, 2, 2, "10"], "2": [0, 0, 1, 1, "10"]},
+        )
+        self.assertEqual(data["regions"], {"10": "SAVANES"})
+
+
+class TestTasksDiagnosticsTotalsView(DiagnosticsTestCase):
+    url = reverse("dashboard:diagnostics:get_tasks_diagnostics_totals")
+
+    def setUp(self):
+        super().setUp()
+        self.facilitator, _ = self.create_facilitator()
+        self.facilitator.set_villages([{"id": "1"}])
+        self.progress = self.create_progress(self.facilitator, "1", self.tasks[0])
+
+    def get_with_etag(self, etag):
+        return self.client.get(
+            self.url, HTTP_X_REQUESTED_WITH="XMLHttpRequest", HTTP_IF_NONE_MATCH=etag
+        )
+
+    def test_not_modified(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        response = self.get_with_etag(response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_progress_modified(self):
+        etag = self.get(self.url)["ETag"]
+        TaskProgress.objects.filter(id=self.progress.id).update(completed=1)
+
+        response = self.get_with_etag(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_villages_modified(self):
+        etag = self.get(self.url)["ETag"]
+        self.facilitator.set_villages([{"id": "1"}, {"id": "2"}])
+
+        response = self.get_with_etag(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["levels"]["village"]["2"][3], 1)
@@ -10,4 +10,9 @@ urlpatterns = [
         views.GetTasksDiagnosticsView.as_view(),
         name="get_tasks_diagnostics_view",
     ),
+    path(
+        "get-tasks-diagnostics-totals",
+        views.GetTasksDiagnosticsTotalsView.as_view(),
+        name="get_tasks_diagnostics_totals",
+    ),
 ]
@@ -1,3 +1,5 @@
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import FormView, View as GenericView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from dashboard.mixins import PageMixin, AJAXRequestMixin, JSONResponseMixin
@@ -9,12 +11,36 @@ from dashboard.utils import (
     get_parent_administrative_level,
     get_documents_by_type,
     get_administrative_levels_by_type,
-    get_region_of_village_by_sql_id,
-    get_all_docs_administrative_levels_by_type_and_administrative_id,
-    get_all_docs_administrative_levels_by_type_and_parent_id,
 )
-from no_sql_client import NoSQLClient
-from authentication.models import Facilitator
+from dashboard.task_progress import (
+    get_administrative_level_names,
+    get_locality_total,
+    get_locality_totals,
+    get_task_progress_version,
+)
+from django.db.models import Count, Sum
+from authentication.models import FacilitatorVillage
+from process_manager.models import TaskProgress
+
+
+def get_deploy_task_progress():
+    return TaskProgress.objects.filter(
+        facilitator__develop_mode=False, facilitator__training_mode=False
+    )
+
+
+def get_deploy_villages():
+    return FacilitatorVillage.objects.filter(
+        facilitator__develop_mode=False, facilitator__training_mode=False
+    )
+
+
+def get_task_progress_etag(request, *args, **kwargs):
+    # Kept on the request for the view, which is only run without a match
+    request.task_progress_version = get_task_progress_version(
+        get_deploy_task_progress(), get_deploy_villages()
+    )
+    return request.task_progress_version
 
 
 class DashboardDiagnosticsCDDView(PageMixin, LoginRequiredMixin, FormView):
@@ -62,287 +88,114 @@ class DashboardDiagnosticsCDDView(PageMixin, LoginRequiredMixin, FormView):
             template=self.get_template_names(),
             context=context,
             using=self.template_engine,
-            **response_kwargs
+            **response_kwargs,
         )
 
 
 class GetTasksDiagnosticsView(
     AJAXRequestMixin, LoginRequiredMixin, JSONResponseMixin, GenericView
 ):
+    """
+    Progress of the tasks of an administrative level, or of a phase, activity or
+    task by region, added up from the TaskProgress and FacilitatorVillage rows of
+    the facilitators in deploy mode (see dashboard.task_progress)
+    """
+
+    locality_types = ["region", "prefecture", "commune", "canton", "village"]
+    regions = ["SAVANES", "KARA", "CENTRALE"]
+
+    @staticmethod
+    def get_percentage(nbr_tasks_completed, nbr_tasks):
+        return ((nbr_tasks_completed / nbr_tasks) * 100) if nbr_tasks else 0
+
     def get(self, request, *args, **kwargs):
         _type = request.GET.get("type")
-        type_header = _type
         sql_id = request.GET.get("sql_id")
         if not sql_id:
             raise Exception("The value of the element must be not null!!!")
-        nsc = NoSQLClient()
-        administrative_levels_db = nsc.get_db("administrative_levels")
-        print("")
-        print("NEW")
-        liste_villages = []
-        nbr_tasks = 0
-        nbr_tasks_completed = 0
-        percentage_tasks_completed = 0
-        nbr_facilitators = 0
-        nbr_villages = 0
-        search_by_locality = False
-        already_count_facilitator = False
-        _region = None
+        progress = get_deploy_task_progress()
+
+        if _type in self.locality_types:
+            totals = get_locality_total(progress, get_deploy_villages(), _type, sql_id)
+            region_id = totals.pop("region_id")
+            region = get_administrative_level_names(
+                {region_id} if region_id else set()
+            ).get(region_id)
+            return self.render_to_json_response(
+                {
+                    "type": _type.title(),
+                    **totals,
+                    "percentage_tasks_completed": self.get_percentage(
+                        totals["nbr_tasks_completed"], totals["nbr_tasks"]
+                    ),
+                    "region": region,
+                    "search_by_locality": True,
+                },
+                safe=False,
+            )
+
         regions = {
-            "SAVANES": {
-                "nbr_tasks": 0,
-                "nbr_tasks_completed": 0,
-                "percentage_tasks_completed": 0,
-            },
-            "KARA": {
+            name: {
                 "nbr_tasks": 0,
                 "nbr_tasks_completed": 0,
                 "percentage_tasks_completed": 0,
-            },
-            "CENTRALE": {
-                "nbr_tasks": 0,
-                "nbr_tasks_completed": 0,
-                "percentage_tasks_completed": 0,
-            },
+            }
+            for name in self.regions
         }
-
-        if _type in ["region", "prefecture", "commune", "canton", "village"]:
-            search_by_locality = True
-            liste_prefectures = []
-            liste_communes = []
-            liste_cantons = []
-            administrative_levels = administrative_levels_db.all_docs(
-                include_docs=True
-            )["rows"]
-
-            if _type == "region":
-                region = (
-                    get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), sql_id
-                    )
-                )
-                region = region[:][0]
-                _type = "prefecture"
-                liste_prefectures = (
-                    get_all_docs_administrative_levels_by_type_and_parent_id(
-                        administrative_levels,
-                        _type.title(),
-                        region["administrative_id"],
-                    )[:]
-                )
-
-            if _type == "prefecture":
-                if not liste_prefectures:
-                    liste_prefectures = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), sql_id
-                    )[
-                        :
-                    ]
-                _type = "commune"
-                for prefecture in liste_prefectures:
-                    [
-                        liste_communes.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            prefecture["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "commune":
-                if not liste_communes:
-                    liste_communes = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), sql_id
-                    )[
-                        :
-                    ]
-                _type = "canton"
-                for commune in liste_communes:
-                    [
-                        liste_cantons.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            commune["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "canton":
-                if not liste_cantons:
-                    liste_cantons = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), sql_id
-                    )[
-                        :
-                    ]
-                _type = "village"
-                for canton in liste_cantons:
-                    [
-                        liste_villages.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            canton["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "village":
-                if not liste_villages:
-                    liste_villages = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), sql_id
-                    )[
-                        :
-                    ]
-
-            for f in Facilitator.objects.filter(
-                develop_mode=False, training_mode=False
-            ):
-                already_count_facilitator = False
-                facilitator_db = nsc.get_db(f.no_sql_db_name)
-                query_result = facilitator_db.get_query_result(
-                    {
-                        "type": "facilitator"  # , "develop_mode": False, "training_mode": False
-                    }
-                )[:]
-                if query_result:
-                    doc = query_result[0]
-                    for _village in doc["administrative_levels"]:
-                        if str(
-                            _village["id"]
-                        ).isdigit():  # Verify if id contain only digit
-                            for village in liste_villages:
-                                if str(_village["id"]) == str(
-                                    village["administrative_id"]
-                                ):  # _village['name'] == village['name'] and
-                                    nbr_villages += 1
-                                    if not already_count_facilitator:
-                                        nbr_facilitators += 1
-                                        already_count_facilitator = True
-
-                                    for _task in facilitator_db.all_docs(
-                                        include_docs=True
-                                    )["rows"]:
-                                        _task = _task.get("doc")
-                                        if _task.get("type") == "task" and str(
-                                            _task.get("administrative_level_id")
-                                        ) == str(_village["id"]):
-                                            if _task["completed"]:
-                                                nbr_tasks_completed += 1
-                                            nbr_tasks += 1
-
-            # nbr_villages = len(liste_villages)
-            if nbr_villages > 0:
-                _region = get_region_of_village_by_sql_id(
-                    administrative_levels_db, liste_villages[0]["administrative_id"]
+        nbr_facilitators = 0
+        if _type in ("phase", "activity", "task"):
+            progress = progress.filter(**{f"{_type}_id": int(sql_id)})
+            by_region = list(
+                progress.values("region_id").annotate(
+                    nbr_tasks=Sum("total"), nbr_tasks_completed=Sum("completed")
                 )
-
-            percentage_tasks_completed = (
-                ((nbr_tasks_completed / nbr_tasks) * 100) if nbr_tasks else 0
             )
-
-        elif _type in ["phase", "activity", "task"]:
-            if _type in ("phase", "activity"):
-                for f in Facilitator.objects.filter(
-                    develop_mode=False, training_mode=False
-                ):
-                    already_count_facilitator = False
-                    facilitator_db = nsc.get_db(f.no_sql_db_name)
-                    query_result = facilitator_db.get_query_result(
-                        {"type": _type, "sql_id": int(sql_id)}
-                    )[:]
-                    if query_result:
-                        for _task in facilitator_db.all_docs(include_docs=True)["rows"]:
-                            _task = _task.get("doc")
-                            if (
-                                _task.get("type") == "task"
-                                and _task.get((str(type_header) + "_id"))
-                                == query_result[0]["_id"]
-                            ):
-                                if str(_task["administrative_level_id"]).isdigit():
-                                    if not already_count_facilitator:
-                                        nbr_facilitators += 1
-                                        already_count_facilitator = True
-
-                                    _region = get_region_of_village_by_sql_id(
-                                        administrative_levels_db,
-                                        _task["administrative_level_id"],
-                                    )
-                                    if _region:
-                                        _region_name = _region["name"]
-                                        if regions.get(_region_name):
-                                            if _task["completed"]:
-                                                regions[_region_name][
-                                                    "nbr_tasks_completed"
-                                                ] += 1
-                                            regions[_region_name]["nbr_tasks"] += 1
-
-            elif _type == "task":
-                for f in Facilitator.objects.filter(
-                    develop_mode=False, training_mode=False
-                ):
-                    already_count_facilitator = False
-                    facilitator_db = nsc.get_db(f.no_sql_db_name)
-                    _tasks = facilitator_db.get_query_result(
-                        {"type": "task", "sql_id": int(sql_id)}
-                    )[:]
-                    for _task in _tasks:
-                        if str(_task["administrative_level_id"]).isdigit():
-                            if not already_count_facilitator:
-                                nbr_facilitators += 1
-                                already_count_facilitator = True
-
-                            _region = get_region_of_village_by_sql_id(
-                                administrative_levels_db,
-                                _task["administrative_level_id"],
-                            )
-                            if _region:
-                                _region_name = _region["name"]
-                                if regions.get(_region_name):
-                                    if _task["completed"]:
-                                        regions[_region_name][
-                                            "nbr_tasks_completed"
-                                        ] += 1
-                                    regions[_region_name]["nbr_tasks"] += 1
-
-            for region, values in regions.items():
-                regions[region]["percentage_tasks_completed"] = (
-                    (
-                        (
-                            regions[region]["nbr_tasks_completed"]
-                            / regions[region]["nbr_tasks"]
-                        )
-                        * 100
-                    )
-                    if regions[region]["nbr_tasks"]
-                    else 0
-                )
-
-        if search_by_locality:
-            return self.render_to_json_response(
-                {
-                    "type": type_header.title(),
-                    "nbr_tasks": nbr_tasks,
-                    "nbr_tasks_completed": nbr_tasks_completed,
-                    "percentage_tasks_completed": percentage_tasks_completed,
-                    "region": _region["name"] if _region else None,
-                    "search_by_locality": search_by_locality,
-                    "nbr_facilitators": nbr_facilitators,
-                    "nbr_villages": nbr_villages,
-                },
-                safe=False,
+            names = get_administrative_level_names(
+                {row["region_id"] for row in by_region if row["region_id"]}
             )
+            for row in by_region:
+                region = regions.get(names.get(row["region_id"]))
+                if region:
+                    region["nbr_tasks"] += row["nbr_tasks"]
+                    region["nbr_tasks_completed"] += row["nbr_tasks_completed"]
+            for region in regions.values():
+                region["percentage_tasks_completed"] = self.get_percentage(
+                    region["nbr_tasks_completed"], region["nbr_tasks"]
+                )
+            nbr_facilitators = progress.aggregate(
+                nbr_facilitators=Count("facilitator", distinct=True)
+            )["nbr_facilitators"]
 
         return self.render_to_json_response(
             {
-                "type": type_header,
+                "type": _type,
                 "regions": regions,
-                "search_by_locality": search_by_locality,
+                "search_by_locality": False,
                 "nbr_facilitators": nbr_facilitators,
             },
             safe=False,
         )
+
+
+@method_decorator(condition(etag_func=get_task_progress_etag), name="get")
+class GetTasksDiagnosticsTotalsView(
+    AJAXRequestMixin, LoginRequiredMixin, JSONResponseMixin, GenericView
+):
+    """
+    Progress of the tasks of every administrative level at once, for the map to
+    answer the localities without a request each. The ETag is the version of the
+    TaskProgress rows, so a map loaded again gets a 304 until they change.
+    """
+
+    def get(self, request, *args, **kwargs):
+        response = self.render_to_json_response(
+            get_locality_totals(
+                get_deploy_task_progress(),
+                get_deploy_villages(),
+                request.task_progress_version,
+            ),
+            safe=False,
+        )
+        # Cached by the browser, but checked again with If-None-Match every time
+        response["Cache-Control"] = "private, no-cache"
+        return response
@@ -1,3 +1,6 @@
+import asyncio
+import itertools
+
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import Http404
@@ -9,6 +12,7 @@ from django.views import generic
 from datetime import datetime
 
 from process_manager.models import Phase, Activity
+from administrativelevels.tree import administrative_level_tree
 from authentication.models import Facilitator
 from dashboard.facilitators.forms import (
     FacilitatorForm,
@@ -17,11 +21,11 @@ from dashboard.facilitators.forms import (
     FilterFacilitatorForm,
 )
 from dashboard.mixins import AJAXRequestMixin, PageMixin, JSONResponseMixin
+from dashboard.sync_runner import onboard_villages
 from no_sql_client import NoSQLClient
-from dashboard.utils import (
-    get_all_docs_administrative_levels_by_type_and_administrative_id,
-    get_all_docs_administrative_levels_by_type_and_parent_id,
-)
+from no_sql_async_client import AsyncNoSQLClient, gather
+from no_sql_views import get_percentage, get_task_completion
+from process_manager.outbox import flush
 from authentication.permissions import (
     CDDSpecialistPermissionRequiredMixin,
     SuperAdminPermissionRequiredMixin,
@@ -101,121 +105,34 @@ class FacilitatorListTableView(LoginRequiredMixin, generic.ListView):
             elif id_village and type_field == "village":
                 _type = "village"
 
-            nsc = NoSQLClient()
-
-            liste_prefectures = []
-            liste_communes = []
-            liste_cantons = []
-            liste_villages = []
-            administrative_levels = nsc.get_db("administrative_levels").all_docs(
-                include_docs=True
-            )["rows"]
-
-            if _type == "region":
-                region = (
-                    get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), id_region
-                    )
-                )
-                region = region[:][0]
-                _type = "prefecture"
-                liste_prefectures = (
-                    get_all_docs_administrative_levels_by_type_and_parent_id(
-                        administrative_levels,
-                        _type.title(),
-                        region["administrative_id"],
-                    )[:]
-                )
-
-            if _type == "prefecture":
-                if not liste_prefectures:
-                    liste_prefectures = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), id_prefecture
-                    )[
-                        :
-                    ]
-                _type = "commune"
-                for prefecture in liste_prefectures:
-                    [
-                        liste_communes.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            prefecture["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "commune":
-                if not liste_communes:
-                    liste_communes = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), id_commune
-                    )[
-                        :
-                    ]
-                _type = "canton"
-                for commune in liste_communes:
-                    [
-                        liste_cantons.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            commune["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "canton":
-                if not liste_cantons:
-                    liste_cantons = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), id_canton
-                    )[
-                        :
-                    ]
-                _type = "village"
-                for canton in liste_cantons:
-                    [
-                        liste_villages.append(elt)
-                        for elt in get_all_docs_administrative_levels_by_type_and_parent_id(
-                            administrative_levels,
-                            _type.title(),
-                            canton["administrative_id"],
-                        )[
-                            :
-                        ]
-                    ]
-
-            if _type == "village":
-                if not liste_villages:
-                    liste_villages = get_all_docs_administrative_levels_by_type_and_administrative_id(
-                        administrative_levels, _type.title(), id_village
-                    )[
-                        :
-                    ]
-
-            for f in Facilitator.objects.filter(
-                develop_mode=False, training_mode=False
+            selected_id = {
+                "region": id_region,
+                "prefecture": id_prefecture,
+                "commune": id_commune,
+                "canton": id_canton,
+                "village": id_village,
+            }.get(_type)
+            tree = administrative_level_tree.get()
+            selected = tree.get(selected_id) if selected_id else None
+            village_ids = set()
+            if (
+                selected
+                and str(selected.get("administrative_level", "")).lower() == _type
             ):
-                already_count_facilitator = False
-                facilitator_db = nsc.get_db(f.no_sql_db_name)
-                query_result = facilitator_db.get_query_result({"type": "facilitator"})[
-                    :
-                ]
-                if query_result:
-                    doc = query_result[0]
-                    for _village in doc["administrative_levels"]:
-                        if str(
-                            _village["id"]
-                        ).isdigit():  # Verify if id contain only digit
-                            for village in liste_villages:
-                                if str(_village["id"]) == str(
-                                    village["administrative_id"]
-                                ):
-                                    if not already_count_facilitator:
-                                        facilitators.append(f)
-                                        already_count_facilitator = True
+                village_ids = {
+                    str(village["administrative_id"])
+                    for village in tree.get_descendants(
+                        selected_id, "Village", include_self=True
+                    )
+                }
+
+            facilitators = list(
+                Facilitator.objects.filter(
+                    develop_mode=False,
+                    training_mode=False,
+                    villages__administrative_id__in=village_ids,
+                ).distinct()
+            )
         else:
             # facilitators = list(Facilitator.objects.all())
             is_training = bool(self.request.GET.get("is_training", "False") == "True")
@@ -239,30 +156,14 @@ class FacilitatorsPercentListView(
     template_name = "facilitators/facilitator_percent_completed.html"
     context_object_name = "facilitator_percent_completed"
 
-    def get_results(self):
-        return self.facilitator_db.get_query_result({"type": "task"})
-
     def get_queryset(self):
         return []
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        total_tasks_completed = 0
-        total_tasks_uncompleted = 0
-        total_tasks = 0
-
-        object_list = self.get_results()
-
-        if object_list:
-            for _ in object_list:
-                if _.get("completed"):
-                    total_tasks_completed += 1
-                else:
-                    total_tasks_uncompleted += 1
-                total_tasks += 1
-
-        context["percentage_tasks_completed"] = (
-            ((total_tasks_completed / total_tasks) * 100) if total_tasks else 0
+        completion = get_task_completion(NoSQLClient(), self.facilitator_db)
+        context["percentage_tasks_completed"] = get_percentage(
+            completion.get((), [0, 0])
         )
 
         return context
@@ -273,28 +174,25 @@ class FacilitatorsPercentView(
 ):
     def post(self, request, *args, **kwargs):
         liste = request.POST.getlist("liste[]")
-        d = {}
-
-        nsc = NoSQLClient()
-        for f in liste:
-            facilitator_db = nsc.get_db(f)
-            docs = facilitator_db.get_query_result({"type": "task"})
-
-            total_tasks_completed = 0
-            total_tasks_uncompleted = 0
-            total_tasks = 0
-            if docs:
-                for _ in docs:
-                    if _.get("completed"):
-                        total_tasks_completed += 1
-                    else:
-                        total_tasks_uncompleted += 1
-                    total_tasks += 1
-
-            d[f] = ((total_tasks_completed / total_tasks) * 100) if total_tasks else 0
+        d = dict(zip(liste, asyncio.run(self.get_percentages(liste))))
 
         return self.render_to_json_response(d, safe=False)
 
+    @staticmethod
+    async def get_percentages(facilitator_db_names):
+        anc = AsyncNoSQLClient()
+
+        async def get_facilitator_percentage(facilitator_db_name):
+            facilitator_db = await anc.get_db(facilitator_db_name)
+            completion = await asyncio.to_thread(
+                get_task_completion, anc.nsc, facilitator_db
+            )
+            return get_percentage(completion.get((), [0, 0]))
+
+        return await gather(
+            *[get_facilitator_percentage(f) for f in facilitator_db_names]
+        )
+
 
 class FacilitatorDetailView(
     FacilitatorMixin, PageMixin, LoginRequiredMixin, generic.DetailView
@@ -453,77 +351,67 @@ class FacilitatorTaskListView(
             ),
         )[index : index + offset]
 
+    def get_completion(self):
+        """
+        Return [tasks, completed tasks] by key of the task_completion view, for
+        the tasks matching the filters of the request
+        """
+        filters = [
+            self.request.GET.get("administrative_level"),
+            self.request.GET.get("phase"),
+            self.request.GET.get("activity"),
+            self.request.GET.get("task"),
+        ]
+        # The leading filters select a range of keys, the others are checked on the
+        # rows of every task
+        prefix = list(itertools.takewhile(bool, filters))
+        params = {"startkey": prefix, "endkey": prefix + [{}]} if prefix else {}
+        group_level = 4 if any(filters[len(prefix) :]) else 1
+        completion = get_task_completion(
+            NoSQLClient(), self.facilitator_db, group_level, **params
+        )
+        return {
+            key: value
+            for key, value in completion.items()
+            if all(not f or i >= len(key) or key[i] == f for i, f in enumerate(filters))
+        }
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        total_tasks_completed = 0
-        total_tasks_uncompleted = 0
         total_tasks = 0
+        total_tasks_completed = 0
         dict_administrative_levels_with_infos = {}
 
-        object_list = self.get_results()
-        administrative_levels = self.facilitator_db.get_query_result(
-            {"type": "facilitator"}
-        )[:][0]["administrative_levels"]
-
-        if object_list:
-            for _ in object_list:
-                if _.get("completed"):
-                    total_tasks_completed += 1
-                else:
-                    total_tasks_uncompleted += 1
-                total_tasks += 1
-
-                for administrative_level in administrative_levels:
-                    if str(administrative_level.get("id")) == str(
-                        _.get("administrative_level_id")
-                    ):
-                        if dict_administrative_levels_with_infos.get(
-                            administrative_level.get("name")
-                        ):
-                            if _.get("completed"):
-                                dict_administrative_levels_with_infos[
-                                    administrative_level.get("name")
-                                ]["total_tasks_completed"] += 1
-                            else:
-                                dict_administrative_levels_with_infos[
-                                    administrative_level.get("name")
-                                ]["total_tasks_uncompleted"] += 1
-                            dict_administrative_levels_with_infos[
-                                administrative_level.get("name")
-                            ]["total_tasks"] += 1
-                        else:
-                            if _.get("completed"):
-                                dict_administrative_levels_with_infos[
-                                    administrative_level.get("name")
-                                ] = {
-                                    "total_tasks_completed": 1,
-                                    "total_tasks_uncompleted": 0,
-                                }
-                            else:
-                                dict_administrative_levels_with_infos[
-                                    administrative_level.get("name")
-                                ] = {
-                                    "total_tasks_completed": 0,
-                                    "total_tasks_uncompleted": 1,
-                                }
-                            dict_administrative_levels_with_infos[
-                                administrative_level.get("name")
-                            ]["total_tasks"] = 1
+        names = {
+            str(administrative_level.get("id")): administrative_level.get("name")
+            for administrative_level in self.doc["administrative_levels"]
+        }
+        for key, (tasks, completed) in self.get_completion().items():
+            total_tasks += tasks
+            total_tasks_completed += completed
+            if key[0] not in names:
+                continue
+            infos = dict_administrative_levels_with_infos.setdefault(
+                names[key[0]],
+                {"total_tasks_completed": 0, "total_tasks_uncompleted": 0},
+            )
+            infos["total_tasks_completed"] += completed
+            infos["total_tasks_uncompleted"] += tasks - completed
 
         context["total_tasks_completed"] = total_tasks_completed
-        context["total_tasks_uncompleted"] = total_tasks_uncompleted
+        context["total_tasks_uncompleted"] = total_tasks - total_tasks_completed
         context["total_tasks"] = total_tasks
-        context["percentage_tasks_completed"] = (
-            ((total_tasks_completed / total_tasks) * 100) if total_tasks else 0
+        context["percentage_tasks_completed"] = get_percentage(
+            [total_tasks, total_tasks_completed]
         )
 
-        for key, value in dict_administrative_levels_with_infos.items():
-            dict_administrative_levels_with_infos[key]["percentage_tasks_completed"] = (
-                ((value["total_tasks_completed"] / value["total_tasks"]) * 100)
-                if value["total_tasks"]
-                else 0
+        for value in dict_administrative_levels_with_infos.values():
+            value["percentage_tasks_completed"] = get_percentage(
+                [
+                    value["total_tasks_completed"] + value["total_tasks_uncompleted"],
+                    value["total_tasks_completed"],
+                ]
             )
-            del dict_administrative_levels_with_infos[key]["total_tasks"]
         context[
             "dict_administrative_levels_with_infos"
         ] = dict_administrative_levels_with_infos
@@ -562,9 +450,16 @@ class CreateFacilitatorFormView(
             "administrative_levels": data["administrative_levels"],
             "type": "facilitator",
         }
-        nsc = NoSQLClient()
-        facilitator_database = nsc.get_db(facilitator.no_sql_db_name)
-        nsc.create_document(facilitator_database, doc)
+        # The design documents of the rows saved since the last drain must exist
+        # first
+        flush()
+        # The facilitator document and the tasks of its villages in one write
+        created, errors = onboard_villages(
+            facilitator, data["administrative_levels"], doc
+        )
+        for error in errors:
+            print(facilitator.no_sql_db_name, error)
+        facilitator.set_villages(data["administrative_levels"])
         return super().form_valid(form)
 
 
@@ -655,4 +550,22 @@ class UpdateFacilitatorView(
         }
         nsc = NoSQLClient()
         nsc.update_doc(self.facilitator_db, self.doc["_id"], doc)
+        self.facilitator.set_villages(_administrative_levels)
+        known = {
+            str(administrative_level.get("id"))
+            for administrative_level in self.doc.get("administrative_levels", [])
+        }
+        # The design documents of the rows saved since the last drain must exist
+        # first
+        flush()
+        created, errors = onboard_villages(
+            self.facilitator,
+            [
+                administrative_level
+                for administrative_level in _administrative_levels
+                if str(administrative_level.get("id")) not in known
+            ],
+        )
+        for error in errors:
+            print(self.facilitator_db_name, error)
         return redirect("dashboard:facilitators:list")
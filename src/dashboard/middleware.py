@@ -0,0 +1,38 @@
+import logging
+
+from django.conf import settings
+
+from no_sql_instrumentation import collect_no_sql_requests
+
+logger = logging.getLogger(__name__)
+
+
+class NoSQLInstrumentationMiddleware:
+    """
+    Collect the CouchDB requests made while handling a request, report them in the
+    Server-Timing header and warn about the selectors run over and over (N+1 queries)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_no_sql_requests() as collector:
+            request.no_sql_requests = collector
+            response = self.get_response(request)
+
+        if collector.count:
+            timing = f'couchdb;dur={collector.duration:.1f};desc="{collector.count} requests"'
+            if response.has_header("Server-Timing"):
+                timing = f'{response["Server-Timing"]}, {timing}'
+            response["Server-Timing"] = timing
+
+        for stat in collector.repeated_shapes(settings.NO_SQL_REPEATED_QUERY_THRESHOLD):
+            logger.warning(
+                "%s: %s CouchDB requests with the same shape on %s: %s",
+                request.path,
+                stat["count"],
+                stat["db"],
+                stat["shape"],
+            )
+        return response
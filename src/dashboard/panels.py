@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from debug_toolbar.panels import Panel
+
+
+class NoSQLPanel(Panel):
+    """
+    Panel listing the CouchDB requests collected by NoSQLInstrumentationMiddleware
+    """
+
+    title = _("CouchDB")
+    template = "debug_toolbar/panels/no_sql.html"
+
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        return _("%(count)d requests in %(duration)0.2fms") % {
+            "count": stats.get("count", 0),
+            "duration": stats.get("duration", 0),
+        }
+
+    def generate_stats(self, request, response):
+        collector = getattr(request, "no_sql_requests", None)
+        if collector is None:
+            return
+        self.record_stats(
+            {
+                "count": collector.count,
+                "duration": collector.duration,
+                "bytes": collector.bytes,
+                "calls": collector.calls,
+                "shapes": collector.by_shape(),
+                "threshold": settings.NO_SQL_REPEATED_QUERY_THRESHOLD,
+            }
+        )
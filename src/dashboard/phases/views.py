@@ -12,6 +12,8 @@ from process_manager.models import Phase, Project, Activity, Task
 from dashboard.phases.forms import PhaseForm, UpdatePhaseForm
 from dashboard.mixins import AJAXRequestMixin, PageMixin, JSONResponseMixin
 from no_sql_client import NoSQLClient
+from process_manager.cache import process_design_cache
+from dashboard.propagation import enqueue_propagation, get_deletions, get_updates
 
 from authentication.permissions import (
     CDDSpecialistPermissionRequiredMixin,
@@ -85,23 +87,15 @@ def delete(request, id):
     phase = Phase.objects.get(id=id)
     all_activity = Activity.objects.filter(phase_id=phase.id).all()
     if request.method == "POST":
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        for act in all_activity:
-            all_task = Task.objects.filter(activity_id=act.id).all()
-            for tas in all_task:
-                task_document = nsc_database.get_query_result({"_id": tas.couch_id})[0]
-                if task_document:
-                    nsc.delete_document(nsc_database, tas.couch_id)
-            actvity_document = nsc_database.get_query_result({"_id": act.couch_id})[0]
-            if actvity_document:
-                nsc.delete_document(nsc_database, act.couch_id)
-        del_document = nsc_database.get_query_result({"_id": phase.couch_id})[0]
-        if del_document:
-            nsc.delete_document(nsc_database, phase.couch_id)
-            phase.delete()
-
-            return redirect("dashboard:phases:list")
+        deleted = get_deletions(
+            phase, *all_activity, *Task.objects.filter(phase_id=phase.id)
+        )
+        # The documents of the phase, its activities and tasks and their copies in
+        # the facilitator databases are deleted by the outbox drainer
+        phase.delete()
+        enqueue_propagation(deleted)
+
+        return redirect("dashboard:phases:list")
 
     return render(request, "phases/phase_confirm_delete.html", {"phase": phase})
 
@@ -123,18 +117,7 @@ def changeOrderUp(request, id):
                         phasePrev.order = phasePrev.order + 1
             phasePrev.save()
             phase.save()
-            doc = {"order": phase.order}
-            docPrev = {"order": phasePrev.order}
-            nsc = NoSQLClient()
-            phase_db = nsc.get_db("process_design")
-            query_result = phase_db.get_query_result({"_id": phase.couch_id})[:]
-            query_result_prev = phase_db.get_query_result({"_id": phasePrev.couch_id})[
-                :
-            ]
-            docu = phase_db[query_result[0]["_id"]]
-            docPrevU = phase_db[query_result_prev[0]["_id"]]
-            nsc.update_doc(phase_db, docu["_id"], doc)
-            nsc.update_doc(phase_db, docPrevU["_id"], docPrev)
+            enqueue_propagation(updated=get_updates(phase, phasePrev))
         else:
             if phase.order > 0:
                 if phase.order == 1:
@@ -142,12 +125,7 @@ def changeOrderUp(request, id):
                 else:
                     phase.order = phase.order - 1
                     phase.save()
-                    doc = {"order": phase.order}
-                    nsc = NoSQLClient()
-                    phase_db = nsc.get_db("process_design")
-                    query_result = phase_db.get_query_result({"_id": phase.couch_id})[:]
-                    docu = phase_db[query_result[0]["_id"]]
-                    nsc.update_doc(phase_db, docu["_id"], doc)
+                    enqueue_propagation(updated=get_updates(phase))
     return redirect("dashboard:phases:list")
 
 
@@ -168,28 +146,12 @@ def changeOrderDown(request, id):
                     phaseNext.order = phaseNext.order - 1
             phaseNext.save()
             phase.save()
-            doc = {"order": phase.order}
-            docNext = {"order": phaseNext.order}
-            nsc = NoSQLClient()
-            phase_db = nsc.get_db("process_design")
-            query_result = phase_db.get_query_result({"_id": phase.couch_id})[:]
-            query_result_next = phase_db.get_query_result({"_id": phaseNext.couch_id})[
-                :
-            ]
-            docu = phase_db[query_result[0]["_id"]]
-            docNextU = phase_db[query_result_next[0]["_id"]]
-            nsc.update_doc(phase_db, docu["_id"], doc)
-            nsc.update_doc(phase_db, docNextU["_id"], docNext)
+            enqueue_propagation(updated=get_updates(phase, phaseNext))
         else:
             if phase.order < phase_count:
                 phase.order = phase.order + 1
                 phase.save()
-                doc = {"order": phase.order}
-                nsc = NoSQLClient()
-                phase_db = nsc.get_db("process_design")
-                query_result = phase_db.get_query_result({"_id": phase.couch_id})[:]
-                docu = phase_db[query_result[0]["_id"]]
-                nsc.update_doc(phase_db, docu["_id"], doc)
+                enqueue_propagation(updated=get_updates(phase))
     return redirect("dashboard:phases:list")
 
 
@@ -218,8 +180,7 @@ class UpdatePhaseView(
             self.phase = self.get_object()
             self.phase_db_name = "process_design"
             self.phase_db = nsc.get_db(self.phase_db_name)
-            query_result = self.phase_db.get_query_result({"type": "phase"})[:]
-            self.doc = self.phase_db[query_result[0]["_id"]]
+            self.doc = process_design_cache.get(self.phase.couch_id)
         except Exception:
             raise Http404
         return super().dispatch(request, *args, **kwargs)
@@ -255,11 +216,6 @@ class UpdatePhaseView(
         phase.name = data["name"]
         phase.description = data["description"]
         phase.save()
-        doc = {"name": data["name"], "description": data["description"]}
-        nsc = NoSQLClient()
-        query_result = self.phase_db.get_query_result({"_id": phase.couch_id})[:]
-        self.doc = self.phase_db[query_result[0]["_id"]]
-        nsc.update_doc(self.phase_db, self.doc["_id"], doc)
         return redirect("dashboard:phases:list")
 
 
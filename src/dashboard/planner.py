@@ -0,0 +1,491 @@
+# Set-based copy of the process design tasks into the facilitator databases.
+# A facilitator database is read once (its facilitator, project, phase, activity and
+# task documents) and indexed in memory by administrative level, type, parents and
+# sql_id or order, like the selectors create_task_all_facilitators used to run for
+# each village. The creations and updates of all the given tasks are computed
+# against this index and written with chunked _bulk_docs requests. The new
+# documents get their _id here so that their children, created in the same plan,
+# can refer to them. The _id is derived from the database, the administrative level,
+# the type and the sql_id, so that the same document always gets the same _id
+# (see also dashboard.process_template).
+import copy
+import uuid
+from datetime import datetime
+
+from no_sql_client import merge_fields
+from process_manager.fingerprints import compute_fingerprint
+
+PLANNED_TYPES = ["facilitator", "project", "phase", "activity", "task"]
+
+DOCUMENT_ID_NAMESPACE = uuid.UUID("0b9a3a6c-5a43-4bd6-9d5e-3f7cf0f4d7a1")
+
+# Fields set by a plan on the latest revision when its write conflicts with it
+PHASE_FIELDS = ["name", "description", "order", "sql_id"]
+ACTIVITY_FIELDS = ["name", "description", "order", "total_tasks", "sql_id"]
+TASK_FIELDS = [
+    "name",
+    "description",
+    "phase_name",
+    "activity_name",
+    "administrative_level_name",
+    "form",
+    "order",
+    "sql_id",
+    "support_attachments",
+]
+
+
+def get_scope(doc):
+    """
+    Return the ids of the parents a document is looked up in
+    """
+    if doc.get("type") == "phase":
+        return (doc.get("project_id"),)
+    if doc.get("type") == "activity":
+        return doc.get("project_id"), doc.get("phase_id")
+    return doc.get("project_id"), doc.get("phase_id"), doc.get("activity_id")
+
+
+def copy_design_document(doc):
+    doc = copy.deepcopy(doc)
+    doc.pop("_id", None)
+    doc.pop("_rev", None)
+    return doc
+
+
+def merge_attachments(attachments, facilitator_attachments):
+    """
+    Return the attachments of the design, those already in the facilitator task
+    (with the uploaded file) being kept, matched by name
+    """
+    existing = {
+        attachment.get("name"): attachment
+        for attachment in facilitator_attachments or []
+        if attachment.get("name")
+    }
+    return [
+        existing.get(attachment.get("name"), attachment)
+        for attachment in attachments or []
+    ]
+
+
+def merge_task(latest, doc):
+    """
+    Conflict merge of a task document: the TASK_FIELDS of the plan are set on the
+    latest revision, whose attachments, completion and dates set by the tablet are
+    kept (the attachments of the design being merged with the uploaded ones)
+    """
+    merge_fields(*TASK_FIELDS)(latest, doc)
+    if "attachments" in doc:
+        latest["attachments"] = merge_attachments(
+            doc["attachments"], latest.get("attachments")
+        )
+    for attr in ("last_updated", "completed_date"):
+        if not latest.get(attr) and doc.get(attr):
+            latest[attr] = doc[attr]
+    return latest
+
+
+def get_diff_value(value):
+    """
+    Return the value as shown in a diff report, the lists and dicts (forms,
+    attachments) being replaced by a digest to keep the report compact
+    """
+    if isinstance(value, (list, dict)):
+        return "sha1:" + compute_fingerprint(value)[:12]
+    return value
+
+
+def get_document_id(db_name, administrative_level_id, _type, sql_id):
+    """
+    Return the _id of the document of the phase, activity or task with the sql_id
+    in the administrative level of the facilitator database
+    """
+    return uuid.uuid5(
+        DOCUMENT_ID_NAMESPACE,
+        f"{db_name}:{administrative_level_id}:{_type}:{sql_id}",
+    ).hex
+
+
+def describe_document(doc):
+    return {
+        "_id": doc.get("_id"),
+        "type": doc.get("type"),
+        "sql_id": doc.get("sql_id"),
+        "administrative_level_id": doc.get("administrative_level_id"),
+    }
+
+
+class FacilitatorPlan:
+    def __init__(self, docs, db_name=None):
+        self.db_name = db_name
+        self.facilitator = None
+        self.projects = {}
+        self.index = {}
+        self.docs = list(docs)
+        self.changes = {}  # _id -> (document, conflict merge function)
+        self.diffs = {}  # _id -> {field: [old value, new value]}
+        self.visited = set()
+        self.created = set()
+        self.updated = set()
+        for doc in self.docs:
+            self.add(doc)
+
+    @staticmethod
+    def get_keys(doc):
+        base = (doc.get("administrative_level_id"), doc.get("type"), get_scope(doc))
+        return [
+            base + (attr, doc[attr])
+            for attr in ("sql_id", "order")
+            if doc.get(attr) is not None
+        ]
+
+    def add(self, doc):
+        _type = doc.get("type")
+        if _type == "facilitator":
+            self.facilitator = self.facilitator or doc
+        elif _type == "project":
+            self.projects.setdefault(doc.get("_id"), doc)
+            self.projects.setdefault(("name", doc.get("name")), doc)
+        elif _type in ("phase", "activity", "task"):
+            for key in self.get_keys(doc):
+                self.index.setdefault(key, doc)
+
+    def remove(self, doc):
+        for key in self.get_keys(doc):
+            if self.index.get(key) is doc:
+                del self.index[key]
+
+    def find(self, administrative_level_id, _type, scope, sql_id, order):
+        """
+        Return the document with the given sql_id, or else with the given order
+        """
+        base = (administrative_level_id, _type, scope)
+        return self.index.get(base + ("sql_id", sql_id)) or self.index.get(
+            base + ("order", order)
+        )
+
+    def create(self, doc, merge=None):
+        if not doc.get("_id"):
+            if self.db_name is not None and doc.get("sql_id") is not None:
+                doc["_id"] = get_document_id(
+                    self.db_name,
+                    doc.get("administrative_level_id"),
+                    doc.get("type"),
+                    doc["sql_id"],
+                )
+            else:
+                doc["_id"] = uuid.uuid4().hex
+        self.add(doc)
+        self.changes[doc["_id"]] = (doc, merge)
+        self.visited.add(doc["_id"])
+        self.created.add(doc["_id"])
+        return doc
+
+    def update(self, doc, values, merge):
+        """
+        Set the values on the document, which is only written if one of them changed
+        """
+        self.visited.add(doc["_id"])
+        if all(doc.get(k) == v and k in doc for k, v in values.items()):
+            return doc
+        diff = self.diffs.setdefault(doc["_id"], {})
+        for k, v in values.items():
+            if doc.get(k) != v or k not in doc:
+                diff.setdefault(k, [doc.get(k), None])[1] = v
+        self.remove(doc)
+        doc.update(values)
+        self.add(doc)
+        if doc["_id"] in self.changes:
+            # A document created by the plan is written whole
+            merge = self.changes[doc["_id"]][1]
+        if doc["_id"] not in self.created:
+            self.updated.add(doc["_id"])
+        self.changes[doc["_id"]] = (doc, merge)
+        return doc
+
+    def get_summary(self):
+        """
+        Return the number of documents created, updated and left unchanged
+        """
+        return {
+            "created": len(self.created),
+            "updated": len(self.updated),
+            "unchanged": len(self.visited - self.created - self.updated),
+        }
+
+    def get_orphans(self, tasks):
+        """
+        Return the project, phase, activity and task documents the plan of the
+        tasks left untouched, with the reason: an administrative level the
+        facilitator no longer has, an sql_id not among the tasks, or a duplicate
+        """
+        administrative_level_ids = {
+            str(administrative_level["id"])
+            for administrative_level in (self.facilitator or {}).get(
+                "administrative_levels", []
+            )
+        }
+        sql_ids = {"phase": set(), "activity": set(), "task": set()}
+        for task_model in tasks:
+            sql_ids["phase"].add(task_model.phase.id)
+            sql_ids["activity"].add(task_model.activity.id)
+            sql_ids["task"].add(task_model.id)
+
+        orphans = []
+        for doc in self.docs:
+            _type = doc.get("type")
+            if _type not in PLANNED_TYPES[1:] or doc.get("_id") in self.visited:
+                continue
+            if _type == "project":
+                reason = "not_planned"
+            elif (
+                str(doc.get("administrative_level_id")) not in administrative_level_ids
+            ):
+                reason = "administrative_level"
+            elif doc.get("sql_id") not in sql_ids[_type]:
+                reason = "sql_id"
+            else:
+                reason = "duplicate"
+            orphans.append({**describe_document(doc), "reason": reason})
+        return orphans
+
+    def get_report(self, tasks=None):
+        """
+        Return the documents the plan creates and updates, with the old and new
+        value of each changed field, and the orphaned documents if the plan was
+        made for every task
+        """
+        report = {
+            **self.get_summary(),
+            "to_create": [
+                describe_document(self.changes[_id][0]) for _id in sorted(self.created)
+            ],
+            "to_update": [
+                {
+                    **describe_document(self.changes[_id][0]),
+                    "fields": {
+                        field: [get_diff_value(old), get_diff_value(new)]
+                        for field, (old, new) in sorted(self.diffs[_id].items())
+                    },
+                }
+                for _id in sorted(self.updated)
+            ],
+        }
+        if tasks is not None:
+            report["orphaned"] = self.get_orphans(tasks)
+        return report
+
+    def plan_project(self, project):
+        existing = self.projects.get(project["_id"]) or self.projects.get(
+            ("name", project["name"])
+        )
+        if existing:
+            self.visited.add(existing["_id"])
+            return
+        doc = copy.deepcopy(project)
+        doc.pop("_rev", None)
+        self.create(doc)
+
+    def plan_task(self, task_model, design_docs, administrative_level):
+        """
+        Create or update the phase, activity and task documents of the task in the
+        administrative level
+        """
+        task, activity, phase, project = design_docs
+        administrative_level_id = administrative_level["id"]
+        project_id = project["_id"]
+
+        fc_phase = self.find(
+            administrative_level_id,
+            "phase",
+            (project_id,),
+            task_model.phase.id,
+            phase["order"],
+        )
+        if fc_phase is None:
+            fc_phase = copy_design_document(phase)
+            fc_phase["administrative_level_id"] = administrative_level_id
+            fc_phase["project_id"] = project_id
+            fc_phase["sql_id"] = task_model.phase.id
+            self.create(fc_phase)
+        else:
+            self.update(
+                fc_phase,
+                {
+                    "name": task_model.phase.name,
+                    "description": task_model.phase.description,
+                    "order": task_model.phase.order,
+                    "sql_id": task_model.phase.id,
+                },
+                merge_fields(*PHASE_FIELDS),
+            )
+
+        fc_activity = self.find(
+            administrative_level_id,
+            "activity",
+            (project_id, fc_phase["_id"]),
+            task_model.activity.id,
+            activity["order"],
+        )
+        if fc_activity is None:
+            fc_activity = copy_design_document(activity)
+            fc_activity["administrative_level_id"] = administrative_level_id
+            fc_activity["project_id"] = project_id
+            fc_activity["phase_id"] = fc_phase["_id"]
+            fc_activity["sql_id"] = task_model.activity.id
+            self.create(fc_activity)
+        else:
+            self.update(
+                fc_activity,
+                {
+                    "name": task_model.activity.name,
+                    "description": task_model.activity.description,
+                    "order": task_model.activity.order,
+                    "total_tasks": task_model.activity.total_tasks,
+                    "sql_id": task_model.activity.id,
+                },
+                merge_fields(*ACTIVITY_FIELDS),
+            )
+
+        fc_task = self.find(
+            administrative_level_id,
+            "task",
+            (project_id, fc_phase["_id"], fc_activity["_id"]),
+            task_model.id,
+            task["order"],
+        )
+        if fc_task is None:
+            fc_task = copy_design_document(task)
+            fc_task["administrative_level_id"] = administrative_level_id
+            fc_task["administrative_level_name"] = administrative_level["name"]
+            fc_task["project_id"] = project_id
+            fc_task["phase_id"] = fc_phase["_id"]
+            fc_task["activity_id"] = fc_activity["_id"]
+            fc_task["sql_id"] = task_model.id
+            fc_task["completed_date"] = None
+            fc_task["last_updated"] = None
+            self.create(fc_task)
+            return
+
+        values = {
+            "name": task_model.name,
+            "description": task_model.description,
+            "phase_name": task_model.phase.name,
+            "activity_name": task_model.activity.name,
+            "administrative_level_name": administrative_level["name"],
+            "attachments": merge_attachments(
+                task.get("attachments"), fc_task.get("attachments")
+            ),
+            "order": task_model.order,
+            "sql_id": task_model.id,
+            "support_attachments": task.get("support_attachments"),
+        }
+        if task_model.form:
+            values["form"] = task_model.form
+        elif task.get("form"):
+            values["form"] = task.get("form")
+
+        datetime_now = datetime.now()
+        datetime_str = f"{str(datetime_now.year)}-{str(datetime_now.month)}-{str(datetime_now.day)} {str(datetime_now.hour)}:{str(datetime_now.minute)}:{str(datetime_now.second)}"
+        for attr in ("last_updated", "completed_date"):
+            if not fc_task.get(attr):
+                values[attr] = (
+                    datetime_str if fc_task.get("completed") else "0000-00-00 00:00:00"
+                )
+        self.update(fc_task, values, merge_task)
+
+    def plan(self, tasks, design_docs):
+        """
+        Plan the documents of the tasks in every administrative level of the
+        facilitator. design_docs maps the couch_id of the tasks, activities, phases
+        and projects to their process_design document.
+        """
+        if self.facilitator is None:
+            return
+        for task_model in tasks:
+            docs = [
+                design_docs.get(couch_id)
+                for couch_id in (
+                    task_model.couch_id,
+                    task_model.activity.couch_id,
+                    task_model.phase.couch_id,
+                    task_model.project.couch_id,
+                )
+            ]
+            if not all(docs):
+                print(f"Missing process design documents for the task {task_model.id}")
+                continue
+            self.plan_project(docs[3])
+            for administrative_level in self.facilitator.get(
+                "administrative_levels", []
+            ):
+                self.plan_task(task_model, docs, administrative_level)
+
+    def apply(self, nsc, db):
+        """
+        Write the planned documents. The documents in conflict with a newer
+        revision are read again, the plan merged on them and written once more. Returns the results of the writes that failed.
+        """
+        docs = [doc for doc, _ in self.changes.values()]
+        conflicts = []
+        errors = []
+        for doc, result in zip(docs, nsc.bulk_upsert(db, docs)):
+            if result.get("rev"):
+                doc["_rev"] = result["rev"]
+            elif result.get("error") == "conflict" and self.changes[doc["_id"]][1]:
+                conflicts.append(doc)
+            else:
+                errors.append(result)
+
+        if conflicts:
+            latest = {
+                doc["_id"]: doc
+                for doc in nsc.bulk_get(db, [doc["_id"] for doc in conflicts])
+            }
+            merged = []
+            for doc in conflicts:
+                if doc["_id"] not in latest:
+                    continue
+                merged.append(self.changes[doc["_id"]][1](latest[doc["_id"]], doc))
+            errors.extend(nsc.bulk_errors(nsc.bulk_upsert(db, merged)))
+        self.changes = {}
+        return errors
+
+
+def get_tasks_selectors(tasks, design_docs):
+    """
+    Return the selectors of the documents the plan of the tasks can touch: the
+    facilitator and project documents, and the phases, activities and tasks with
+    the sql_id or the order of the given ones. They are read with one query each,
+    so that each one can use its index (an $or can't).
+    """
+    sql_ids = set()
+    orders = set()
+    for task_model in tasks:
+        for obj in (task_model.phase, task_model.activity, task_model):
+            sql_ids.add(obj.id)
+            orders.add(obj.order)
+            if obj.couch_id in design_docs:
+                orders.add(design_docs[obj.couch_id].get("order"))
+
+    types = {"$in": ["activity", "phase", "task"]}
+    return [
+        {"type": {"$in": ["facilitator", "project"]}},
+        {"type": types, "sql_id": {"$in": sorted(sql_ids)}},
+        {"type": types, "order": {"$in": sorted(orders, key=str)}},
+    ]
+
+
+def plan_facilitator_database(nsc, db, tasks, design_docs, selectors=None):
+    """
+    Read the facilitator database and plan the documents of the tasks.
+    The documents read can be narrowed with selectors (see get_tasks_selectors).
+    """
+    docs = {}
+    for selector in selectors or [{"type": {"$in": PLANNED_TYPES}}]:
+        for doc in nsc.find_documents(db, selector):
+            docs.setdefault(doc["_id"], doc)
+    plan = FacilitatorPlan(docs.values(), db.database_name)
+    plan.plan(tasks, design_docs)
+    return plan
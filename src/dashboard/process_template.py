@@ -0,0 +1,123 @@
+# Precompiled process template of the facilitator databases.
+# The documents a village of a facilitator gets (its phases, activities and tasks,
+# and the projects) are planned once per design version against an empty database
+# (see dashboard.planner) and kept in memory. Materializing a village then only
+# stamps the administrative level and the _ids, derived from the database, the
+# village, the type and the sql_id like the planner does, on a copy of these
+# documents and writes them with a single chunked _bulk_docs request, without
+# reading the facilitator database. A document that already exists makes its
+# write fail with a conflict and is left as it is, so a materialization can be run
+# again.
+import copy
+import threading
+from collections import OrderedDict
+
+from dashboard.planner import FacilitatorPlan, get_document_id
+
+TEMPLATE_LEVEL = {"id": "__template__", "name": "__template__"}
+CACHE_SIZE = 4
+
+_templates = OrderedDict()
+_lock = threading.Lock()
+
+
+class ProcessTemplate:
+    def __init__(self, tasks, design_docs):
+        plan = FacilitatorPlan(
+            [{"type": "facilitator", "administrative_levels": [TEMPLATE_LEVEL]}], ""
+        )
+        plan.plan(tasks, design_docs)
+        # A second pass gives the documents the values a later sync would set on
+        # them (the names and forms of the SQL rows, the empty dates)
+        plan.plan(tasks, design_docs)
+        docs = [doc for doc, _ in plan.changes.values()]
+        self.projects = [doc for doc in docs if doc["type"] == "project"]
+        self.documents = [doc for doc in docs if doc["type"] != "project"]
+        self.task_ids = {
+            doc["sql_id"] for doc in self.documents if doc["type"] == "task"
+        }
+
+    def __len__(self):
+        return len(self.projects) + len(self.documents)
+
+    def materialize(self, db_name, administrative_level):
+        """
+        Return the phase, activity and task documents of the administrative level
+        in the facilitator database
+        """
+        ids = {
+            doc["_id"]: get_document_id(
+                db_name, administrative_level["id"], doc["type"], doc["sql_id"]
+            )
+            for doc in self.documents
+        }
+        docs = []
+        for template_doc in self.documents:
+            doc = copy.deepcopy(template_doc)
+            doc["_id"] = ids[template_doc["_id"]]
+            doc["administrative_level_id"] = administrative_level["id"]
+            if "administrative_level_name" in doc:
+                doc["administrative_level_name"] = administrative_level["name"]
+            for attr in ("phase_id", "activity_id"):
+                if attr in doc:
+                    doc[attr] = ids[doc[attr]]
+            docs.append(doc)
+        return docs
+
+
+def get_process_template(design_version, tasks, design_docs):
+    """
+    Return the template of the tasks, compiled once per design version
+    """
+    with _lock:
+        if design_version in _templates:
+            _templates.move_to_end(design_version)
+            return _templates[design_version]
+    template = ProcessTemplate(tasks, design_docs)
+    with _lock:
+        _templates[design_version] = template
+        while len(_templates) > CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+
+def get_administrative_levels_with_documents(nsc, db, administrative_levels):
+    """
+    Return the ids of the administrative levels that already have phases in the
+    facilitator database (filled before the _ids were deterministic)
+    """
+    if not administrative_levels:
+        return set()
+    return {
+        doc.get("administrative_level_id")
+        for doc in nsc.find_documents(
+            db,
+            {
+                "type": "phase",
+                "administrative_level_id": {
+                    "$in": [level["id"] for level in administrative_levels]
+                },
+            },
+            fields=["administrative_level_id"],
+        )
+    }
+
+
+def materialize_villages(nsc, db, template, administrative_levels, extra_docs=()):
+    """
+    Write the documents of the template for the administrative levels, with the
+    projects and the extra documents, in one bulk request. Returns the number of
+    documents created and the errors other than the conflicts of the existing
+    documents.
+    """
+    docs = [copy.deepcopy(doc) for doc in template.projects] + list(extra_docs)
+    for administrative_level in administrative_levels:
+        docs.extend(template.materialize(db.database_name, administrative_level))
+    results = nsc.bulk_upsert(db, docs) if docs else []
+    created = len([result for result in results if result.get("rev")])
+    errors = [
+        result
+        for result in nsc.bulk_errors(results)
+        if result.get("error") != "conflict"
+    ]
+    return created, errors
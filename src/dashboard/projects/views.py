@@ -15,6 +15,7 @@ from process_manager.models import Project
 from dashboard.projects.forms import ProjectForm, UpdateProjectForm
 from dashboard.mixins import AJAXRequestMixin, PageMixin, JSONResponseMixin
 from no_sql_client import NoSQLClient
+from process_manager.cache import process_design_cache
 
 from authentication.permissions import (
     CDDSpecialistPermissionRequiredMixin,
@@ -30,15 +31,14 @@ class ProjectMixin:
     project_db_name = None
 
     def dispatch(self, request, *args, **kwargs):
-        nsc = NoSQLClient()
         try:
-            self.project_db_name = kwargs["id"]
-            self.project_db = nsc.get_db(self.project_db_name)
-            query_result = self.project_db.get_query_result({"type": "project"})[:]
-            self.doc = self.project_db[query_result[0]["_id"]]
-            self.obj = get_object_or_404(Project, no_sql_db_name=kwargs["id"])
+            self.project_db_name = "process_design"
+            self.obj = get_object_or_404(Project, couch_id=kwargs["id"])
+            self.doc = process_design_cache.get(self.obj.couch_id)
         except Exception:
             raise Http404
+        if not self.doc:
+            raise Http404
         return super().dispatch(request, *args, **kwargs)
 
 
@@ -125,8 +125,7 @@ class UpdateProjectView(
             self.project = self.get_object()
             self.project_db_name = "process_design"
             self.project_db = nsc.get_db(self.project_db_name)
-            query_result = self.project_db.get_query_result({"type": "project"})[:]
-            self.doc = self.project_db[query_result[0]["_id"]]
+            self.doc = process_design_cache.get(self.project.couch_id)
         except Exception:
             raise Http404
         return super().dispatch(request, *args, **kwargs)
@@ -163,18 +162,6 @@ class UpdateProjectView(
         project.description = data["description"]
         project.couch_id = data["couch_id"]
         project.save()
-        doc = {
-            "name": data["name"],
-            "type": "project",
-            "description": data["description"],
-            "sql_id": project.id,
-        }
-        nsc = NoSQLClient()
-        query_result = self.project_db.get_query_result(
-            {"type": "project", "_id": project.couch_id}
-        )[:]
-        self.doc = self.project_db[query_result[0]["_id"]]
-        nsc.update_doc(self.project_db, self.doc["_id"], doc)
         return redirect("dashboard:projects:list")
 
 
@@ -225,23 +212,8 @@ def updaterecord(request, id):
     project.name = name
     project.description = description
     project.couch_id = couch_id
+    # save() records the update of the document in the outbox
     project.save()
-    doc = None
-    _id = couch_id
-    doc = {
-        "name": project.name,
-        "type": "project",
-        "description": request.POST["description"],
-        "sql_id": project.id,
-    }
-    try:
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        query_result = nsc_database.get_query_result({"type": "project"})[:]
-        doc = nsc_database[query_result[0]["_id"]]
-        nsc.update_doc(nsc_database, doc["_id"], doc)
-    except Exception:
-        raise Http404
     return redirect("dashboard:projects:list")
 
 
@@ -249,13 +221,10 @@ def delete(request, id):
     project = Project.objects.get(id=id)
 
     if request.method == "POST":
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": project.couch_id})[0]
-        if new_document:
-            nsc.delete_document(nsc_database, project.couch_id)
-            project.delete()
+        # The documents of the project and its process are deleted by the outbox
+        # drainer
+        project.delete()
 
-            return redirect("dashboard:projects:list")
+        return redirect("dashboard:projects:list")
 
     return render(request, "projects/project_confirm_delete.html", {"project": project})
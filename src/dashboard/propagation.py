@@ -0,0 +1,194 @@
+# Propagation of the structural edits of the process design (deleted phases,
+# activities and tasks, new orders) to the copies in the facilitator databases,
+# without a full sync. The copies are found by type and sql_id with the
+# type-sql_id index (see no_sql_indexes), one _find per edited type, and deleted or
+# updated with a single chunked _bulk_docs write per database, `concurrency`
+# databases at a time. Every propagation is recorded in the SyncRun ledger.
+#
+# The dashboard views don't propagate in the request: they record the edit in the
+# outbox (enqueue_propagation) and the drain_outbox command makes it.
+from django.conf import settings
+
+from authentication.models import Facilitator
+from dashboard.sync_runner import run_concurrently, run_measured
+from no_sql_client import NoSQLClient, merge_fields
+from process_manager.models import OutboxMessage, SyncRun
+
+# Fields of the documents kept in step with the SQL rows on a structural edit
+PROPAGATED_FIELDS = {
+    "phase": ["order"],
+    "activity": ["order", "total_tasks"],
+    "task": ["order"],
+}
+
+
+def get_deletions(*objects):
+    """
+    Return the sql_ids by type of the given phases, activities and tasks, to be
+    called before they are deleted
+    """
+    deleted = {}
+    for obj in objects:
+        deleted.setdefault(obj._meta.model_name, set()).add(obj.id)
+    return deleted
+
+
+def get_updates(*objects):
+    """
+    Return the values of the propagated fields of the given phases, activities
+    and tasks, by type and sql_id
+    """
+    updated = {}
+    for obj in objects:
+        _type = obj._meta.model_name
+        updated.setdefault(_type, {})[obj.id] = {
+            field: getattr(obj, field) for field in PROPAGATED_FIELDS[_type]
+        }
+    return updated
+
+
+def propagate_facilitator(facilitator, deleted, updated):
+    """
+    Delete and update the copies of the edited rows in the database of the
+    facilitator. Returns the number of documents read, deleted and updated, and
+    the writes that failed.
+    """
+    nsc = NoSQLClient()
+    db = nsc.get_db(facilitator.no_sql_db_name)
+    docs = []
+    for _type in PROPAGATED_FIELDS:
+        sql_ids = set(deleted.get(_type, ())) | set(updated.get(_type, {}))
+        if sql_ids:
+            docs.extend(
+                nsc.find_documents(
+                    db, {"type": _type, "sql_id": {"$in": sorted(sql_ids)}}
+                )
+            )
+
+    changes = []
+    deletions = 0
+    for doc in docs:
+        if doc["sql_id"] in deleted.get(doc["type"], ()):
+            changes.append({"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True})
+            deletions += 1
+            continue
+        values = updated.get(doc["type"], {}).get(doc["sql_id"], {})
+        if any(doc.get(k) != v for k, v in values.items()):
+            doc.update(values)
+            changes.append(doc)
+
+    results = nsc.bulk_upsert(db, changes)
+    conflicts = {
+        doc["_id"]: doc
+        for doc, result in zip(changes, results)
+        if result.get("error") == "conflict"
+    }
+    errors = [
+        result
+        for doc, result in zip(changes, results)
+        if result.get("error") and doc["_id"] not in conflicts
+    ]
+    if conflicts:
+        # The documents are deleted at their latest revision. The changes made on
+        # the tablets since the read are kept on the others, only the propagated
+        # fields are set again.
+        retried = []
+        for latest in nsc.bulk_get(db, conflicts):
+            doc = conflicts[latest["_id"]]
+            if doc.get("_deleted"):
+                retried.append(
+                    {"_id": latest["_id"], "_rev": latest["_rev"], "_deleted": True}
+                )
+            else:
+                retried.append(
+                    merge_fields(*PROPAGATED_FIELDS[latest["type"]])(latest, doc)
+                )
+        errors.extend(nsc.bulk_errors(nsc.bulk_upsert(db, retried)))
+    counts = {
+        "read": len(docs),
+        "deleted": deletions,
+        "updated": len(changes) - deletions,
+    }
+    return counts, errors
+
+
+def propagate_structure(
+    deleted=None, updated=None, facilitators=None, concurrency=None
+):
+    """
+    Propagate the deleted rows (sql_ids by type, see get_deletions) and the new
+    orders and totals (values by type and sql_id, see get_updates) to the
+    databases of the facilitators, every facilitator by default. Returns the
+    totals of the propagation.
+    """
+    deleted = deleted or {}
+    updated = updated or {}
+    if facilitators is None:
+        facilitators = Facilitator.objects.all()
+    summary = {"databases": 0, "deleted": 0, "updated": 0, "failed": 0}
+    run = SyncRun.objects.create(kind=SyncRun.PROPAGATION)
+    run_error = ""
+    try:
+        for facilitator, future in run_concurrently(
+            run_measured,
+            list(facilitators),
+            concurrency or settings.NO_SQL_CONCURRENCY,
+            propagate_facilitator,
+            deleted,
+            updated,
+        ):
+            database, result, exception = future.result()
+            counts = {"read": 0, "deleted": 0, "updated": 0}
+            if exception is None:
+                counts, errors = result
+            else:
+                errors = [str(exception) or exception.__class__.__name__]
+            for error in errors:
+                print(facilitator.no_sql_db_name, error)
+            database.status = SyncRun.FAILED if errors else SyncRun.DONE
+            database.error = "\n".join(str(error) for error in errors)
+            for key, value in counts.items():
+                setattr(database, key, value)
+            run.add(database)
+
+            summary["databases"] += 1
+            summary["failed"] += bool(errors)
+            summary["deleted"] += counts["deleted"]
+            summary["updated"] += counts["updated"]
+    except BaseException as exc:
+        run_error = str(exc) or exc.__class__.__name__
+        raise
+    finally:
+        run.finish(run_error)
+    return summary
+
+
+def enqueue_propagation(deleted=None, updated=None):
+    """
+    Record the propagation of the deleted rows and of the new orders and totals
+    (see propagate_structure) in the outbox, the drain_outbox command making it
+    """
+    return OutboxMessage.enqueue_propagation(
+        {
+            "deleted": {
+                _type: sorted(sql_ids) for _type, sql_ids in (deleted or {}).items()
+            },
+            "updated": {
+                _type: sorted([sql_id, values] for sql_id, values in values.items())
+                for _type, values in (updated or {}).items()
+            },
+        }
+    )
+
+
+def propagate_message(data):
+    """
+    Make the propagation recorded by enqueue_propagation. Returns an error if a
+    database failed.
+    """
+    summary = propagate_structure(
+        {_type: set(sql_ids) for _type, sql_ids in data["deleted"].items()},
+        {_type: dict(values) for _type, values in data["updated"].items()},
+    )
+    if summary["failed"]:
+        return f"{summary['failed']} database(s) failed"
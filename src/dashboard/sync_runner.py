@@ -0,0 +1,471 @@
+# Parallel and resumable sync of the process design tasks into the facilitator
+# databases. Each facilitator database is planned and written (see
+# dashboard.planner) by a pool of at most `concurrency` threads, while the main
+# thread records the outcome of each one in FacilitatorSyncState. The databases
+# whose last sync is done with the current design version and villages are
+# skipped, so a rerun after a crash only syncs the remaining ones. Every run is also kept in the
+# SyncRun ledger, with the timings, document counts and CouchDB requests of each
+# database.
+#
+# Each facilitator database also keeps in a _local document (never replicated to
+# the tablets) the fingerprint of every task it received and the administrative
+# levels they were planned for. An incremental sync only plans the tasks whose
+# fingerprint changed, reading only the documents they can touch. The villages
+# added to a facilitator since get the documents of the precompiled process
+# template (see dashboard.process_template) in a single write.
+#
+# A dry run plans every task against every database with the same single _find
+# per database but writes nothing, and reports what a sync would change.
+import contextvars
+import copy
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.utils import timezone
+
+from authentication.models import FacilitatorVillage
+from dashboard.planner import get_tasks_selectors, plan_facilitator_database
+from dashboard.process_template import (
+    get_administrative_levels_with_documents,
+    get_process_template,
+    materialize_villages,
+)
+from dashboard.utils import get_tasks_design_documents
+from no_sql_client import NoSQLClient
+from no_sql_instrumentation import collect_no_sql_requests
+from process_manager.fingerprints import get_task_fingerprint
+from process_manager.models import (
+    FacilitatorSyncState,
+    SyncRun,
+    SyncRunDatabase,
+    Task,
+)
+from process_manager.outbox import flush
+
+
+MANIFEST = "process_design_manifest"
+
+
+def get_design_version(fingerprints, design_docs):
+    """
+    Return a digest of the fingerprints of the tasks and of the revisions of their
+    process_design documents, which changes whenever a sync could write something
+    """
+    data = {
+        "tasks": sorted(fingerprints.items()),
+        "docs": sorted([doc["_id"], doc.get("_rev")] for doc in design_docs.values()),
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def get_administrative_levels_versions(facilitators):
+    """
+    Return a digest of the villages (FacilitatorVillage) of each facilitator by id,
+    which changes whenever villages are assigned, renamed or taken away
+    """
+    villages = {facilitator.id: [] for facilitator in facilitators}
+    for facilitator_id, administrative_id, name in FacilitatorVillage.objects.filter(
+        facilitator__in=facilitators
+    ).values_list("facilitator_id", "administrative_id", "name"):
+        villages[facilitator_id].append([administrative_id, name])
+    return {
+        facilitator_id: hashlib.sha1(
+            json.dumps(sorted(administrative_levels)).encode()
+        ).hexdigest()
+        for facilitator_id, administrative_levels in villages.items()
+    }
+
+
+def get_fingerprints(tasks, design_docs):
+    """
+    Return the fingerprint of each task by id, with its process_design document
+    """
+    return {
+        task.id: get_task_fingerprint(task, design_docs.get(task.couch_id))
+        for task in tasks
+    }
+
+
+def get_administrative_level_ids(facilitator_doc):
+    return sorted(
+        str(administrative_level["id"])
+        for administrative_level in (facilitator_doc or {}).get(
+            "administrative_levels", []
+        )
+    )
+
+
+def sync_facilitator(
+    facilitator, tasks, design_docs, fingerprints, incremental=True, template=None
+):
+    """
+    Plan and write the tasks in the database of the facilitator, only the ones
+    whose fingerprint differs from the manifest of the database if incremental.
+    The administrative levels added to the facilitator since the manifest get the
+    documents of the template, if given (it must be compiled for every task).
+    Returns the summary of the plan (with the number of documents read), the
+    writes that failed and the duration in seconds.
+    """
+    started = time.perf_counter()
+    nsc = NoSQLClient()
+    db = nsc.get_db(facilitator.no_sql_db_name)
+    manifest = nsc.get_local_document(db, MANIFEST) or {}
+    initial_manifest = copy.deepcopy(manifest)
+
+    selectors = None
+    facilitator_doc = None
+    materialized = 0
+    read = 0
+    if incremental:
+        facilitator_docs = nsc.find_documents(db, {"type": "facilitator"})
+        read += len(facilitator_docs)
+        facilitator_doc = facilitator_docs[0] if facilitator_docs else None
+        received = {}
+        if facilitator_doc and "administrative_levels" in manifest:
+            known = set(manifest["administrative_levels"])
+            new_levels = [
+                administrative_level
+                for administrative_level in facilitator_doc.get(
+                    "administrative_levels", []
+                )
+                if str(administrative_level["id"]) not in known
+            ]
+            if (
+                template is not None
+                and new_levels
+                and not get_administrative_levels_with_documents(nsc, db, new_levels)
+            ):
+                materialized, errors = materialize_villages(
+                    nsc, db, template, new_levels
+                )
+                if errors:
+                    summary = {
+                        "read": read,
+                        "created": materialized,
+                        "updated": 0,
+                        "unchanged": 0,
+                    }
+                    return summary, errors, round(time.perf_counter() - started, 2)
+                known.update(str(level["id"]) for level in new_levels)
+                manifest["administrative_levels"] = sorted(known)
+            if known.issuperset(get_administrative_level_ids(facilitator_doc)):
+                received = manifest.get("tasks", {})
+        tasks = [
+            task
+            for task in tasks
+            if received.get(str(task.id)) != fingerprints[task.id]
+        ]
+        selectors = get_tasks_selectors(tasks, design_docs)
+
+    summary = {"created": 0, "updated": 0, "unchanged": 0}
+    errors = []
+    if tasks:
+        plan = plan_facilitator_database(nsc, db, tasks, design_docs, selectors)
+        summary = plan.get_summary()
+        errors = plan.apply(nsc, db)
+        facilitator_doc = plan.facilitator
+        read += len(plan.docs)
+    summary["created"] += materialized
+    summary["read"] = read
+
+    if not errors and facilitator_doc:
+        administrative_levels = get_administrative_level_ids(facilitator_doc)
+        if not set(manifest.get("administrative_levels", [])).issuperset(
+            administrative_levels
+        ):
+            # The tasks received before weren't planned for the new administrative
+            # levels, they must be planned again
+            manifest["tasks"] = {}
+        manifest["administrative_levels"] = administrative_levels
+        manifest.setdefault("tasks", {}).update(
+            {str(task.id): fingerprints[task.id] for task in tasks}
+        )
+        if manifest != initial_manifest:
+            nsc.put_local_document(db, MANIFEST, manifest)
+    return summary, errors, round(time.perf_counter() - started, 2)
+
+
+def onboard_villages(facilitator, administrative_levels, facilitator_doc=None):
+    """
+    Write the documents of the process template for the administrative levels of
+    the facilitator in one bulk request, with the facilitator document if given
+    (a new database, which isn't read), and add them to the manifest. The levels
+    that already have documents are left to the next sync. Returns the number of
+    documents created and the errors.
+    """
+    tasks = list(
+        Task.objects.select_related("project", "phase", "activity").order_by(
+            "phase__order", "activity__order", "order"
+        )
+    )
+    design_docs = get_tasks_design_documents("process_design", tasks)
+    fingerprints = get_fingerprints(tasks, design_docs)
+    template = get_process_template(
+        get_design_version(fingerprints, design_docs), tasks, design_docs
+    )
+
+    nsc = NoSQLClient()
+    db = nsc.get_db(facilitator.no_sql_db_name)
+    if facilitator_doc is None:
+        manifest = nsc.get_local_document(db, MANIFEST)
+        existing = get_administrative_levels_with_documents(
+            nsc, db, administrative_levels
+        )
+        administrative_levels = [
+            administrative_level
+            for administrative_level in administrative_levels
+            if administrative_level["id"] not in existing
+        ]
+    else:
+        manifest = {"administrative_levels": [], "tasks": {}}
+        manifest["tasks"] = {
+            str(task.id): fingerprints[task.id]
+            for task in tasks
+            if task.id in template.task_ids
+        }
+
+    created, errors = materialize_villages(
+        nsc,
+        db,
+        template,
+        administrative_levels,
+        [facilitator_doc] if facilitator_doc else [],
+    )
+    if not errors and manifest is not None and administrative_levels:
+        manifest["administrative_levels"] = sorted(
+            set(manifest.get("administrative_levels", []))
+            | {str(level["id"]) for level in administrative_levels}
+        )
+        nsc.put_local_document(db, MANIFEST, manifest)
+    return created, errors
+
+
+def run_concurrently(func, facilitators, concurrency, *args):
+    """
+    Call func(facilitator, *args) for each facilitator, `concurrency` at a time,
+    and yield the facilitators with their future as they complete
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            # Each job runs in a copy of the context, so that its CouchDB requests
+            # are counted by the collector of the caller (no_sql_instrumentation)
+            executor.submit(
+                contextvars.copy_context().run, func, facilitator, *args
+            ): facilitator
+            for facilitator in facilitators
+        }
+        for future in as_completed(futures):
+            yield futures[future], future
+
+
+def run_measured(facilitator, func, *args):
+    """
+    Call func(facilitator, *args), counting its CouchDB requests. Returns the
+    SyncRunDatabase of the facilitator (not saved yet) with its timings and
+    requests, the result of func and the exception it raised, if any.
+    """
+    database = SyncRunDatabase(
+        facilitator=facilitator,
+        db_name=facilitator.no_sql_db_name,
+        started_on=timezone.now(),
+    )
+    started = time.perf_counter()
+    result = exception = None
+    with collect_no_sql_requests() as collector:
+        try:
+            result = func(facilitator, *args)
+        except Exception as exc:
+            exception = exc
+    database.duration = round(time.perf_counter() - started, 2)
+    database.finished_on = timezone.now()
+    database.requests = collector.count
+    database.bytes = collector.bytes
+    return database, result, exception
+
+
+def diff_facilitator(facilitator, tasks, design_docs):
+    """
+    Plan every task in the database of the facilitator without writing, and
+    return the report of the plan (see FacilitatorPlan.get_report)
+    """
+    nsc = NoSQLClient()
+    db = nsc.get_db(facilitator.no_sql_db_name)
+    plan = plan_facilitator_database(nsc, db, tasks, design_docs)
+    if plan.facilitator is None:
+        return {"error": "No facilitator document"}
+    return plan.get_report(tasks)
+
+
+def run_dry_run(database, tasks, facilitators, concurrency=None, progress=None):
+    """
+    Report, without writing anything, the documents a sync of the tasks would
+    create and update in the database of each facilitator, with the changed
+    fields, and the documents no task accounts for. Only bulk reads are made:
+    the design documents once, then one _find per facilitator database.
+    progress(db_name, report) is called in the calling thread after each one.
+    """
+    # The design documents of the rows saved since the last drain must exist first
+    flush()
+    tasks = list(tasks)
+    concurrency = concurrency or settings.NO_SQL_CONCURRENCY
+    design_docs = get_tasks_design_documents(database, tasks)
+    fingerprints = get_fingerprints(tasks, design_docs)
+    totals = {"created": 0, "updated": 0, "unchanged": 0, "orphaned": 0, "failed": 0}
+    databases = {}
+    for facilitator, future in run_concurrently(
+        diff_facilitator, facilitators, concurrency, tasks, design_docs
+    ):
+        try:
+            report = future.result()
+        except Exception as exc:
+            report = {"error": str(exc) or exc.__class__.__name__}
+        if "error" in report:
+            totals["failed"] += 1
+        else:
+            for key in ("created", "updated", "unchanged"):
+                totals[key] += report[key]
+            totals["orphaned"] += len(report["orphaned"])
+        databases[facilitator.no_sql_db_name] = report
+        if progress:
+            progress(facilitator.no_sql_db_name, report)
+    return {
+        "design_version": get_design_version(fingerprints, design_docs),
+        "totals": totals,
+        "databases": dict(sorted(databases.items())),
+    }
+
+
+def run_sync(
+    database,
+    tasks,
+    facilitators,
+    concurrency=None,
+    force=False,
+    incremental=True,
+    progress=None,
+):
+    """
+    Sync the tasks into the databases of the facilitators, `concurrency` of them at
+    a time (NO_SQL_CONCURRENCY by default). Unless incremental is False, only the
+    tasks that changed since the last sync of a database are planned.
+    progress(result) is called in the calling thread after each database with a
+    dict holding the facilitator, its status, the read/created/updated/unchanged
+    counts, the error and the duration. The run is recorded in the SyncRun ledger.
+    Returns the totals of the run, with the id of its SyncRun.
+    """
+    # The design documents of the rows saved since the last drain must exist first
+    flush()
+    tasks = list(tasks)
+    facilitators = list(facilitators)
+    concurrency = concurrency or settings.NO_SQL_CONCURRENCY
+    design_docs = get_tasks_design_documents(database, tasks)
+    fingerprints = get_fingerprints(tasks, design_docs)
+    design_version = get_design_version(fingerprints, design_docs)
+    template = None
+    if incremental:
+        template = get_process_template(design_version, tasks, design_docs)
+
+    administrative_levels_versions = get_administrative_levels_versions(facilitators)
+    states = {
+        state.facilitator_id: state
+        for state in FacilitatorSyncState.objects.filter(facilitator__in=facilitators)
+    }
+    summary = {
+        "synced": 0,
+        "skipped": 0,
+        "failed": 0,
+        "read": 0,
+        "created": 0,
+        "updated": 0,
+        "unchanged": 0,
+    }
+    pending = {}
+    for facilitator in facilitators:
+        state = states.get(facilitator.id)
+        if (
+            state
+            and not force
+            and state.is_current(
+                design_version, administrative_levels_versions[facilitator.id]
+            )
+        ):
+            summary["skipped"] += 1
+            continue
+        if state is None:
+            state = FacilitatorSyncState(facilitator=facilitator)
+        state.status = FacilitatorSyncState.RUNNING
+        state.error = ""
+        state.started_on = timezone.now()
+        state.finished_on = None
+        state.save()
+        pending[facilitator] = state
+
+    run = SyncRun.objects.create(
+        kind=SyncRun.SYNC, design_version=design_version, skipped=summary["skipped"]
+    )
+    run_error = ""
+    try:
+        for facilitator, future in run_concurrently(
+            run_measured,
+            list(pending),
+            concurrency,
+            sync_facilitator,
+            tasks,
+            design_docs,
+            fingerprints,
+            incremental,
+            template,
+        ):
+            state = pending[facilitator]
+            database, result, exception = future.result()
+            counts = {"read": 0, "created": 0, "updated": 0, "unchanged": 0}
+            duration = database.duration
+            if exception is None:
+                counts, errors, duration = result
+                error = "\n".join(json.dumps(error) for error in errors)
+            else:
+                error = str(exception) or exception.__class__.__name__
+
+            state.status = (
+                FacilitatorSyncState.FAILED if error else FacilitatorSyncState.DONE
+            )
+            state.design_version = design_version if not error else ""
+            state.administrative_levels_version = (
+                administrative_levels_versions[facilitator.id] if not error else ""
+            )
+            state.error = error
+            state.created = counts["created"]
+            state.updated = counts["updated"]
+            state.unchanged = counts["unchanged"]
+            state.finished_on = timezone.now()
+            state.save()
+
+            database.status = SyncRun.FAILED if error else SyncRun.DONE
+            database.error = error
+            for key, value in counts.items():
+                setattr(database, key, value)
+            run.add(database)
+
+            summary["failed" if error else "synced"] += 1
+            for key, value in counts.items():
+                summary[key] += value
+            if progress:
+                progress(
+                    {
+                        "facilitator": facilitator,
+                        "status": state.status,
+                        "error": error,
+                        "duration": duration,
+                        **counts,
+                    }
+                )
+    except BaseException as exc:
+        run_error = str(exc) or exc.__class__.__name__
+        raise
+    finally:
+        run.finish(run_error)
+    summary["run"] = run.id
+    return summary
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from dashboard.sync_runs import views
+
+app_name = "sync_runs"
+urlpatterns = [
+    path("", views.SyncRunListView.as_view(), name="list"),
+]
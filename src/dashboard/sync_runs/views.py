@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from django.views import generic
+
+from authentication.permissions import AdminPermissionRequiredMixin
+from dashboard.mixins import PageMixin
+from process_manager.models import SyncRun, SyncRunDatabase
+
+
+class SyncRunListView(
+    PageMixin, LoginRequiredMixin, AdminPermissionRequiredMixin, generic.ListView
+):
+    """
+    Recent sync runs, with the slowest facilitator databases and the ones failing
+    the most over the last `days` days
+    """
+
+    model = SyncRun
+    template_name = "sync_runs/list.html"
+    context_object_name = "runs"
+    title = gettext_lazy("Sync runs")
+    active_level1 = "sync_runs"
+    breadcrumb = [
+        {"url": "", "title": title},
+    ]
+    limit = 20
+
+    def get_queryset(self):
+        return SyncRun.objects.annotate(
+            databases_count=Count("databases"),
+            average_duration=Avg("databases__duration"),
+        ).order_by("-started_on")[: self.limit]
+
+    def get_days(self):
+        try:
+            return max(int(self.request.GET.get("days", 7)), 1)
+        except ValueError:
+            return 7
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        days = self.get_days()
+        databases = SyncRunDatabase.objects.filter(
+            started_on__gte=timezone.now() - timedelta(days=days)
+        ).values("db_name")
+        context["days"] = days
+        context["slowest_databases"] = databases.annotate(
+            runs=Count("id"),
+            average_duration=Avg("duration"),
+            max_duration=Max("duration"),
+            average_requests=Avg("requests"),
+            average_read=Avg("read"),
+        ).order_by("-average_duration")[: self.limit]
+        context["failing_databases"] = (
+            databases.annotate(
+                runs=Count("id"),
+                failures=Count("id", filter=Q(status=SyncRun.FAILED)),
+                last_failure=Max("started_on", filter=Q(status=SyncRun.FAILED)),
+            )
+            .filter(failures__gt=0)
+            .order_by("-failures", "-last_failure")[: self.limit]
+        )
+        return context
@@ -0,0 +1,346 @@
+# Rollup of the task copies of the facilitator databases in TaskProgress, read by
+# the diagnostics of the dashboard instead of the facilitator databases. Every
+# copy of a task in a village (an administrative level with a numeric id) gets a
+# row with its completion and the administrative levels above the village, read
+# from the administrative level tree (see administrativelevels.tree).
+#
+# The follow_changes command keeps the rows current from the _changes feeds (see
+# process_manager.change_handlers) and the rebuild_task_progress command fills
+# them from scratch, with one _find of the tasks per facilitator database.
+#
+# The totals of every administrative level are computed at once for the map of
+# the diagnostics, and kept for as long as the version of the rows (and of the
+# villages of the facilitators and of the administrative level tree giving the
+# region names) doesn't change. Like the diagnostics always did, the totals of a
+# locality only count the villages assigned to the facilitators (FacilitatorVillage),
+# each facilitator of a village counting it once, and the tasks of those villages.
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Sum
+from django.db.models.functions import Coalesce
+
+from administrativelevels.tree import administrative_level_tree
+from authentication.models import Facilitator, FacilitatorVillage
+from dashboard.sync_runner import run_concurrently
+from no_sql_client import NoSQLClient
+from process_manager.models import Task, TaskProgress
+
+ANCESTOR_LEVELS = ["canton", "commune", "prefecture", "region"]
+LOCALITY_LEVELS = ["region", "prefecture", "commune", "canton", "village"]
+# Fields of the totals of an administrative level in get_locality_totals
+LOCALITY_FIELDS = [
+    "nbr_tasks",
+    "nbr_tasks_completed",
+    "nbr_facilitators",
+    "nbr_villages",
+    "region_id",
+]
+TASK_FIELDS = ["_id", "sql_id", "administrative_level_id", "completed"]
+
+
+def get_village_id(doc):
+    village_id = str(doc.get("administrative_level_id"))
+    return village_id if village_id.isdigit() else None
+
+
+def get_ancestors(village_ids):
+    """
+    Return the ids of the canton, commune, prefecture and region of each village,
+    as the fields of its TaskProgress rows
+    """
+    tree = administrative_level_tree.get()
+    ancestors = {}
+    for village_id in village_ids:
+        ancestors[village_id] = {}
+        for level in ANCESTOR_LEVELS:
+            ancestor = tree.get_ancestor(village_id, level)
+            if ancestor:
+                ancestors[village_id][f"{level}_id"] = str(
+                    ancestor["administrative_id"]
+                )
+    return ancestors
+
+
+def get_administrative_level_names(administrative_ids):
+    """
+    Return the names of the administrative levels by administrative_id
+    """
+    tree = administrative_level_tree.get()
+    return {
+        administrative_id: tree.get(administrative_id).get("name")
+        for administrative_id in administrative_ids
+        if administrative_id in tree
+    }
+
+
+def get_tasks(docs):
+    """
+    Return the tasks of the task documents by sql_id
+    """
+    sql_ids = {doc.get("sql_id") for doc in docs if isinstance(doc.get("sql_id"), int)}
+    return Task.objects.only("project_id", "phase_id", "activity_id").in_bulk(sql_ids)
+
+
+def get_progress_rows(facilitator, docs, tasks, ancestors):
+    """
+    Return the TaskProgress rows of the task documents of the facilitator
+    database, one per village and task
+    """
+    rows = {}
+    for doc in docs:
+        village_id = get_village_id(doc)
+        task = tasks.get(doc.get("sql_id"))
+        if village_id is None or task is None:
+            continue
+        rows[(village_id, task.id)] = TaskProgress(
+            facilitator=facilitator,
+            village_id=village_id,
+            project_id=task.project_id,
+            phase_id=task.phase_id,
+            activity_id=task.activity_id,
+            task_id=task.id,
+            doc_id=doc["_id"],
+            completed=int(bool(doc.get("completed"))),
+            **ancestors.get(village_id, {}),
+        )
+    return list(rows.values())
+
+
+def update_task_progress(task_docs, deleted=None):
+    """
+    Write the rows of the task documents (database name -> documents) and remove
+    the ones of the deleted documents (database name -> _ids). Returns the number
+    of rows written.
+    """
+    deleted = deleted or {}
+    facilitators = Facilitator.objects.filter(
+        no_sql_db_name__in=set(task_docs) | set(deleted)
+    )
+    docs = [doc for db_docs in task_docs.values() for doc in db_docs]
+    tasks = get_tasks(docs)
+    village_ids = {get_village_id(doc) for doc in docs} - {None}
+    ancestors = get_ancestors(village_ids) if village_ids else {}
+
+    written = 0
+    with transaction.atomic():
+        for facilitator in facilitators:
+            db_name = facilitator.no_sql_db_name
+            rows = get_progress_rows(
+                facilitator, task_docs.get(db_name, []), tasks, ancestors
+            )
+            doc_ids = set(deleted.get(db_name, ())) | {
+                doc["_id"] for doc in task_docs.get(db_name, [])
+            }
+            TaskProgress.objects.filter(
+                facilitator=facilitator, doc_id__in=doc_ids
+            ).delete()
+            TaskProgress.objects.bulk_create(rows, ignore_conflicts=True)
+            written += len(rows)
+    return written
+
+
+def read_task_documents(facilitator):
+    nsc = NoSQLClient()
+    return nsc.find_documents(
+        nsc.get_db(facilitator.no_sql_db_name), {"type": "task"}, fields=TASK_FIELDS
+    )
+
+
+def rebuild_task_progress(facilitators=None, concurrency=None):
+    """
+    Replace the rows of the facilitators, every facilitator by default, by the
+    ones of the tasks of their databases, `concurrency` databases read at a time.
+    Returns the number of databases rebuilt and failed, and of rows written.
+    """
+    if facilitators is None:
+        facilitators = Facilitator.objects.all()
+    ancestors = {}
+    summary = {"databases": 0, "failed": 0, "rows": 0}
+    for facilitator, future in run_concurrently(
+        read_task_documents,
+        list(facilitators),
+        concurrency or settings.NO_SQL_CONCURRENCY,
+    ):
+        try:
+            docs = future.result()
+            village_ids = {get_village_id(doc) for doc in docs} - {None}
+            missing = village_ids - set(ancestors)
+            if missing:
+                ancestors.update(get_ancestors(missing))
+        except Exception as exc:
+            print(facilitator.no_sql_db_name, exc)
+            summary["failed"] += 1
+            continue
+        rows = get_progress_rows(facilitator, docs, get_tasks(docs), ancestors)
+        with transaction.atomic():
+            TaskProgress.objects.filter(facilitator=facilitator).delete()
+            TaskProgress.objects.bulk_create(
+                rows, batch_size=settings.NO_SQL_BULK_SIZE, ignore_conflicts=True
+            )
+        summary["databases"] += 1
+        summary["rows"] += len(rows)
+    return summary
+
+
+def get_assigned_task_progress(progress):
+    """
+    Return the rows of the queryset in a village assigned to their facilitator
+    """
+    return progress.filter(
+        Exists(
+            FacilitatorVillage.objects.filter(
+                facilitator=OuterRef("facilitator"),
+                administrative_id=OuterRef("village_id"),
+            )
+        )
+    )
+
+
+def get_task_progress_version(progress, villages):
+    """
+    Return a version of the rows of the queryset, of the FacilitatorVillage rows of
+    the villages queryset and of the administrative level tree, changing with any
+    row written or deleted
+    """
+    version = progress.aggregate(
+        rows=Count("id"),
+        completed=Coalesce(Sum("completed"), 0),
+        last_id=Max("id"),
+        updated_on=Max("updated_on"),
+    )
+    version["villages"] = villages.aggregate(rows=Count("id"), last_id=Max("id"))
+    version["administrative_levels"] = administrative_level_tree.get().update_seq
+    return hashlib.sha1(
+        json.dumps(version, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def get_locality_villages(level, administrative_id):
+    """
+    Return the ids of the villages of the administrative level
+    """
+    if level == "village":
+        return [str(administrative_id)]
+    return [
+        str(village["administrative_id"])
+        for village in administrative_level_tree.get().get_descendants(
+            administrative_id, "village"
+        )
+    ]
+
+
+def get_locality_total(progress, villages, level, administrative_id):
+    """
+    Return the values of LOCALITY_FIELDS of the administrative level, from the rows
+    of the progress queryset and the FacilitatorVillage rows of the villages
+    queryset
+    """
+    totals = (
+        get_assigned_task_progress(progress)
+        .filter(**{f"{level}_id": str(administrative_id)})
+        .aggregate(
+            nbr_tasks=Coalesce(Sum("total"), 0),
+            nbr_tasks_completed=Coalesce(Sum("completed"), 0),
+        )
+    )
+    villages = villages.filter(
+        administrative_id__in=get_locality_villages(level, administrative_id)
+    )
+    totals["nbr_villages"] = villages.count()
+    totals["nbr_facilitators"] = villages.values("facilitator").distinct().count()
+    region = None
+    if totals["nbr_villages"]:
+        region = administrative_level_tree.get().get_region(administrative_id)
+        if level == "region":
+            region = administrative_level_tree.get().get(administrative_id)
+    totals["region_id"] = str(region["administrative_id"]) if region else None
+    return totals
+
+
+_locality_totals_lock = threading.Lock()
+_locality_totals = (None, None)  # (version, totals)
+
+
+def get_locality_totals(progress, villages, version):
+    """
+    Return the totals of the rows of the progress queryset and of the
+    FacilitatorVillage rows of the villages queryset for every administrative
+    level, level -> administrative_id -> the values of LOCALITY_FIELDS, with the
+    names of the regions. The totals of the last version asked for are kept.
+    """
+    global _locality_totals
+    with _locality_totals_lock:
+        if _locality_totals[0] == version:
+            return _locality_totals[1]
+
+    levels = {}
+    progress = get_assigned_task_progress(progress)
+    for level in LOCALITY_LEVELS:
+        rows = (
+            progress.exclude(**{f"{level}_id": ""})
+            .values(f"{level}_id")
+            .annotate(
+                nbr_tasks=Coalesce(Sum("total"), 0),
+                nbr_tasks_completed=Coalesce(Sum("completed"), 0),
+                region=Max("region_id"),
+            )
+            .order_by()
+        )
+        levels[level] = {
+            row[f"{level}_id"]: [
+                row["nbr_tasks"],
+                row["nbr_tasks_completed"],
+                0,
+                0,
+                row["region"],
+            ]
+            for row in rows
+        }
+
+    # The villages and facilitators are counted from the villages assigned to the
+    # facilitators, the ones without tasks included
+    assigned = [
+        (facilitator_id, village_id)
+        for facilitator_id, village_id in villages.values_list(
+            "facilitator_id", "administrative_id"
+        )
+        if village_id.isdigit()
+    ]
+    ancestors = get_ancestors({village_id for _, village_id in assigned})
+    facilitators = {}  # (level, administrative_id) -> facilitator ids
+    for facilitator_id, village_id in assigned:
+        administrative_ids = {**ancestors[village_id], "village_id": village_id}
+        for level in LOCALITY_LEVELS:
+            administrative_id = administrative_ids.get(f"{level}_id")
+            if not administrative_id:
+                continue
+            values = levels[level].setdefault(
+                administrative_id,
+                [0, 0, 0, 0, administrative_ids.get("region_id")],
+            )
+            values[3] += 1
+            facilitators.setdefault((level, administrative_id), set()).add(
+                facilitator_id
+            )
+    for (level, administrative_id), facilitator_ids in facilitators.items():
+        levels[level][administrative_id][2] = len(facilitator_ids)
+
+    region_ids = {
+        values[4]
+        for administrative_levels in levels.values()
+        for values in administrative_levels.values()
+        if values[4]
+    }
+    totals = {
+        "fields": LOCALITY_FIELDS,
+        "levels": levels,
+        "regions": get_administrative_level_names(region_ids),
+    }
+
+    with _locality_totals_lock:
+        _locality_totals = (version, totals)
+    return totals
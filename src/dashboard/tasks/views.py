@@ -12,6 +12,8 @@ from process_manager.models import Phase, Activity, Project, Task
 from dashboard.tasks.forms import TaskForm, UpdateTaskForm
 from dashboard.mixins import AJAXRequestMixin, PageMixin, JSONResponseMixin
 from no_sql_client import NoSQLClient
+from process_manager.cache import process_design_cache
+from dashboard.propagation import enqueue_propagation, get_deletions, get_updates
 
 from authentication.permissions import (
     CDDSpecialistPermissionRequiredMixin,
@@ -90,29 +92,18 @@ def delete(request, id):
     task = Task.objects.get(id=id)
     activity_id = task.activity.id
     if request.method == "POST":
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": task.couch_id})[0]
-        if new_document:
-            activity = Activity.objects.get(id=task.activity_id)
-            docu = {"total_tasks": activity.total_tasks}
-            query_result = nsc_database.get_query_result(
-                {"_id": task.activity.couch_id}
-            )[:]
-            doc = nsc_database[query_result[0]["_id"]]
-            nsc.update_doc(nsc_database, doc["_id"], docu)
-            nsc.delete_document(nsc_database, task.couch_id)
-            task.delete()
-            activity.total_tasks = (
-                Task.objects.filter(activity_id=activity.id).all().count()
-            )
-            activity.save()
-            tasks = list(Task.objects.filter(activity_id=activity_id))
-            return render(
-                request,
-                "activities/activity_detail.html",
-                context={"activity": activity, "tasks": tasks},
-            )
+        deleted = get_deletions(task)
+        # The document and the task counters of the activity are moved by the
+        # delete
+        task.delete()
+        activity = Activity.objects.get(id=activity_id)
+        enqueue_propagation(deleted, get_updates(activity))
+        tasks = list(Task.objects.filter(activity_id=activity_id))
+        return render(
+            request,
+            "activities/activity_detail.html",
+            context={"activity": activity, "tasks": tasks},
+        )
 
     return render(request, "tasks/task_confirm_delete.html", {"task": task})
 
@@ -142,8 +133,7 @@ class UpdateTaskView(
             self.task = self.get_object()
             self.task_db_name = "process_design"
             self.task_db = nsc.get_db(self.task_db_name)
-            query_result = self.task_db.get_query_result({"type": "task"})[:]
-            self.doc = self.task_db[query_result[0]["_id"]]
+            self.doc = process_design_cache.get(self.task.couch_id)
         except Exception:
             raise Http404
         return super().dispatch(request, *args, **kwargs)
@@ -179,15 +169,6 @@ class UpdateTaskView(
         task.name = data["name"]
         task.description = data["description"]
         task.save()
-        doc = {
-            "name": data["name"],
-            "description": data["description"],
-            "sql_id": task.id,
-        }
-        nsc = NoSQLClient()
-        query_result = self.task_db.get_query_result({"_id": task.couch_id})[:]
-        self.doc = self.task_db[query_result[0]["_id"]]
-        nsc.update_doc(self.task_db, self.doc["_id"], doc)
 
         activity = Activity.objects.get(id=task.activity_id)
         tasks = list(
@@ -275,16 +256,7 @@ def changeOrderUp(request, id):
                         taskPrev.order = taskPrev.order + 1
             taskPrev.save()
             task.save()
-            doc = {"order": task.order}
-            docPrev = {"order": taskPrev.order}
-            nsc = NoSQLClient()
-            task_db = nsc.get_db("process_design")
-            query_result = task_db.get_query_result({"_id": task.couch_id})[:]
-            query_result_prev = task_db.get_query_result({"_id": taskPrev.couch_id})[:]
-            docu = task_db[query_result[0]["_id"]]
-            docPrevU = task_db[query_result_prev[0]["_id"]]
-            nsc.update_doc(task_db, docu["_id"], doc)
-            nsc.update_doc(task_db, docPrevU["_id"], docPrev)
+            enqueue_propagation(updated=get_updates(task, taskPrev))
         else:
             if task.order > 0:
                 if task.order == 1:
@@ -292,12 +264,7 @@ def changeOrderUp(request, id):
                 else:
                     task.order = task.order - 1
                     task.save()
-                    doc = {"order": task.order}
-                    nsc = NoSQLClient()
-                    task_db = nsc.get_db("process_design")
-                    query_result = task_db.get_query_result({"_id": task.couch_id})[:]
-                    docu = task_db[query_result[0]["_id"]]
-                    nsc.update_doc(task_db, docu["_id"], doc)
+                    enqueue_propagation(updated=get_updates(task))
 
     activity = Activity.objects.get(id=task.activity.id)
     tasks = list(Task.objects.filter(activity_id=activity.id).order_by("order"))
@@ -324,26 +291,12 @@ def changeOrderDown(request, id):
                     taskNext.order = taskNext.order - 1
             taskNext.save()
             task.save()
-            doc = {"order": task.order}
-            docNext = {"order": taskNext.order}
-            nsc = NoSQLClient()
-            task_db = nsc.get_db("process_design")
-            query_result = task_db.get_query_result({"_id": task.couch_id})[:]
-            query_result_next = task_db.get_query_result({"_id": taskNext.couch_id})[:]
-            docu = task_db[query_result[0]["_id"]]
-            docNextU = task_db[query_result_next[0]["_id"]]
-            nsc.update_doc(task_db, docu["_id"], doc)
-            nsc.update_doc(task_db, docNextU["_id"], docNext)
+            enqueue_propagation(updated=get_updates(task, taskNext))
         else:
             if task.order < task_count:
                 task.order = task.order + 1
                 task.save()
-                doc = {"order": task.order}
-                nsc = NoSQLClient()
-                task_db = nsc.get_db("process_design")
-                query_result = task_db.get_query_result({"_id": task.couch_id})[:]
-                docu = task_db[query_result[0]["_id"]]
-                nsc.update_doc(task_db, docu["_id"], doc)
+                enqueue_propagation(updated=get_updates(task))
 
     activity = Activity.objects.get(id=task.activity.id)
     tasks = list(Task.objects.filter(activity_id=activity.id).order_by("order"))
@@ -0,0 +1,412 @@
+from unittest import mock
+
+from django.urls import reverse
+
+from dashboard.planner import get_document_id, plan_facilitator_database
+from dashboard.propagation import (
+    enqueue_propagation,
+    get_deletions,
+    get_updates,
+    propagate_structure,
+)
+from dashboard.sync_runner import MANIFEST, run_dry_run, run_sync
+from dashboard.utils import get_tasks_design_documents
+from no_sql_client import NoSQLClient
+from no_sql_instrumentation import collect_no_sql_requests
+from no_sql_views import (
+    DESIGN_DOCUMENT_ID,
+    FACILITATOR_DESIGN_DOCUMENTS,
+    ensure_design_documents,
+    get_percentage,
+    get_task_completion,
+)
+from process_manager.cache import process_design_cache
+from process_manager.models import OutboxMessage, Task
+from process_manager.outbox import flush
+from process_manager.tests import FakeCouchDBTestCase
+
+VILLAGES = [{"id": "1", "name": "Village 1"}, {"id": "2", "name": "Village 2"}]
+
+
+class TestFacilitatorPlan(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.facilitator, self.db = self.create_facilitator(
+            administrative_levels=VILLAGES
+        )
+        self.create_process(tasks=2)
+        flush()
+
+    def get_tasks(self):
+        return list(
+            Task.objects.select_related("project", "phase", "activity").order_by("id")
+        )
+
+    def plan(self, design_docs=None):
+        tasks = self.get_tasks()
+        design_docs = design_docs or get_tasks_design_documents("process_design", tasks)
+        return plan_facilitator_database(self.nsc, self.db, tasks, design_docs)
+
+    def get_task_doc(self, task, administrative_level_id="1"):
+        return self.get_doc(
+            self.db.database_name,
+            get_document_id(
+                self.db.database_name, administrative_level_id, "task", task.id
+            ),
+        )
+
+    def test_create(self):
+        plan = self.plan()
+        # The project, then a phase, an activity and 2 tasks in each village
+        self.assertEqual(plan.get_summary()["created"], 9)
+        self.assertEqual(plan.apply(self.nsc, self.db), [])
+
+        task = self.get_tasks()[0]
+        doc = self.get_task_doc(task)
+        self.assertEqual(doc["name"], task.name)
+        self.assertEqual(doc["administrative_level_name"], "Village 1")
+        self.assertEqual(len(self.nsc.find_documents(self.db, {"type": "task"})), 4)
+
+    def test_update(self):
+        self.plan().apply(self.nsc, self.db)
+        # The first update fills the dates of the new tasks in
+        self.plan().apply(self.nsc, self.db)
+        self.assertEqual(self.plan().get_summary()["updated"], 0)
+
+        task = self.get_tasks()[0]
+        task.name = "Renamed"
+        task.save()
+        flush()
+
+        plan = self.plan()
+        self.assertEqual(
+            plan.get_summary(), {"created": 0, "updated": 2, "unchanged": 7}
+        )
+        report = plan.get_report()
+        self.assertEqual(
+            report["to_update"][0]["fields"], {"name": ["Task 1", "Renamed"]}
+        )
+        self.assertEqual(plan.apply(self.nsc, self.db), [])
+        self.assertEqual(self.get_task_doc(task, "2")["name"], "Renamed")
+
+    def test_orphans(self):
+        self.plan().apply(self.nsc, self.db)
+        task = self.get_task_doc(self.get_tasks()[0])
+        del task["_rev"]
+        self.nsc.bulk_upsert(
+            self.db,
+            [
+                {**task, "_id": "old_village", "administrative_level_id": "3"},
+                {**task, "_id": "deleted_task", "sql_id": 0, "order": 0},
+                {**task, "_id": "duplicate"},
+            ],
+        )
+
+        report = self.plan().get_report(self.get_tasks())
+        self.assertEqual(
+            sorted((doc["_id"], doc["reason"]) for doc in report["orphaned"]),
+            [
+                ("deleted_task", "sql_id"),
+                ("duplicate", "duplicate"),
+                ("old_village", "administrative_level"),
+            ],
+        )
+
+    def test_conflict_keeps_the_tablet_fields(self):
+        self.plan().apply(self.nsc, self.db)
+        self.plan().apply(self.nsc, self.db)
+        task = self.get_tasks()[0]
+        task.name = "Renamed"
+        task.save()
+        flush()
+        tasks = self.get_tasks()
+        design_docs = get_tasks_design_documents("process_design", tasks)
+        design_docs[task.couch_id]["attachments"] = [
+            {"name": "Report", "url": None},
+            {"name": "Photo", "url": None},
+        ]
+        plan = self.plan(design_docs)
+
+        # The tablet writes the task after the plan read it
+        doc = self.get_task_doc(task)
+        self.nsc.bulk_upsert(
+            self.db,
+            [
+                {
+                    **doc,
+                    "completed": True,
+                    "completed_date": "2024-1-2 3:4:5",
+                    "attachments": [{"name": "Report", "url": "/attachments/1"}],
+                }
+            ],
+        )
+
+        self.assertEqual(plan.apply(self.nsc, self.db), [])
+        doc = self.get_task_doc(task)
+        self.assertEqual(doc["name"], "Renamed")
+        self.assertTrue(doc["completed"])
+        self.assertEqual(doc["completed_date"], "2024-1-2 3:4:5")
+        self.assertEqual(
+            doc["attachments"],
+            [
+                {"name": "Report", "url": "/attachments/1"},
+                {"name": "Photo", "url": None},
+            ],
+        )
+
+
+class TestSyncState(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.facilitator, self.db = self.create_facilitator(
+            administrative_levels=VILLAGES[:1]
+        )
+        self.facilitator.set_villages(VILLAGES[:1])
+        self.create_process()
+
+    def sync(self):
+        tasks = Task.objects.select_related("project", "phase", "activity")
+        return run_sync("process_design", tasks, [self.facilitator])
+
+    def test_unchanged_facilitator_is_skipped(self):
+        self.assertEqual(self.sync()["synced"], 1)
+        self.assertEqual(self.sync()["skipped"], 1)
+
+    def test_new_village_is_synced(self):
+        self.sync()
+        (doc,) = self.nsc.find_documents(self.db, {"type": "facilitator"})
+        self.nsc.bulk_upsert(self.db, [{**doc, "administrative_levels": VILLAGES}])
+        self.facilitator.set_villages(VILLAGES)
+
+        summary = self.sync()
+        self.assertEqual(summary["synced"], 1)
+        self.assertEqual(len(self.nsc.find_documents(self.db, {"type": "task"})), 2)
+
+
+class TestIncrementalSync(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.facilitator, self.db = self.create_facilitator(
+            administrative_levels=VILLAGES
+        )
+        self.create_process(tasks=2)
+
+    def sync(self, **kwargs):
+        tasks = Task.objects.select_related("project", "phase", "activity")
+        return run_sync("process_design", tasks, [self.facilitator], **kwargs)
+
+    def get_task_docs(self):
+        return self.nsc.find_documents(self.db, {"type": "task"})
+
+    def test_first_sync(self):
+        summary = self.sync()
+        self.assertEqual(summary["synced"], 1)
+        self.assertEqual(len(self.get_task_docs()), 4)
+        manifest = self.nsc.get_local_document(self.db, MANIFEST)
+        self.assertEqual(manifest["administrative_levels"], ["1", "2"])
+        self.assertEqual(len(manifest["tasks"]), 2)
+
+    def test_unchanged_design_is_skipped(self):
+        self.sync()
+        summary = self.sync()
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual(summary["synced"], 0)
+
+    def test_changed_task_is_planned_again(self):
+        self.sync()
+        task = Task.objects.order_by("id").first()
+        task.name = "Renamed"
+        task.save()
+
+        summary = self.sync()
+        self.assertEqual(summary["synced"], 1)
+        self.assertEqual(summary["updated"], 2)
+        names = {doc["name"] for doc in self.get_task_docs()}
+        self.assertEqual(names, {"Renamed", "Task 2"})
+
+        # Only the documents the renamed task can touch were read
+        full = self.sync(force=True, incremental=False)
+        self.assertLess(summary["read"], full["read"])
+
+    def test_changed_design_document_is_planned_again(self):
+        self.sync()
+        task = Task.objects.order_by("id").first()
+        doc = self.get_doc("process_design", task.couch_id)
+        doc["support_attachments"] = [{"name": "guide.pdf"}]
+        self.nsc.bulk_upsert(self.nsc.get_db("process_design"), [doc])
+        process_design_cache.invalidate(task.couch_id)
+
+        summary = self.sync()
+        self.assertEqual(summary["updated"], 2)
+        attachments = [
+            doc.get("support_attachments")
+            for doc in self.get_task_docs()
+            if doc["sql_id"] == task.id
+        ]
+        self.assertEqual(attachments, [[{"name": "guide.pdf"}]] * 2)
+
+
+class TestDryRun(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.facilitator, self.db = self.create_facilitator(
+            administrative_levels=VILLAGES
+        )
+        self.create_process(tasks=2)
+
+    def get_tasks(self):
+        return Task.objects.select_related("project", "phase", "activity")
+
+    def test_report(self):
+        run_sync("process_design", self.get_tasks(), [self.facilitator])
+        # The first full sync fills the dates of the new tasks in
+        run_sync(
+            "process_design",
+            self.get_tasks(),
+            [self.facilitator],
+            force=True,
+            incremental=False,
+        )
+        task = Task.objects.order_by("id").first()
+        task.name = "Renamed"
+        task.save()
+        empty, _ = self.create_facilitator("empty")
+        self.nsc.bulk_delete(
+            self.nsc.get_db(empty.no_sql_db_name),
+            self.nsc.find_documents(
+                self.nsc.get_db(empty.no_sql_db_name), {"type": "facilitator"}
+            ),
+        )
+        seq = self.nsc.get_changes(self.db, limit=1, include_docs=False)
+
+        report = run_dry_run(
+            "process_design", self.get_tasks(), [self.facilitator, empty]
+        )
+        self.assertEqual(
+            report["totals"],
+            {"created": 0, "updated": 2, "unchanged": 7, "orphaned": 0, "failed": 1},
+        )
+        database = report["databases"][self.facilitator.no_sql_db_name]
+        self.assertEqual(
+            [doc["fields"] for doc in database["to_update"]],
+            [{"name": ["Task 1", "Renamed"]}] * 2,
+        )
+        self.assertEqual(
+            report["databases"][empty.no_sql_db_name],
+            {"error": "No facilitator document"},
+        )
+        # Nothing was written
+        self.assertEqual(
+            self.nsc.get_changes(self.db, limit=1, include_docs=False)["pending"],
+            seq["pending"],
+        )
+
+
+class TestPropagation(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.facilitator, self.db = self.create_facilitator(
+            administrative_levels=VILLAGES
+        )
+        _, self.phase, self.activity = self.create_process(tasks=2)
+        tasks = Task.objects.select_related("project", "phase", "activity")
+        run_sync("process_design", tasks, [self.facilitator])
+
+    def get_docs(self, _type):
+        return self.nsc.find_documents(self.db, {"type": _type})
+
+    def test_delete_view_enqueues_the_propagation(self):
+        flush()
+        with collect_no_sql_requests() as requests:
+            response = self.client.post(
+                reverse("dashboard:phases:delete", args=[self.phase.id])
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(requests.count, 0)
+        self.assertEqual(len(self.get_docs("task")), 4)
+
+        flush()
+        for _type in ("phase", "activity", "task"):
+            self.assertEqual(self.get_docs(_type), [])
+        self.assertFalse(
+            OutboxMessage.objects.filter(
+                kind=OutboxMessage.PROPAGATE, sent_on__isnull=True
+            ).exists()
+        )
+
+    def test_reorder(self):
+        task = Task.objects.order_by("id").first()
+        task.order = 5
+        task.save()
+        enqueue_propagation(updated=get_updates(task))
+        flush()
+
+        orders = [
+            doc["order"] for doc in self.get_docs("task") if doc["sql_id"] == task.id
+        ]
+        self.assertEqual(orders, [5, 5])
+
+    def test_conflicted_delete_is_retried(self):
+        find_documents = NoSQLClient.find_documents
+
+        def find_then_edit(nsc, db, selector, *args, **kwargs):
+            docs = find_documents(nsc, db, selector, *args, **kwargs)
+            # The tablet writes the documents after the read
+            nsc.bulk_upsert(db, [{**doc, "completed": True} for doc in docs])
+            return docs
+
+        task = Task.objects.order_by("id").first()
+        with mock.patch.object(NoSQLClient, "find_documents", find_then_edit):
+            summary = propagate_structure(get_deletions(task))
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(
+            [doc["sql_id"] for doc in self.get_docs("task")],
+            [Task.objects.last().id] * 2,
+        )
+
+
+class TestTaskCompletionView(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.nsc.create_db("facilitator_test")
+        self.nsc.bulk_upsert(
+            self.db,
+            [
+                {
+                    "type": "task",
+                    "administrative_level_id": village_id,
+                    "phase_name": "Phase",
+                    "activity_name": "Activity",
+                    "name": f"Task {i}",
+                    "completed": completed,
+                }
+                for i, (village_id, completed) in enumerate(
+                    [(1, True), ("1", False), ("2", True), ("2", True)]
+                )
+            ]
+            + [{"type": "activity", "administrative_level_id": "1"}],
+        )
+
+    def test_design_document_is_created(self):
+        self.assertIsNone(self.nsc.get_design_document(self.db, DESIGN_DOCUMENT_ID))
+        self.assertEqual(get_task_completion(self.nsc, self.db), {(): [4, 3]})
+        self.assertEqual(
+            ensure_design_documents(self.nsc, self.db, FACILITATOR_DESIGN_DOCUMENTS),
+            {DESIGN_DOCUMENT_ID: "exists"},
+        )
+
+    def test_group_level(self):
+        completion = get_task_completion(self.nsc, self.db, group_level=1)
+        self.assertEqual(completion, {("1",): [2, 1], ("2",): [2, 2]})
+        self.assertEqual(get_percentage(completion[("1",)]), 50)
+        self.assertEqual(get_percentage([0, 0]), 0)
+
+    def test_village(self):
+        completion = get_task_completion(
+            self.nsc,
+            self.db,
+            group_level=1,
+            startkey=["2"],
+            endkey=["2", {}],
+        )
+        self.assertEqual(completion, {("2",): [2, 2]})
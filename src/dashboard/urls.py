@@ -7,6 +7,7 @@ urlpatterns = [
     path("facilitators/", include("dashboard.facilitators.urls")),
     path("administrative-levels/", include("dashboard.administrative_levels.urls")),
     path("diagnostics/", include("dashboard.diagnostics.urls")),
+    path("sync-runs/", include("dashboard.sync_runs.urls")),
     path("projects/", include("dashboard.projects.urls")),
     path("phases/", include("dashboard.phases.urls")),
     path("activities/", include("dashboard.activities.urls")),
@@ -5,11 +5,15 @@ import re
 from django.template.defaultfilters import date as _date
 from django.contrib.auth.hashers import make_password
 from authentication.models import Facilitator
-from no_sql_client import NoSQLClient
+from no_sql_client import NoSQLClient, merge_fields
 from process_manager.models import Task, Phase, Activity, Project
+from process_manager.cache import process_design_cache
+from process_manager.outbox import flush
+from dashboard.planner import plan_facilitator_database
 from cloudant.document import Document
 
 from administrativelevels import models as administrativelevels_models
+from administrativelevels.tree import administrative_level_tree
 
 
 def structure_the_words(word):
@@ -120,51 +124,15 @@ def get_administrative_level_choices(administrative_levels_db, empty_choice=True
 
 
 def get_child_administrative_levels(administrative_levels_db, parent_id):
-    data = administrative_levels_db.get_query_result(
-        {
-            "type": "administrative_level",
-            "parent_id": parent_id,
-        }
-    )
-    data = [doc for doc in data]
-    return data
+    return administrative_level_tree.get().get_children(parent_id)
 
 
 def get_parent_administrative_level(administrative_levels_db, administrative_id):
-    parent = None
-    docs = administrative_levels_db.get_query_result(
-        {"administrative_id": administrative_id, "type": "administrative_level"}
-    )
-
-    try:
-        doc = administrative_levels_db[docs[0][0]["_id"]]
-        if "parent_id" in doc and doc["parent_id"]:
-            administrative_id = doc["parent_id"]
-            docs = administrative_levels_db.get_query_result(
-                {"administrative_id": administrative_id, "type": "administrative_level"}
-            )
-            parent = administrative_levels_db[docs[0][0]["_id"]]
-    except Exception:
-        pass
-    return parent
+    return administrative_level_tree.get().get_parent(administrative_id)
 
 
 def get_region_of_village_by_sql_id(administrative_levels_db, village_sql_id):
-    canton = get_parent_administrative_level(administrative_levels_db, village_sql_id)
-    if canton:
-        commune = get_parent_administrative_level(
-            administrative_levels_db, canton["administrative_id"]
-        )
-        if commune:
-            prefecture = get_parent_administrative_level(
-                administrative_levels_db, commune["administrative_id"]
-            )
-            if prefecture:
-                return get_parent_administrative_level(
-                    administrative_levels_db, prefecture["administrative_id"]
-                )
-
-    return None
+    return administrative_level_tree.get().get_region(village_sql_id)
 
 
 def get_documents_by_type(db, _type, empty_choice=True, attrs={}):
@@ -175,6 +143,19 @@ def get_documents_by_type(db, _type, empty_choice=True, attrs={}):
     return query_result
 
 
+def get_design_documents(database, *doc_ids):
+    """
+    Return for each id a list holding its document (empty if it doesn't exist),
+    the process_design documents coming from the in-process cache
+    """
+    if database == process_design_cache.db_name:
+        docs = process_design_cache.get_many(doc_ids)
+    else:
+        nsc = NoSQLClient()
+        docs = {doc["_id"]: doc for doc in nsc.bulk_get(nsc.get_db(database), doc_ids)}
+    return [[docs[doc_id]] if doc_id in docs else [] for doc_id in doc_ids]
+
+
 # # TODO Refactor para la nueva logica
 # def create_task_all_facilitators(database, task_model, develop_mode=False, trainning_mode=False):
 #     facilitators = Facilitator.objects.filter(develop_mode=develop_mode, training_mode=trainning_mode)
@@ -254,267 +235,100 @@ def get_documents_by_type(db, _type, empty_choice=True, attrs={}):
 #             print(administrative_level)
 
 
-# TODO Refactor para la nueva logica
-def create_task_all_facilitators(
-    database, task_model, develop_mode=False, trainning_mode=False, no_sql_db=False
-):
+def get_facilitators(develop_mode=False, training_mode=False, no_sql_db=False):
     if no_sql_db:
-        facilitators = Facilitator.objects.filter(
+        return Facilitator.objects.filter(
             develop_mode=develop_mode,
-            training_mode=trainning_mode,
+            training_mode=training_mode,
             no_sql_db_name=no_sql_db,
         )
-    else:
-        facilitators = Facilitator.objects.filter(
-            develop_mode=develop_mode, training_mode=trainning_mode
+    return Facilitator.objects.filter(
+        develop_mode=develop_mode, training_mode=training_mode
+    )
+
+
+def get_tasks_design_documents(database, tasks):
+    """
+    Return a dict _id -> document of the tasks with their activities, phases and
+    projects in the design database
+    """
+    couch_ids = []
+    for task_model in tasks:
+        couch_ids.extend(
+            [
+                task_model.couch_id,
+                task_model.activity.couch_id,
+                task_model.phase.couch_id,
+                task_model.project.couch_id,
+            ]
         )
+    return {
+        docs[0]["_id"]: docs[0]
+        for docs in get_design_documents(database, *dict.fromkeys(couch_ids))
+        if docs
+    }
+
+
+def sync_facilitators_tasks(database, tasks, facilitators, dry_run=False):
+    """
+    Copy the tasks with their phases, activities and project from the design
+    database into the database of every facilitator, with one read and one
+    chunked bulk write per facilitator database (see dashboard.planner).
+    With dry_run nothing is written and the report of the plan of each database
+    is returned instead.
+    """
+    # The design documents of the rows saved since the last drain must exist first
+    flush()
+    tasks = list(tasks)
+    design_docs = get_tasks_design_documents(database, tasks)
 
     nsc = NoSQLClient()
-    nsc_database = nsc.get_db(database)
-    task = nsc_database.get_query_result({"_id": task_model.couch_id})[0]
-    activity = nsc_database.get_query_result({"_id": task_model.activity.couch_id})[0]
-    phase = nsc_database.get_query_result({"_id": task_model.phase.couch_id})[0]
-    project = nsc_database.get_query_result({"_id": task_model.project.couch_id})[0]
+    reports = {}
     for facilitator in facilitators:
         facilitator_database = nsc.get_db(facilitator.no_sql_db_name)
         print(facilitator.no_sql_db_name, facilitator.username)
-        facilitator_administrative_levels = facilitator_database.get_query_result(
-            {"type": "facilitator"}
-        )[0]
-        fc_project = facilitator_database.get_query_result(
-            {"type": "project", "name": project[0]["name"]}
-        )[0]
-
-        # check if the project exists
-        if not fc_project:
-            # create the project on the facilitator database
-            nsc.create_document(facilitator_database, project[0])
-
-        # Iterate every administrative level assigned to the facilitator
-        for administrative_level in facilitator_administrative_levels[0][
-            "administrative_levels"
-        ]:
-            # Get phase
-            new_phase = phase[0].copy()
-            del new_phase["_id"]
-            del new_phase["_rev"]
-            new_phase["administrative_level_id"] = administrative_level["id"]
-            new_phase["project_id"] = project[0]["_id"]
-            new_phase["sql_id"] = task_model.phase.id  # Add sql_id
-            # fc_phase = facilitator_database.get_query_result(new_phase)[0]
-
-            # Search phase include id
-            fc_phase = facilitator_database.get_query_result(
-                {
-                    "administrative_level_id": administrative_level["id"],
-                    "project_id": project[0]["_id"],
-                    "type": new_phase["type"],
-                    "sql_id": task_model.phase.id,
-                }
-            )[0]
-            if len(fc_phase) < 1:  # if any phase find by "Search phase include id"
-                # Search phase include order
-                fc_phase = facilitator_database.get_query_result(
-                    {
-                        "administrative_level_id": administrative_level["id"],
-                        "project_id": project[0]["_id"],
-                        "type": new_phase["type"],
-                        "order": new_phase["order"],
-                    }
-                )[0]
-
-            # Check if the phase was found
-            if len(fc_phase) < 1:
-                # create the phase
-                nsc.create_document(facilitator_database, new_phase)
-                # Get phase
-                fc_phase = facilitator_database.get_query_result(new_phase)[0]
-            else:
-                # Update phase if it exists
-                _fc_phase = fc_phase[0].copy()
-                _fc_phase["name"] = task_model.phase.name
-                _fc_phase["description"] = task_model.phase.description
-                _fc_phase["order"] = task_model.phase.order
-                _fc_phase["sql_id"] = task_model.phase.id  # update doc by adding sql_id
-
-                nsc.update_cloudant_document(
-                    facilitator_database, _fc_phase["_id"], _fc_phase
-                )  # Update phase for the facilitator
-
-            # Get or create  activity
-            new_activity = activity[0].copy()
-            del new_activity["_id"]
-            del new_activity["_rev"]
-            new_activity["administrative_level_id"] = administrative_level["id"]
-            new_activity["project_id"] = project[0]["_id"]
-            new_activity["phase_id"] = fc_phase[0]["_id"]
-            new_activity["sql_id"] = task_model.activity.id  # Add sql_id
-
-            # fc_activity = facilitator_database.get_query_result(new_activity)[0]
-
-            # Search activity include id
-            fc_activity = facilitator_database.get_query_result(
-                {
-                    "administrative_level_id": administrative_level["id"],
-                    "project_id": project[0]["_id"],
-                    "phase_id": fc_phase[0]["_id"],
-                    "type": new_activity["type"],
-                    "sql_id": task_model.activity.id,
-                }
-            )[0]
-            if (
-                len(fc_activity) < 1
-            ):  # if any activity find by "Search activity include id"
-                # Search activity include order
-                fc_activity = facilitator_database.get_query_result(
-                    {
-                        "administrative_level_id": administrative_level["id"],
-                        "project_id": project[0]["_id"],
-                        "phase_id": fc_phase[0]["_id"],
-                        "type": new_activity["type"],
-                        "order": new_activity["order"],
-                    }
-                )[0]
+        plan = plan_facilitator_database(nsc, facilitator_database, tasks, design_docs)
+        print(f"{len(plan.changes)} document(s) to write")
+        if dry_run:
+            reports[facilitator.no_sql_db_name] = plan.get_report()
+            continue
+        for error in plan.apply(nsc, facilitator_database):
+            print(error)
+    return reports
 
-            # Check if the activity was found
-            if len(fc_activity) < 1:
-                # create the activity
-                nsc.create_document(facilitator_database, new_activity)
-                # Get activity
-                fc_activity = facilitator_database.get_query_result(new_activity)[0]
-            else:
-                # Update activity if it exists
-                _fc_activity = fc_activity[0].copy()
-                _fc_activity["name"] = task_model.activity.name
-                _fc_activity["description"] = task_model.activity.description
-                _fc_activity["order"] = task_model.activity.order
-                _fc_activity["total_tasks"] = task_model.activity.total_tasks
-                _fc_activity[
-                    "sql_id"
-                ] = task_model.activity.id  # update doc by adding sql_id
-
-                nsc.update_cloudant_document(
-                    facilitator_database, _fc_activity["_id"], _fc_activity
-                )  # Update activity for the facilitator
 
-            # Get or create  task
-            new_task = task[0].copy()
-            del new_task["_id"]
-            del new_task["_rev"]
-            new_task["administrative_level_id"] = administrative_level["id"]
-            new_task["administrative_level_name"] = administrative_level["name"]
-            new_task["project_id"] = project[0]["_id"]
-            new_task["phase_id"] = fc_phase[0]["_id"]
-            new_task["activity_id"] = fc_activity[0]["_id"]
-            new_task["sql_id"] = task_model.id  # Add sql_id
-
-            # fc_task = facilitator_database.get_query_result(new_task)[0]
-
-            # Search task include id
-            fc_task = facilitator_database.get_query_result(
-                {
-                    "administrative_level_id": administrative_level["id"],
-                    "project_id": project[0]["_id"],
-                    "phase_id": fc_phase[0]["_id"],
-                    "activity_id": fc_activity[0]["_id"],
-                    "type": new_task["type"],
-                    "sql_id": task_model.id,
-                }
-            )[0]
-            if len(fc_task) < 1:  # if any task find by "Search task include id"
-                # Search task include order
-                fc_task = facilitator_database.get_query_result(
-                    {
-                        "administrative_level_id": administrative_level["id"],
-                        "project_id": project[0]["_id"],
-                        "phase_id": fc_phase[0]["_id"],
-                        "activity_id": fc_activity[0]["_id"],
-                        "type": new_task["type"],
-                        "order": new_task["order"],
-                    }
-                )[0]
-
-            # Check if the task was found
-            if len(fc_task) < 1:
-                # create the task
-                new_task["completed_date"] = None  # Add completed_date
-                new_task["last_updated"] = None  # Add last_updated
-                nsc.create_document(facilitator_database, new_task)
-                # Get activity
-                fc_task = facilitator_database.get_query_result(new_task)[0]
-                print(fc_task)
-            else:
-                # Update task if it exists
-                _fc_task = fc_task[0].copy()
-                _fc_task["name"] = task_model.name
-                _fc_task["description"] = task_model.description
-                _fc_task["phase_name"] = task_model.phase.name
-                _fc_task["activity_name"] = task_model.activity.name
-                _fc_task["administrative_level_name"] = administrative_level["name"]
-                if task_model.form:
-                    _fc_task["form"] = task_model.form
-                elif new_task.get("form"):
-                    _fc_task["form"] = new_task.get("form")
-                _fc_task["attachments"] = new_task.get("attachments")
-                _fc_task["order"] = task_model.order
-                _fc_task["sql_id"] = task_model.id  # update doc by adding sql_id
-                _fc_task["support_attachments"] = new_task.get("support_attachments")
-
-                # Start management of the dates of the last update and completed
-
-                datetime_now = datetime.now()
-                datetime_str = f"{str(datetime_now.year)}-{str(datetime_now.month)}-{str(datetime_now.day)} {str(datetime_now.hour)}:{str(datetime_now.minute)}:{str(datetime_now.second)}"
-
-                if not _fc_task.get("last_updated"):
-                    if _fc_task.get("completed"):
-                        _fc_task[
-                            "last_updated"
-                        ] = datetime_str  # update doc by adding last_updated
-                    else:
-                        _fc_task[
-                            "last_updated"
-                        ] = "0000-00-00 00:00:00"  # update doc by adding last_updated
-
-                if not _fc_task.get("completed_date"):
-                    if _fc_task.get("completed"):
-                        _fc_task[
-                            "completed_date"
-                        ] = datetime_str  # update doc by adding completed_date
-                    else:
-                        _fc_task[
-                            "completed_date"
-                        ] = "0000-00-00 00:00:00"  # update doc by adding completed_date
-
-                # End management of the dates of the last update and completed
-
-                nsc.update_cloudant_document(
-                    facilitator_database,
-                    _fc_task["_id"],
-                    _fc_task,
-                    {"attachments": ["name"]},
-                    fc_task[0]["attachments"],
-                )  # Update task for the facilitator
-                print(_fc_task)
-            print(administrative_level)
+def create_task_all_facilitators(
+    database,
+    task_model,
+    develop_mode=False,
+    trainning_mode=False,
+    no_sql_db=False,
+    dry_run=False,
+):
+    return sync_facilitators_tasks(
+        database,
+        [task_model],
+        get_facilitators(develop_mode, trainning_mode, no_sql_db),
+        dry_run,
+    )
 
 
 def add_news_attr_to_doc(db_name, objects_list, attrs_to_add=["sql_id"]):
     nsc = NoSQLClient()
     db = nsc.get_db(db_name)
 
-    nsc = NoSQLClient()
-    for obj in objects_list:
-        docs = db.get_query_result({"_id": obj.couch_id})[0]
-        if len(docs) > 0:
-            doc = docs[0].copy()
-            for attr in attrs_to_add:
-                if attr == "sql_id":
-                    doc[attr] = obj.id  # update doc by adding sql_id
-                elif attr in ["completed_date", "last_updated"]:
-                    doc[attr] = "0000-00-00 00:00:00"
-            nsc.update_cloudant_document(
-                db, doc["_id"], doc
-            )  # Update doc of process_design
+    objects = {obj.couch_id: obj for obj in objects_list if obj.couch_id}
+    docs = nsc.bulk_get(db, objects.keys())
+    for doc in docs:
+        obj = objects[doc["_id"]]
+        for attr in attrs_to_add:
+            if attr == "sql_id":
+                doc[attr] = obj.id  # update doc by adding sql_id
+            elif attr in ["completed_date", "last_updated"]:
+                doc[attr] = "0000-00-00 00:00:00"
+    results = nsc.bulk_upsert(db, docs)  # Update docs of process_design
+    for error in nsc.bulk_errors(results):
+        print(error)
 
 
 def over_documents(develop_mode=False, training_mode=False):
@@ -536,11 +350,9 @@ def over_documents(develop_mode=False, training_mode=False):
     print("Syncing: projects - process_design")
     add_news_attr_to_doc("process_design", projects)
 
-    for task in tasks:
-        print("syncing: ", task.phase.order, task.activity.order, task.order)
-        create_task_all_facilitators(
-            "process_design", task, develop_mode, training_mode
-        )
+    sync_facilitators_tasks(
+        "process_design", tasks, get_facilitators(develop_mode, training_mode)
+    )
 
 
 def over_documents_to_add_completed_date_and_last_updated_attrs(
@@ -553,11 +365,9 @@ def over_documents_to_add_completed_date_and_last_updated_attrs(
     print("Syncing: tasks - process_design")
     add_news_attr_to_doc("process_design", tasks, ["completed_date", "last_updated"])
 
-    for task in tasks:
-        print("syncing: ", task.phase.order, task.activity.order, task.order)
-        create_task_all_facilitators(
-            "process_design", task, develop_mode, training_mode
-        )
+    sync_facilitators_tasks(
+        "process_design", tasks, get_facilitators(develop_mode, training_mode)
+    )
 
 
 def add_news_attrs_to_facilitators():
@@ -581,11 +391,13 @@ def add_news_attrs_to_facilitators():
 def create_task_one_facilitator(database, task_model, no_sql_db):
     facilitators = Facilitator.objects.filter(no_sql_db_name=no_sql_db)
     nsc = NoSQLClient()
-    nsc_database = nsc.get_db(database)
-    task = nsc_database.get_query_result({"_id": task_model.couch_id})[0]
-    activity = nsc_database.get_query_result({"_id": task_model.activity.couch_id})[0]
-    phase = nsc_database.get_query_result({"_id": task_model.phase.couch_id})[0]
-    project = nsc_database.get_query_result({"_id": task_model.project.couch_id})[0]
+    task, activity, phase, project = get_design_documents(
+        database,
+        task_model.couch_id,
+        task_model.activity.couch_id,
+        task_model.phase.couch_id,
+        task_model.project.couch_id,
+    )
     for facilitator in facilitators:
         facilitator_database = nsc.get_db(facilitator.no_sql_db_name)
         print(facilitator.no_sql_db_name, facilitator.username)
@@ -660,31 +472,27 @@ def create_task_one_facilitator(database, task_model, no_sql_db):
 
 # from dashboard.utils import sync_tasks
 def sync_tasks(develop_mode=False, training_mode=False, no_sql_db=False):
-    tasks = Task.objects.all().prefetch_related()
-    for task in tasks:
-        print("syncing: ", task.phase.order, task.activity.order, task.order)
-        # if no_sql_db:
-        #     create_task_one_facilitator("process_design", task, no_sql_db)
-        # else:
-        #     create_task_all_facilitators("process_design", task, develop_mode, training_mode)
-        create_task_all_facilitators(
-            "process_design", task, develop_mode, training_mode, no_sql_db
-        )
+    from dashboard.sync_runner import run_sync
+
+    tasks = Task.objects.select_related("project", "phase", "activity").order_by(
+        "phase__order", "activity__order", "order"
+    )
+    print("syncing: ", tasks.count(), "task(s)")
+    summary = run_sync(
+        "process_design",
+        tasks,
+        get_facilitators(develop_mode, training_mode, no_sql_db),
+        force=True,
+        incremental=False,
+        progress=lambda result: print(result["facilitator"].no_sql_db_name, result),
+    )
+    print(summary)
 
 
 def sync_tasks_tasks_by_putting_unfinished_those_which_do_not_have_the_attachments(
     develop_mode=False, training_mode=False, no_sql_db=False
 ):
-    if no_sql_db:
-        facilitators = Facilitator.objects.filter(
-            develop_mode=develop_mode,
-            training_mode=training_mode,
-            no_sql_db_name=no_sql_db,
-        )
-    else:
-        facilitators = Facilitator.objects.filter(
-            develop_mode=develop_mode, training_mode=training_mode
-        )
+    facilitators = get_facilitators(develop_mode, training_mode, no_sql_db)
 
     nsc = NoSQLClient()
     for facilitator in facilitators:
@@ -792,18 +600,14 @@ def clear_facilitator_database(develop_mode=False, training_mode=False):
     for facilitator in facilitators:
         print(facilitator)
         nsc_database = nsc.get_db(facilitator.no_sql_db_name)
-        phases = nsc_database.get_query_result({"type": "phase"})
-        for phase in phases:
-            nsc.delete_document(nsc_database, phase["_id"])
-        activities = nsc_database.get_query_result({"type": "activity"})
-        for activity in activities:
-            nsc.delete_document(nsc_database, activity["_id"])
-        tasks = nsc_database.get_query_result({"type": "task"})
-        for task in tasks:
-            nsc.delete_document(nsc_database, task["_id"])
-        projects = nsc_database.get_query_result({"type": "project"})
-        for project in projects:
-            nsc.delete_document(nsc_database, project["_id"])
+        docs = nsc.find_documents(
+            nsc_database,
+            {"type": {"$in": ["phase", "activity", "task", "project"]}},
+            fields=["_id", "_rev"],
+        )
+        results = nsc.bulk_delete(nsc_database, docs)
+        for error in nsc.bulk_errors(results):
+            print(error)
 
 
 def clear_facilitator_documents_tasks_by_administrativelevels(
@@ -821,23 +625,20 @@ def clear_facilitator_documents_tasks_by_administrativelevels(
         administrative_levels = facilitator_doc["administrative_levels"]
         _administrative_levels = []
         print(administrative_levels)
-        for adl_id in administrativelevels_ids:
-            phases = nsc_database.get_query_result(
-                {"type": "phase", "administrative_level_id": adl_id}
-            )
-            for phase in phases:
-                nsc.delete_document(nsc_database, phase["_id"])
-            activities = nsc_database.get_query_result(
-                {"type": "activity", "administrative_level_id": adl_id}
-            )
-            for activity in activities:
-                nsc.delete_document(nsc_database, activity["_id"])
-            tasks = nsc_database.get_query_result(
-                {"type": "task", "administrative_level_id": adl_id}
-            )
-            for task in tasks:
-                nsc.delete_document(nsc_database, task["_id"])
 
+        docs = nsc.find_documents(
+            nsc_database,
+            {
+                "type": {"$in": ["phase", "activity", "task"]},
+                "administrative_level_id": {"$in": administrativelevels_ids},
+            },
+            fields=["_id", "_rev"],
+        )
+        results = nsc.bulk_delete(nsc_database, docs)
+        for error in nsc.bulk_errors(results):
+            print(error)
+
+        for adl_id in administrativelevels_ids:
             for i in range(len(administrative_levels)):
                 if administrative_levels[i]["id"] == adl_id:
                     continue
@@ -845,21 +646,13 @@ def clear_facilitator_documents_tasks_by_administrativelevels(
         print(_administrative_levels)
         doc = {"administrative_levels": _administrative_levels}
         nsc.update_doc(nsc_database, facilitator_doc["_id"], doc)
+        facilitator.set_villages(_administrative_levels)
 
 
 def sync_geographicalunits_with_cvd_on_facilittor(
     develop_mode=False, training_mode=False, no_sql_db=False
 ):
-    if no_sql_db:
-        facilitators = Facilitator.objects.filter(
-            develop_mode=develop_mode,
-            training_mode=training_mode,
-            no_sql_db_name=no_sql_db,
-        )
-    else:
-        facilitators = Facilitator.objects.filter(
-            develop_mode=develop_mode, training_mode=training_mode
-        )
+    facilitators = get_facilitators(develop_mode, training_mode, no_sql_db)
 
     nsc = NoSQLClient()
     for facilitator in facilitators:
@@ -0,0 +1,1089 @@
+# In-memory stand-in for the subset of the CouchDB HTTP API used by
+# no_sql_client.py, cdd_client.py and the sync routines, meant for tests and
+# benchmarks without a live CouchDB. Point NO_SQL_URL at it:
+#
+#     python fake_couchdb.py --port 5984 --latency 20
+#
+# or start it from Python with `with FakeCouchDB(latency=0.02) as couch: ...`
+# and use couch.url. Every request waits `latency` seconds before being handled
+# to model the round trip to the production server.
+#
+# Supported: _session, _all_dbs, database create/delete/info, _security,
+# documents (design and local documents included), _all_docs, _find with the
+# usual Mango operators, _index, _explain, _bulk_docs, _changes (normal and
+# longpoll feeds, _selector and _doc_ids filters), _db_updates,
+# map/reduce views (the map functions of no_sql_views only, run by their Python
+# twins, with the _count and _sum reduces),
+# _replicate between local databases, and the documents of the _replicator
+# database with their _scheduler/docs and _scheduler/jobs states (a replication
+# runs as soon as its document is written, continuous ones again after every
+# write to their source). Revision trees are not kept: a database only holds the
+# winning revision of each document.
+import argparse
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from no_sql_views import MAP_FUNCTIONS
+
+DB_NAME_REGEX = re.compile(r"^[a-z_][a-z0-9_$()+/-]*$")
+
+
+class CouchError(Exception):
+    def __init__(self, status, error, reason=""):
+        super().__init__(reason or error)
+        self.status = status
+        self.error = error
+        self.reason = reason
+
+
+def get_field(doc, path):
+    """
+    Return (True, value) for the dotted path of the document, (False, None) if a
+    part of the path is missing
+    """
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return False, None
+    return True, value
+
+
+def _collation_key(value):
+    # CouchDB orders null < booleans < numbers < strings < arrays < objects
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, list):
+        return (4, [_collation_key(v) for v in value])
+    return (5, sorted((k, _collation_key(v)) for k, v in value.items()))
+
+
+def _compare(a, b):
+    a, b = _collation_key(a), _collation_key(b)
+    return (a > b) - (a < b)
+
+
+def _reduce(reduce, values):
+    if reduce == "_count":
+        return len(values)
+    if reduce == "_sum":
+        if values and isinstance(values[0], list):
+            return [sum(column) for column in zip(*values)]
+        return sum(values)
+    raise CouchError(500, "unsupported", f"Unsupported reduce {reduce}")
+
+
+def _match_operator(op, arg, exists, value):
+    if op == "$exists":
+        return exists == bool(arg)
+    if op == "$and":
+        return all(_match_condition(exists, value, sub) for sub in arg)
+    if op == "$or":
+        return any(_match_condition(exists, value, sub) for sub in arg)
+    if op == "$not":
+        return not _match_condition(exists, value, arg)
+    if op == "$nor":
+        return not any(_match_condition(exists, value, sub) for sub in arg)
+    if not exists:
+        return False
+    if op == "$eq":
+        return _compare(value, arg) == 0
+    if op == "$ne":
+        return _compare(value, arg) != 0
+    if op == "$gt":
+        return _compare(value, arg) > 0
+    if op == "$gte":
+        return _compare(value, arg) >= 0
+    if op == "$lt":
+        return _compare(value, arg) < 0
+    if op == "$lte":
+        return _compare(value, arg) <= 0
+    if op == "$in":
+        return any(_compare(value, v) == 0 for v in arg)
+    if op == "$nin":
+        return all(_compare(value, v) != 0 for v in arg)
+    if op == "$regex":
+        return isinstance(value, str) and re.search(arg, value) is not None
+    if op == "$size":
+        return isinstance(value, list) and len(value) == arg
+    if op == "$all":
+        return isinstance(value, list) and all(
+            any(_compare(v, a) == 0 for v in value) for a in arg
+        )
+    if op == "$elemMatch":
+        return isinstance(value, list) and any(
+            _match_condition(True, v, arg) for v in value
+        )
+    if op == "$allMatch":
+        return isinstance(value, list) and all(
+            _match_condition(True, v, arg) for v in value
+        )
+    if op == "$type":
+        types = {
+            "null": type(None),
+            "boolean": bool,
+            "number": (int, float),
+            "string": str,
+            "array": list,
+            "object": dict,
+        }
+        return isinstance(value, types[arg]) and not (
+            arg == "number" and isinstance(value, bool)
+        )
+    raise CouchError(400, "invalid_operator", f"Invalid operator: {op}")
+
+
+def _match_condition(exists, value, condition):
+    """
+    Match the value of a field against its condition, either a plain value or a
+    dict of operators and/or sub-fields
+    """
+    if isinstance(condition, dict) and condition:
+        for key, arg in condition.items():
+            if key.startswith("$"):
+                if not _match_operator(key, arg, exists, value):
+                    return False
+            else:
+                sub_exists, sub_value = (
+                    get_field(value, key) if exists else (False, None)
+                )
+                if not _match_condition(sub_exists, sub_value, arg):
+                    return False
+        return True
+    return exists and _compare(value, condition) == 0
+
+
+def match_selector(doc, selector):
+    for key, condition in selector.items():
+        if key in ("$and", "$or", "$nor", "$not"):
+            if key == "$and":
+                ok = all(match_selector(doc, sub) for sub in condition)
+            elif key == "$or":
+                ok = any(match_selector(doc, sub) for sub in condition)
+            elif key == "$nor":
+                ok = not any(match_selector(doc, sub) for sub in condition)
+            else:
+                ok = not match_selector(doc, condition)
+        else:
+            exists, value = get_field(doc, key)
+            ok = _match_condition(exists, value, condition)
+        if not ok:
+            return False
+    return True
+
+
+def project_fields(doc, fields):
+    if not fields:
+        return doc
+    result = {}
+    for field in fields:
+        exists, value = get_field(doc, field)
+        if exists:
+            target = result
+            parts = field.split(".")
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return result
+
+
+def new_revision(doc, previous_rev=None):
+    generation = int(previous_rev.split("-")[0]) if previous_rev else 0
+    digest = hashlib.md5(json.dumps(doc, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{generation + 1}-{digest}"
+
+
+def _rev_key(rev):
+    generation, _, digest = rev.partition("-")
+    return (int(generation), digest)
+
+
+class Database:
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}  # _id -> latest revision, deleted ones included
+        self.local_docs = {}
+        self.seq = 0
+        self.changes = OrderedDict()  # _id -> seq, ordered by seq
+        self.security = {"admins": {}, "members": {}}
+
+    @property
+    def update_seq(self):
+        return f"{self.seq}-fake"
+
+    def info(self):
+        doc_count = sum(1 for doc in self.docs.values() if not doc.get("_deleted"))
+        return {
+            "db_name": self.name,
+            "doc_count": doc_count,
+            "doc_del_count": len(self.docs) - doc_count,
+            "update_seq": self.update_seq,
+            "purge_seq": 0,
+            "compact_running": False,
+            "sizes": {"active": 0, "external": 0, "file": 0},
+            "instance_start_time": "0",
+        }
+
+    def get(self, doc_id):
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            raise CouchError(404, "not_found", "missing")
+        if doc.get("_deleted"):
+            raise CouchError(404, "not_found", "deleted")
+        return doc
+
+    def put(self, doc, new_edits=True):
+        """
+        Store the document and return its (_id, new revision). With new_edits=False
+        the revision of the document is kept (replication) and the document is only
+        stored if it wins over the current one.
+        """
+        doc_id = doc.get("_id") or uuid.uuid4().hex
+        current = self.docs.get(doc_id)
+        if new_edits:
+            current_rev = current["_rev"] if current else None
+            if current and not current.get("_deleted"):
+                if doc.get("_rev") != current_rev:
+                    raise CouchError(409, "conflict", "Document update conflict.")
+            elif doc.get("_rev") and doc.get("_rev") != current_rev:
+                raise CouchError(409, "conflict", "Document update conflict.")
+            body = {k: v for k, v in doc.items() if k not in ("_id", "_rev")}
+            rev = new_revision(body, current_rev)
+        else:
+            rev = doc["_rev"]
+            if current and _rev_key(current["_rev"]) >= _rev_key(rev):
+                return doc_id, rev
+
+        stored = dict(doc, _id=doc_id, _rev=rev)
+        if stored.get("_deleted"):
+            stored = {"_id": doc_id, "_rev": rev, "_deleted": True}
+        self.docs[doc_id] = stored
+        self.seq += 1
+        self.changes.pop(doc_id, None)
+        self.changes[doc_id] = self.seq
+        return doc_id, rev
+
+    def live_docs(self):
+        return [doc for doc in self.docs.values() if not doc.get("_deleted")]
+
+    def indexes(self):
+        """
+        Return the Mango indexes, stored like CouchDB does in design documents
+        of the "query" language
+        """
+        indexes = []
+        for doc in self.live_docs():
+            if doc["_id"].startswith("_design/") and doc.get("language") == "query":
+                for name, view in doc.get("views", {}).items():
+                    fields = view["options"]["def"]["fields"]
+                    indexes.append(
+                        {
+                            "ddoc": doc["_id"],
+                            "name": name,
+                            "type": "json",
+                            "def": {
+                                "fields": [
+                                    f if isinstance(f, dict) else {f: "asc"}
+                                    for f in fields
+                                ]
+                            },
+                        }
+                    )
+        return indexes
+
+
+class FakeCouchDB:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.databases = {}
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.jobs = {}  # _replicator document id -> replication job
+        self.db_updates_seq = 0
+        self.db_updates = OrderedDict()  # database name -> (seq, type)
+        self.server = None
+        self.thread = None
+        for name in ("_users", "_replicator"):
+            self.databases[name] = Database(name)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.server.daemon_threads = True
+        self.server.couch = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.server.daemon_threads = True
+        self.server.couch = self
+        self.server.serve_forever()
+
+    def get_db(self, name):
+        db = self.databases.get(name)
+        if db is None:
+            raise CouchError(404, "not_found", "Database does not exist.")
+        return db
+
+    def create_db(self, name):
+        if name in self.databases:
+            raise CouchError(
+                412,
+                "file_exists",
+                "The database could not be created, the file already exists.",
+            )
+        if not DB_NAME_REGEX.match(name):
+            raise CouchError(400, "illegal_database_name", f"Name: '{name}'.")
+        self.databases[name] = Database(name)
+        self.record_db_update(name, "created")
+        return self.databases[name]
+
+    def delete_db(self, name):
+        self.get_db(name)
+        del self.databases[name]
+        self.record_db_update(name, "deleted")
+
+    def record_db_update(self, name, _type):
+        self.db_updates_seq += 1
+        self.db_updates.pop(name, None)
+        self.db_updates[name] = (self.db_updates_seq, _type)
+        self.changed.notify_all()
+
+    def write(self, db, doc, new_edits=True):
+        doc_id, rev = db.put(doc, new_edits)
+        self.after_write(db, [doc_id])
+        return doc_id, rev
+
+    def after_write(self, db, doc_ids):
+        """
+        Start the replications of the written _replicator documents, catch up the
+        continuous replications reading from the database and wake up the
+        longpoll _changes requests
+        """
+        if db.name == "_replicator":
+            for doc_id in doc_ids:
+                self.start_job(db.docs[doc_id])
+        for job in list(self.jobs.values()):
+            if job["state"] == "running" and job["source"] == db.name:
+                self.run_job(job)
+        self.record_db_update(db.name, "updated")
+
+    def start_job(self, doc):
+        doc_id = doc["_id"]
+        if doc.get("_deleted"):
+            self.jobs.pop(doc_id, None)
+            return
+        if doc_id.startswith("_design/"):
+            return
+        self.jobs[doc_id] = {
+            "database": "_replicator",
+            "doc_id": doc_id,
+            "id": uuid.uuid5(uuid.NAMESPACE_URL, doc_id).hex,
+            "source": self._get_db_name(doc.get("source", "")),
+            "target": self._get_db_name(doc.get("target", "")),
+            "state": "running",
+            "continuous": bool(doc.get("continuous")),
+            "options": doc,
+            "checkpoint": 0,
+            "info": {"docs_read": 0, "docs_written": 0, "doc_write_failures": 0},
+            "error_count": 0,
+            "start_time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "last_updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        self.run_job(self.jobs[doc_id])
+
+    def run_job(self, job):
+        try:
+            info, job["checkpoint"] = self.replicate(job["options"], job["checkpoint"])
+        except CouchError as e:
+            job["state"] = "failed"
+            job["error_count"] += 1
+            job["info"] = {"error": e.reason}
+        else:
+            for key, value in info.items():
+                job["info"][key] = job["info"].get(key, 0) + value
+            if not job["continuous"]:
+                job["state"] = "completed"
+        job["last_updated"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    @staticmethod
+    def _get_db_name(endpoint):
+        if isinstance(endpoint, dict):
+            endpoint = endpoint.get("url", "")
+        return unquote(urlsplit(endpoint).path.strip("/").split("/")[-1])
+
+    def replicate(self, options, since=0):
+        """
+        Replicate the changes of the source database after `since` to the target
+        database, both being local. Returns the stats and the new checkpoint.
+        """
+        source = self.get_db(self._get_db_name(options.get("source", "")))
+        target_name = self._get_db_name(options.get("target", ""))
+        if target_name not in self.databases and options.get("create_target"):
+            self.create_db(target_name)
+        target = self.get_db(target_name)
+
+        doc_ids = options.get("doc_ids")
+        selector = options.get("selector")
+        read = 0
+        written = []
+        for doc_id, seq in list(source.changes.items()):
+            if seq <= since:
+                continue
+            doc = source.docs[doc_id]
+            read += 1
+            if doc_ids is not None and doc_id not in doc_ids:
+                continue
+            if (
+                selector
+                and not doc.get("_deleted")
+                and not match_selector(doc, selector)
+            ):
+                continue
+            current = target.docs.get(doc_id)
+            if current and _rev_key(current["_rev"]) >= _rev_key(doc["_rev"]):
+                continue
+            target.put(doc, new_edits=False)
+            written.append(doc_id)
+        if written:
+            self.after_write(target, written)
+        info = {
+            "docs_read": read,
+            "docs_written": len(written),
+            "doc_write_failures": 0,
+        }
+        return info, source.seq
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeCouchDB/1.0"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, don't let Nagle's algorithm
+        # delay the body on kept-alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def couch(self):
+        return self.server.couch
+
+    def do_GET(self):
+        self.handle_couch_request("GET")
+
+    def do_HEAD(self):
+        self.handle_couch_request("HEAD")
+
+    def do_POST(self):
+        self.handle_couch_request("POST")
+
+    def do_PUT(self):
+        self.handle_couch_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_couch_request("DELETE")
+
+    def handle_couch_request(self, method):
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.method = method
+        length = int(self.headers.get("Content-Length") or 0)
+        self.raw_body = self.rfile.read(length) if length else b""
+        if self.couch.latency:
+            time.sleep(self.couch.latency)
+
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        try:
+            status, body, headers = self.route(parts)
+        except CouchError as e:
+            status, body, headers = e.status, {"error": e.error, "reason": e.reason}, {}
+        except (ValueError, KeyError, TypeError) as e:
+            status, body, headers = 400, {"error": "bad_request", "reason": str(e)}, {}
+        self.send_json(status, body, headers)
+
+    def send_json(self, status, body, headers):
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if self.method == "HEAD":
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @property
+    def body(self):
+        if not self.raw_body:
+            return {}
+        if "application/x-www-form-urlencoded" in self.headers.get("Content-Type", ""):
+            return {k: v[-1] for k, v in parse_qs(self.raw_body.decode()).items()}
+        return json.loads(self.raw_body)
+
+    def json_param(self, name, default=None):
+        if name not in self.query:
+            return default
+        return json.loads(self.query[name])
+
+    def bool_param(self, name, default=False):
+        return self.query.get(name, str(default).lower()) == "true"
+
+    def route(self, parts):
+        with self.couch.lock:
+            if not parts:
+                return (
+                    200,
+                    {
+                        "couchdb": "Welcome",
+                        "version": "3.2.2",
+                        "features": ["scheduler"],
+                    },
+                    {},
+                )
+            if parts[0] == "_session":
+                return self.session()
+            if parts[0] == "_up":
+                return 200, {"status": "ok"}, {}
+            if parts[0] == "_all_dbs":
+                return 200, sorted(self.couch.databases), {}
+            if parts[0] == "_replicate":
+                info, _ = self.couch.replicate(self.body)
+                return 200, {"ok": True, "history": [info]}, {}
+            if parts[0] == "_scheduler":
+                return self.scheduler(parts[1:])
+            if parts[0] == "_db_updates":
+                return self.db_updates()
+            if len(parts) == 1:
+                return self.database(parts[0])
+
+            db = self.couch.get_db(parts[0])
+            endpoint = parts[1]
+            if endpoint == "_design" and len(parts) == 5 and parts[3] == "_view":
+                return self.view(db, f"_design/{parts[2]}", parts[4])
+            if endpoint in ("_design", "_local") and len(parts) >= 3:
+                return self.document(db, f"{endpoint}/{parts[2]}", parts[3:])
+            handlers = {
+                "_security": self.security,
+                "_all_docs": self.all_docs,
+                "_find": self.find,
+                "_explain": self.explain,
+                "_index": self.index,
+                "_bulk_docs": self.bulk_docs,
+                "_bulk_get": self.bulk_get,
+                "_changes": self.changes,
+                "_ensure_full_commit": lambda db, parts: (201, {"ok": True}, {}),
+            }
+            if endpoint in handlers:
+                return handlers[endpoint](db, parts[2:])
+            return self.document(db, endpoint, parts[2:])
+
+    def session(self):
+        if self.method == "DELETE":
+            return 200, {"ok": True}, {"Set-Cookie": "AuthSession=; Path=/"}
+        if self.method == "POST":
+            name = self.body.get("name")
+            return (
+                200,
+                {"ok": True, "name": name, "roles": ["_admin"]},
+                {
+                    "Set-Cookie": f"AuthSession={uuid.uuid4().hex}; Version=1; Path=/; HttpOnly"
+                },
+            )
+        return 200, {"ok": True, "userCtx": {"name": "admin", "roles": ["_admin"]}}, {}
+
+    def db_updates(self):
+        since = self.query.get("since", "0")
+        if since == "now":
+            since = self.couch.db_updates_seq
+        else:
+            since = int(str(since).split("-")[0] or 0)
+        limit = int(self.query["limit"]) if "limit" in self.query else None
+
+        def collect():
+            results = []
+            last_seq = since
+            for name, (seq, _type) in self.couch.db_updates.items():
+                if seq <= since:
+                    continue
+                last_seq = seq
+                results.append({"db_name": name, "type": _type, "seq": f"{seq}-fake"})
+                if limit is not None and len(results) >= limit:
+                    break
+            return results, last_seq
+
+        results, last_seq = collect()
+        if not results and self.query.get("feed") in ("longpoll", "continuous"):
+            timeout = int(self.query.get("timeout", 60000)) / 1000
+            deadline = time.monotonic() + timeout
+            while not results and time.monotonic() < deadline:
+                self.couch.changed.wait(deadline - time.monotonic())
+                results, last_seq = collect()
+        return 200, {"results": results, "last_seq": f"{last_seq}-fake"}, {}
+
+    def scheduler(self, parts):
+        def job_doc(job):
+            return {
+                "database": job["database"],
+                "doc_id": job["doc_id"],
+                "id": job["id"],
+                "source": job["source"],
+                "target": job["target"],
+                "state": job["state"],
+                "info": job["info"],
+                "error_count": job["error_count"],
+                "start_time": job["start_time"],
+                "last_updated": job["last_updated"],
+            }
+
+        jobs = sorted(self.couch.jobs.values(), key=lambda job: job["doc_id"])
+        if parts and parts[0] == "jobs":
+            running = [job_doc(job) for job in jobs if job["state"] == "running"]
+            return 200, {"total_rows": len(running), "offset": 0, "jobs": running}, {}
+        if parts and parts[0] == "docs":
+            if len(parts) >= 3:
+                job = self.couch.jobs.get(parts[2])
+                if job is None:
+                    raise CouchError(404, "not_found", "missing")
+                return 200, job_doc(job), {}
+            docs = [job_doc(job) for job in jobs]
+            return 200, {"total_rows": len(docs), "offset": 0, "docs": docs}, {}
+        raise CouchError(404, "not_found", "Database does not exist.")
+
+    def database(self, name):
+        if self.method == "PUT":
+            self.couch.create_db(name)
+            return 201, {"ok": True}, {}
+        if self.method == "DELETE":
+            self.couch.delete_db(name)
+            return 200, {"ok": True}, {}
+        if self.method == "POST":
+            db = self.couch.get_db(name)
+            doc = self.body
+            doc_id, rev = self.couch.write(db, doc)
+            return 201, {"ok": True, "id": doc_id, "rev": rev}, {}
+        return 200, self.couch.get_db(name).info(), {}
+
+    def security(self, db, parts):
+        if self.method == "PUT":
+            db.security = self.body
+            return 200, {"ok": True}, {}
+        return 200, db.security, {}
+
+    def document(self, db, doc_id, parts):
+        if parts:
+            raise CouchError(
+                404, "not_found", "Attachments and views are not supported."
+            )
+        if doc_id.startswith("_local/"):
+            return self.local_document(db, doc_id)
+        if self.method in ("GET", "HEAD"):
+            doc = db.get(doc_id)
+            return 200, doc, {"ETag": f'"{doc["_rev"]}"'}
+        if self.method == "PUT":
+            doc = dict(self.body, _id=doc_id)
+            if "rev" in self.query and "_rev" not in doc:
+                doc["_rev"] = self.query["rev"]
+            _, rev = self.couch.write(
+                db, doc, new_edits=self.query.get("new_edits") != "false"
+            )
+            return 201, {"ok": True, "id": doc_id, "rev": rev}, {"ETag": f'"{rev}"'}
+        if self.method == "DELETE":
+            doc = db.get(doc_id)
+            rev = self.query.get("rev") or self.headers.get("If-Match", "").strip('"')
+            if rev != doc["_rev"]:
+                raise CouchError(409, "conflict", "Document update conflict.")
+            _, rev = self.couch.write(
+                db, {"_id": doc_id, "_rev": rev, "_deleted": True}
+            )
+            return 200, {"ok": True, "id": doc_id, "rev": rev}, {}
+        raise CouchError(405, "method_not_allowed", "Only GET,HEAD,PUT,DELETE allowed")
+
+    def local_document(self, db, doc_id):
+        if self.method in ("GET", "HEAD"):
+            if doc_id not in db.local_docs:
+                raise CouchError(404, "not_found", "missing")
+            return 200, db.local_docs[doc_id], {}
+        if self.method == "PUT":
+            db.local_docs[doc_id] = dict(self.body, _id=doc_id, _rev="0-1")
+            return 201, {"ok": True, "id": doc_id, "rev": "0-1"}, {}
+        db.local_docs.pop(doc_id, None)
+        return 200, {"ok": True, "id": doc_id, "rev": "0-0"}, {}
+
+    def all_docs(self, db, parts):
+        keys = self.body.get("keys") if self.method == "POST" else None
+        if keys is None:
+            keys = self.json_param("keys")
+        include_docs = self.bool_param("include_docs")
+
+        def row(doc):
+            result = {
+                "id": doc["_id"],
+                "key": doc["_id"],
+                "value": {"rev": doc["_rev"]},
+            }
+            if doc.get("_deleted"):
+                result["value"]["deleted"] = True
+                if include_docs:
+                    result["doc"] = None
+            elif include_docs:
+                result["doc"] = doc
+            return result
+
+        if keys is not None:
+            rows = [
+                row(db.docs[key])
+                if key in db.docs
+                else {"key": key, "error": "not_found"}
+                for key in keys
+            ]
+        else:
+            docs = sorted(db.live_docs(), key=lambda doc: doc["_id"])
+            if self.bool_param("descending"):
+                docs.reverse()
+            start = self.json_param("startkey", self.json_param("start_key"))
+            end = self.json_param("endkey", self.json_param("end_key"))
+            key = self.json_param("key")
+            descending = self.bool_param("descending")
+            inclusive_end = self.bool_param("inclusive_end", True)
+            selected = []
+            for doc in docs:
+                doc_id = doc["_id"]
+                if key is not None and doc_id != key:
+                    continue
+                if start is not None and (
+                    doc_id > start if descending else doc_id < start
+                ):
+                    continue
+                if end is not None:
+                    after = doc_id < end if descending else doc_id > end
+                    if after or (not inclusive_end and doc_id == end):
+                        continue
+                selected.append(doc)
+            skip = int(self.query.get("skip", 0))
+            limit = int(self.query["limit"]) if "limit" in self.query else None
+            selected = selected[skip : skip + limit if limit is not None else None]
+            rows = [row(doc) for doc in selected]
+        return 200, {"total_rows": len(db.live_docs()), "offset": 0, "rows": rows}, {}
+
+    def bulk_get(self, db, parts):
+        results = []
+        for item in self.body.get("docs", []):
+            doc = db.docs.get(item["id"])
+            if doc is None:
+                results.append(
+                    {
+                        "id": item["id"],
+                        "docs": [
+                            {
+                                "error": {
+                                    "id": item["id"],
+                                    "error": "not_found",
+                                    "reason": "missing",
+                                }
+                            }
+                        ],
+                    }
+                )
+            else:
+                results.append({"id": item["id"], "docs": [{"ok": doc}]})
+        return 200, {"results": results}, {}
+
+    def find(self, db, parts):
+        query = self.body
+        selector = query.get("selector")
+        if not isinstance(selector, dict):
+            raise CouchError(400, "bad_request", "Missing required key: selector")
+        docs = [
+            doc
+            for doc in db.live_docs()
+            if not doc["_id"].startswith("_design/") and match_selector(doc, selector)
+        ]
+        docs.sort(key=lambda doc: doc["_id"])
+        for sort in reversed(query.get("sort") or []):
+            field, direction = (
+                next(iter(sort.items())) if isinstance(sort, dict) else (sort, "asc")
+            )
+            docs.sort(
+                key=lambda doc: _collation_key(get_field(doc, field)[1]),
+                reverse=direction == "desc",
+            )
+
+        skip = int(query.get("skip", 0))
+        if query.get("bookmark") and query["bookmark"] != "nil":
+            skip = int(query["bookmark"])
+        limit = int(query.get("limit", 25))
+        page = docs[skip : skip + limit]
+        return (
+            200,
+            {
+                "docs": [project_fields(doc, query.get("fields")) for doc in page],
+                "bookmark": str(skip + len(page)),
+            },
+            {},
+        )
+
+    def explain(self, db, parts):
+        selector = self.body.get("selector") or {}
+        fields = set(selector)
+        best = None
+        for index in db.indexes():
+            index_fields = [list(f)[0] for f in index["def"]["fields"]]
+            if index_fields and set(index_fields) <= fields:
+                if best is None or len(index_fields) > len(best["def"]["fields"]):
+                    best = index
+        if best is None:
+            best = {
+                "ddoc": None,
+                "name": "_all_docs",
+                "type": "special",
+                "def": {"fields": [{"_id": "asc"}]},
+            }
+        return 200, {"dbname": db.name, "index": best, "selector": selector}, {}
+
+    def index(self, db, parts):
+        if self.method == "GET":
+            special = {
+                "ddoc": None,
+                "name": "_all_docs",
+                "type": "special",
+                "def": {"fields": [{"_id": "asc"}]},
+            }
+            indexes = [special] + db.indexes()
+            return 200, {"total_rows": len(indexes), "indexes": indexes}, {}
+        if self.method == "DELETE":
+            ddoc_id = f"_design/{parts[0]}"
+            doc = dict(db.get(ddoc_id))
+            views = dict(doc.get("views", {}))
+            if parts[-1] not in views:
+                raise CouchError(404, "not_found", "Index not found")
+            del views[parts[-1]]
+            if views:
+                doc["views"] = views
+            else:
+                doc["_deleted"] = True
+            self.couch.write(db, doc)
+            return 200, {"ok": True}, {}
+
+        body = self.body
+        fields = body["index"]["fields"]
+        field_names = [list(f)[0] if isinstance(f, dict) else f for f in fields]
+        name = (
+            body.get("name")
+            or hashlib.md5(json.dumps(field_names).encode()).hexdigest()
+        )
+        ddoc_id = "_design/" + (body.get("ddoc") or name)
+        view = {
+            "map": {
+                "fields": {f: "asc" for f in field_names},
+                "partial_filter_selector": {},
+            },
+            "reduce": "_count",
+            "options": {"def": {"fields": fields}},
+        }
+        current = db.docs.get(ddoc_id)
+        if current and not current.get("_deleted"):
+            if current.get("views", {}).get(name) == view:
+                return 200, {"result": "exists", "id": ddoc_id, "name": name}, {}
+            doc = dict(current, views=dict(current.get("views", {}), **{name: view}))
+        else:
+            doc = {"_id": ddoc_id, "language": "query", "views": {name: view}}
+        self.couch.write(db, doc)
+        return 200, {"result": "created", "id": ddoc_id, "name": name}, {}
+
+    def view(self, db, ddoc_id, name):
+        ddoc = db.docs.get(ddoc_id)
+        if not ddoc or ddoc.get("_deleted") or name not in ddoc.get("views", {}):
+            raise CouchError(404, "not_found", "missing_named_view")
+        view = ddoc["views"][name]
+        map_function = MAP_FUNCTIONS.get(view.get("map"))
+        if map_function is None:
+            raise CouchError(500, "unsupported", "Unknown map function")
+
+        rows = []
+        for doc in db.live_docs():
+            if doc["_id"].startswith("_design/"):
+                continue
+            for key, value in map_function(doc):
+                rows.append({"id": doc["_id"], "key": key, "value": value})
+        total_rows = len(rows)
+        rows.sort(key=lambda row: (_collation_key(row["key"]), row["id"]))
+
+        key = self.json_param("key")
+        start = self.json_param("startkey", self.json_param("start_key"))
+        end = self.json_param("endkey", self.json_param("end_key"))
+        inclusive_end = self.bool_param("inclusive_end", True)
+        if key is not None:
+            rows = [row for row in rows if _compare(row["key"], key) == 0]
+        if start is not None:
+            rows = [row for row in rows if _compare(row["key"], start) >= 0]
+        if end is not None:
+            rows = [
+                row
+                for row in rows
+                if _compare(row["key"], end) < (1 if inclusive_end else 0)
+            ]
+
+        if not view.get("reduce") or not self.bool_param("reduce", True):
+            return 200, {"total_rows": total_rows, "offset": 0, "rows": rows}, {}
+
+        if self.bool_param("group"):
+            group_level = None
+        else:
+            group_level = int(self.query.get("group_level", 0))
+        groups = OrderedDict()
+        for row in rows:
+            group = row["key"]
+            if group_level == 0:
+                group = None
+            elif group_level is not None and isinstance(group, list):
+                group = group[:group_level]
+            groups.setdefault(json.dumps(group), (group, []))[1].append(row["value"])
+        return (
+            200,
+            {
+                "rows": [
+                    {"key": group, "value": _reduce(view["reduce"], values)}
+                    for group, values in groups.values()
+                ]
+            },
+            {},
+        )
+
+    def bulk_docs(self, db, parts):
+        body = self.body
+        new_edits = body.get("new_edits", True)
+        results = []
+        doc_ids = []
+        for doc in body.get("docs", []):
+            try:
+                doc_id, rev = db.put(doc, new_edits)
+                doc_ids.append(doc_id)
+                results.append({"ok": True, "id": doc_id, "rev": rev})
+            except CouchError as e:
+                results.append(
+                    {"id": doc.get("_id"), "error": e.error, "reason": e.reason}
+                )
+        if doc_ids:
+            self.couch.after_write(db, doc_ids)
+        return 201, results, {}
+
+    def changes(self, db, parts):
+        body = self.body if self.method == "POST" else {}
+        since = self.query.get("since", "0")
+        since = db.seq if since == "now" else int(str(since).split("-")[0] or 0)
+        limit = int(self.query["limit"]) if "limit" in self.query else None
+        include_docs = self.bool_param("include_docs")
+        filter_name = self.query.get("filter")
+        selector = body.get("selector") if filter_name == "_selector" else None
+        doc_ids = body.get("doc_ids") if filter_name == "_doc_ids" else None
+        if filter_name == "_doc_ids" and doc_ids is None:
+            doc_ids = self.json_param("doc_ids")
+
+        def collect():
+            results = []
+            last_seq = since
+            for doc_id, seq in db.changes.items():
+                if seq <= since:
+                    continue
+                doc = db.docs[doc_id]
+                last_seq = seq
+                if doc_ids is not None and doc_id not in doc_ids:
+                    continue
+                if filter_name == "_design" and not doc_id.startswith("_design/"):
+                    continue
+                if selector is not None and (
+                    doc.get("_deleted") or not match_selector(doc, selector)
+                ):
+                    continue
+                result = {
+                    "seq": f"{seq}-fake",
+                    "id": doc_id,
+                    "changes": [{"rev": doc["_rev"]}],
+                }
+                if doc.get("_deleted"):
+                    result["deleted"] = True
+                if include_docs:
+                    result["doc"] = doc
+                results.append(result)
+                if limit is not None and len(results) >= limit:
+                    break
+            return results, last_seq
+
+        results, last_seq = collect()
+        if not results and self.query.get("feed") in ("longpoll", "continuous"):
+            timeout = int(self.query.get("timeout", 60000)) / 1000
+            deadline = time.monotonic() + timeout
+            while not results and time.monotonic() < deadline:
+                self.couch.changed.wait(deadline - time.monotonic())
+                results, last_seq = collect()
+        pending = sum(1 for seq in db.changes.values() if seq > last_seq)
+        return (
+            200,
+            {"results": results, "last_seq": f"{last_seq}-fake", "pending": pending},
+            {},
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory fake CouchDB server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5984)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Milliseconds added to every request to model the network round trip",
+    )
+    args = parser.parse_args()
+    couch = FakeCouchDB(args.host, args.port, args.latency / 1000)
+    print(f"Fake CouchDB listening on {couch.url} (latency {args.latency} ms)")
+    try:
+        couch.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# asyncio counterpart of no_sql_client.py, meant to fan out reads and writes
+# over many databases (e.g. every facilitator database) with several requests
+# in flight instead of one after another.
+# The requests go through the shared, pooled CouchDB session of NoSQLClient and
+# run in worker threads, so no other HTTP library is needed.
+import asyncio
+
+from django.conf import settings
+
+from no_sql_client import NoSQLClient
+
+
+async def gather(*aws, limit=None):
+    """
+    Like asyncio.gather but with at most `limit` (NO_SQL_CONCURRENCY by default)
+    awaitables running at the same time
+    """
+    semaphore = asyncio.Semaphore(limit or settings.NO_SQL_CONCURRENCY)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+class AsyncNoSQLClient:
+    def __init__(self, username=None, password=None, url=None):
+        # NoSQLClient falls back on the settings
+        self.nsc = NoSQLClient(username, password, url)
+
+    async def get_dbs(self):
+        return await asyncio.to_thread(self.nsc.get_dbs)
+
+    async def get_db(self, db_name):
+        return await asyncio.to_thread(self.nsc.get_db, db_name)
+
+    async def get_query_result(self, db, selector, fields=None):
+        """
+        Return the list of every document matching the selector
+        """
+        return await asyncio.to_thread(
+            self.nsc.find_documents, db, selector, fields=fields
+        )
+
+    async def all_docs(self, db, **kwargs):
+        return await asyncio.to_thread(db.all_docs, **kwargs)
+
+    async def bulk_get(self, db, ids, chunk_size=None):
+        return await asyncio.to_thread(self.nsc.bulk_get, db, ids, chunk_size)
+
+    async def bulk_upsert(self, db, docs, chunk_size=None):
+        return await asyncio.to_thread(self.nsc.bulk_upsert, db, docs, chunk_size)
+
+    async def bulk_delete(self, db, docs, chunk_size=None):
+        return await asyncio.to_thread(self.nsc.bulk_delete, db, docs, chunk_size)
+
+    async def upsert_document(self, db, doc, merge=None):
+        return await asyncio.to_thread(self.nsc.upsert_document, db, doc, merge)
@@ -1,35 +1,131 @@
+import json
+import os
+import threading
+from urllib.parse import quote
+
 from django.conf import settings
 
+from no_sql_instrumentation import record_response
+
+_clients = {}
+_clients_lock = threading.Lock()
+_existing_dbs = set()
+
+
+def get_shared_client(username, password, url):
+    """
+    Return the process-wide CouchDB client for the given credentials.
+    The client logs in on first use and is then reused by every NoSQLClient, so
+    connections are kept alive in a bounded pool and the session cookie is
+    renewed by cloudant when it expires.
+    """
+    key = (username, password, url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _connect(username, password, url)
+                _clients[key] = client
+    return client
+
+
+def _connect(username, password, url):
+    from cloudant.client import CouchDB
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.NO_SQL_POOL_MAXSIZE,
+        pool_block=True,
+    )
+    client = CouchDB(
+        username,
+        password,
+        url=url,
+        connect=True,
+        auto_renew=True,
+        adapter=adapter,
+        timeout=settings.NO_SQL_TIMEOUT,
+    )
+    client.r_session.hooks["response"].append(record_response)
+    return client
+
+
+def reset_clients():
+    """
+    Forget every shared client. Sockets can't be shared between processes, so
+    this runs in each child after a fork (gunicorn workers) and can also be
+    called from a gunicorn ``post_fork`` hook.
+    """
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    _existing_dbs.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_clients)
+
+
+def merge_fields(*fields):
+    """
+    Conflict merge for upsert_document: keep the latest revision of the document
+    and only apply the given fields on it
+    """
+
+    def merge(latest, doc):
+        latest.update({field: doc[field] for field in fields if field in doc})
+        return latest
+
+    return merge
+
 
 class NoSQLClient:
-    def __init__(
-        self,
-        username=settings.NO_SQL_USER,
-        password=settings.NO_SQL_PASS,
-        url=settings.NO_SQL_URL,
-    ):
-        self.username = username
-        self.password = password
-        self.url = url
-        self.client = self.get_client()
+    def __init__(self, username=None, password=None, url=None):
+        # The settings are read here rather than at import, so that they can be
+        # overridden (by the tests, against fake_couchdb)
+        self.username = username or settings.NO_SQL_USER
+        self.password = password or settings.NO_SQL_PASS
+        self.url = url or settings.NO_SQL_URL
+        self._client = None
 
-    def get_client(self):
-        from cloudant.client import CouchDB
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.get_client()
+        return self._client
 
-        return CouchDB(
-            self.username, self.password, url=self.url, connect=True, auto_renew=True
-        )
+    def get_client(self):
+        return get_shared_client(self.username, self.password, self.url)
 
     def get_dbs(self):
         return self.client.all_dbs()
 
     def get_db(self, db_name):
-        return self.client[db_name]
+        # A new database object is returned on every call so that its document
+        # cache is not shared between requests; only the existence check is cached.
+        from cloudant.database import CouchDatabase
+
+        db = CouchDatabase(self.client, db_name)
+        if (self.url, db_name) not in _existing_dbs:
+            if not db.exists():
+                raise KeyError(db_name)
+            _existing_dbs.add((self.url, db_name))
+        return db
 
     def create_db(self, db_name, **kwargs):
-        return self.client.create_database(db_name, **kwargs)
+        from cloudant.database import CouchDatabase
+
+        db = CouchDatabase(
+            self.client, db_name, partitioned=kwargs.get("partitioned", False)
+        )
+        db.create(kwargs.get("throw_on_exists", False))
+        _existing_dbs.add((self.url, db_name))
+        return db
 
     def delete_db(self, db_name):
+        _existing_dbs.discard((self.url, db_name))
         try:
             self.client.delete_database(db_name)
         except Exception as e:
@@ -41,30 +137,34 @@ class NoSQLClient:
 
     def update_doc(self, db, id, doc_new: dict):
         try:
-            doc = db.get(id)
+            # db[id] reads the document from the server when it isn't in the local
+            # cache of db, db.get(id) only looks in that cache
+            doc = db[id]
             for k, v in doc_new.items():
                 if v:
                     doc[k] = v
-            db[id] = doc
-            db[id].save()
+            doc["_rev"] = self.upsert_document(db, doc, merge_fields(*doc_new.keys()))
         except Exception as exc:
             print(exc)
             return {}
         return doc
 
     def update_cloudant_document(
-        self, db, doc_id, doc_new: dict, dict_of_list_values: dict = {}, attachments=[]
+        self,
+        db,
+        doc_id,
+        doc_new: dict,
+        dict_of_list_values: dict = {},
+        attachments=[],
+        merge=None,
     ):
         """
         dict_of_list_values: dict : content as key the attribut of the document who have as value as list and the values of
         this key are the attributes than we'll modify their values
+        merge: conflict merge function given to upsert_document
         """
-        _p = {}
+        _p = {"_id": doc_id}
         try:
-            from cloudant.document import Document
-
-            _p = Document(db, doc_id)
-
             for k, v in doc_new.items():
                 if k in list(
                     dict_of_list_values.keys()
@@ -92,17 +192,266 @@ class NoSQLClient:
                                 elt[_v] = new_elt.get(_v)
                         attr.append(elt)
 
-                    _p.field_set(_p, k, attr)
+                    _p[k] = attr
                     continue
 
-                _p.field_set(_p, k, v)
+                _p[k] = v
 
-            _p.save()
+            _p["_rev"] = self.upsert_document(db, _p, merge)
         except Exception as exc:
             print(exc)
             return {}
         return _p
 
+    def upsert_document(self, db, doc, merge=None, retries=3):
+        """
+        Create or update the document in a single request, using the _rev it carries
+        (no read before the write). On a 409 conflict the latest revision is read and
+        merge(latest, doc) gives the document to write again, by default the fields
+        of doc override the latest ones. A document without _id is created with a
+        POST and never retried. Returns the new revision.
+        """
+        from cloudant.document import Document
+
+        merge = merge or (lambda latest, doc: {**latest, **doc})
+        headers = {"Content-Type": "application/json"}
+        if not doc.get("_id"):
+            resp = db.r_session.post(
+                db.database_url,
+                data=json.dumps(doc, cls=db.client.encoder),
+                headers=headers,
+            )
+            resp.raise_for_status()
+            return resp.json()["rev"]
+
+        document_url = Document(db, doc["_id"]).document_url
+        while True:
+            data = json.dumps(doc, cls=db.client.encoder)
+            resp = db.r_session.put(document_url, data=data, headers=headers)
+
+            if resp.status_code == 409 and retries > 0:
+                retries -= 1
+                latest = db.r_session.get(document_url)
+                latest.raise_for_status()
+                latest = latest.json()
+                doc = merge(latest, doc)
+                doc["_rev"] = latest["_rev"]
+                continue
+
+            resp.raise_for_status()
+            return resp.json()["rev"]
+
+    def find_documents(self, db, selector, fields=None, batch_size=None):
+        """
+        Return every document matching the Mango selector, paging through
+        _find with bookmarks instead of the skip based paging of get_query_result
+        """
+        batch_size = batch_size or settings.NO_SQL_BULK_SIZE
+        url = "/".join((db.database_url, "_find"))
+        query = {"selector": selector, "limit": batch_size}
+        if fields:
+            query["fields"] = fields
+        docs = []
+        while True:
+            resp = db.r_session.post(
+                url,
+                data=json.dumps(query, cls=db.client.encoder),
+                headers={"Content-Type": "application/json"},
+            )
+            resp.raise_for_status()
+            result = resp.json()
+            docs.extend(result["docs"])
+            if len(result["docs"]) < batch_size or not result.get("bookmark"):
+                return docs
+            query["bookmark"] = result["bookmark"]
+
+    def bulk_get(self, db, ids, chunk_size=None):
+        """
+        Fetch documents by id through _all_docs?keys=, chunk_size ids per request.
+        Missing or deleted ids are left out of the result.
+        """
+        docs = []
+        ids = list(ids)
+        chunk_size = chunk_size or settings.NO_SQL_BULK_SIZE
+        for i in range(0, len(ids), chunk_size):
+            rows = db.all_docs(keys=ids[i : i + chunk_size], include_docs=True)
+            for row in rows["rows"]:
+                if row.get("doc"):
+                    docs.append(row["doc"])
+        return docs
+
+    def bulk_upsert(self, db, docs, chunk_size=None):
+        """
+        Create or update documents through _bulk_docs. Documents carrying a _rev
+        are updated, the others are created. Returns one result per document,
+        either {"id", "rev", "ok"} or {"id", "error", "reason"}.
+        """
+        results = []
+        for chunk in self._bulk_chunks(docs, chunk_size):
+            results.extend(db.bulk_docs(chunk))
+        return results
+
+    def bulk_delete(self, db, docs, chunk_size=None):
+        """
+        Delete documents through _bulk_docs. Each document needs its _id and _rev.
+        """
+        return self.bulk_upsert(
+            db,
+            [
+                {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+                for doc in docs
+            ],
+            chunk_size,
+        )
+
+    @staticmethod
+    def bulk_errors(results):
+        return [result for result in results if result.get("error")]
+
+    @staticmethod
+    def _bulk_chunks(docs, chunk_size=None):
+        """
+        Split the documents in requests of at most chunk_size documents and
+        NO_SQL_BULK_MAX_BYTES bytes (a single bigger document gets its own request)
+        """
+        chunk_size = chunk_size or settings.NO_SQL_BULK_SIZE
+        chunk = []
+        chunk_bytes = 0
+        for doc in docs:
+            doc_bytes = len(json.dumps(doc))
+            if chunk and (
+                len(chunk) >= chunk_size
+                or chunk_bytes + doc_bytes > settings.NO_SQL_BULK_MAX_BYTES
+            ):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(doc)
+            chunk_bytes += doc_bytes
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _local_document_url(db, name):
+        return "/".join((db.database_url, "_local", quote(name, safe="")))
+
+    def get_local_document(self, db, name):
+        """
+        Return the _local document (never replicated), or None if it doesn't exist
+        """
+        resp = db.r_session.get(self._local_document_url(db, name))
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    def put_local_document(self, db, name, doc):
+        """
+        Write the _local document, doc carrying the _rev it was read with
+        """
+        resp = db.r_session.put(
+            self._local_document_url(db, name),
+            data=json.dumps(doc, cls=db.client.encoder),
+            headers={"Content-Type": "application/json"},
+        )
+        resp.raise_for_status()
+        return resp.json()["rev"]
+
+    def get_changes(
+        self, db, since="0", limit=None, include_docs=True, feed="normal", timeout=None
+    ):
+        """
+        Read the changes of the database after the `since` sequence, at most `limit`
+        of them. With feed="longpoll" the request waits up to `timeout` seconds for
+        a change. Returns {"results": [...], "last_seq": ..., "pending": ...}
+        """
+        params = {
+            "since": since,
+            "feed": feed,
+            "include_docs": json.dumps(include_docs),
+        }
+        if limit:
+            params["limit"] = limit
+        if timeout is not None:
+            params["timeout"] = self._feed_timeout(timeout)
+        resp = db.r_session.get("/".join((db.database_url, "_changes")), params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    def get_db_updates(self, since="now", limit=None, feed="normal", timeout=None):
+        """
+        Read the databases created, updated or deleted after the `since` sequence
+        of _db_updates (needs an admin user).
+        Returns {"results": [{"db_name", "type", "seq"}...], "last_seq": ...}
+        """
+        params = {"since": since, "feed": feed}
+        if limit:
+            params["limit"] = limit
+        if timeout is not None:
+            params["timeout"] = self._feed_timeout(timeout)
+        resp = self.client.r_session.get(
+            "/".join((self.client.server_url, "_db_updates")), params=params
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    @staticmethod
+    def _feed_timeout(timeout):
+        """
+        Milliseconds a longpoll feed waits for a change. The session timeout applies
+        to every request, so the feed has to answer well before it.
+        """
+        if settings.NO_SQL_TIMEOUT:
+            timeout = min(timeout, settings.NO_SQL_TIMEOUT / 2)
+        return int(timeout * 1000)
+
+    def get_indexes(self, db):
+        return db.get_query_indexes(raw_result=True)["indexes"]
+
+    def create_index(self, db, design_document_id, index_name, fields):
+        return db.create_query_index(
+            design_document_id=design_document_id,
+            index_name=index_name,
+            fields=fields,
+        )
+
+    def delete_index(self, db, design_document_id, index_name):
+        db.delete_query_index(design_document_id, "json", index_name)
+
+    def get_design_document(self, db, design_document_id):
+        """
+        Return the design document, or None if it doesn't exist
+        """
+        resp = db.r_session.get("/".join((db.database_url, design_document_id)))
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    def get_view(self, db, design_document_id, view_name, **params):
+        """
+        Return the rows of the map/reduce view. The params (group_level, key,
+        startkey, endkey, reduce...) are JSON encoded as CouchDB expects them.
+        """
+        resp = db.r_session.get(
+            "/".join((db.database_url, design_document_id, "_view", view_name)),
+            params={k: json.dumps(v) for k, v in params.items()},
+        )
+        resp.raise_for_status()
+        return resp.json()["rows"]
+
+    def explain(self, db, selector):
+        """
+        Return the query plan of the selector, "index" tells which index is used
+        """
+        resp = db.r_session.post(
+            "/".join((db.database_url, "_explain")),
+            data=json.dumps({"selector": selector}, cls=db.client.encoder),
+            headers={"Content-Type": "application/json"},
+        )
+        resp.raise_for_status()
+        return resp.json()
+
     def create_user(self, username, password):
         db = self.get_db("_users")
         return db.create_document(
@@ -0,0 +1,142 @@
+# Mango indexes used by the queries of the dashboard and the sync routines.
+# Each index lives in its own design document so that changing one of them
+# doesn't rebuild the others. The facilitator indexes are also created in the
+# "design" database, which is replicated to every new facilitator database.
+
+FACILITATOR_DB_PREFIX = "facilitator_"
+
+PROCESS_DESIGN_INDEXES = [
+    {"name": "type", "fields": ["type"]},
+    {"name": "type-sql_id", "fields": ["type", "sql_id"]},
+]
+
+ADMINISTRATIVE_LEVELS_INDEXES = [
+    {"name": "type-administrative_id", "fields": ["type", "administrative_id"]},
+    {"name": "type-parent_id", "fields": ["type", "parent_id"]},
+    {
+        "name": "type-administrative_level",
+        "fields": ["type", "administrative_level"],
+    },
+]
+
+FACILITATOR_INDEXES = [
+    {"name": "type", "fields": ["type"]},
+    {"name": "type-sql_id", "fields": ["type", "sql_id"]},
+    {"name": "type-order", "fields": ["type", "order"]},
+    {
+        "name": "type-administrative_level_id",
+        "fields": ["type", "administrative_level_id"],
+    },
+    {
+        "name": "type-administrative_level_id-sql_id",
+        "fields": ["type", "administrative_level_id", "sql_id"],
+    },
+    {
+        "name": "type-administrative_level_id-order",
+        "fields": ["type", "administrative_level_id", "order"],
+    },
+]
+
+# Representative selectors of the queries run against each kind of database,
+# checked with _explain by the create_no_sql_indexes command
+PROCESS_DESIGN_SELECTORS = [
+    {"type": "phase"},
+    {"type": "task", "sql_id": 1},
+]
+
+ADMINISTRATIVE_LEVELS_SELECTORS = [
+    {"type": "administrative_level", "administrative_id": "1"},
+    {"type": "administrative_level", "administrative_id": {"$in": ["1", "2"]}},
+    {"type": "administrative_level", "parent_id": "1"},
+    {"type": "administrative_level", "parent_id": None},
+    {"type": "administrative_level", "administrative_level": "Village"},
+]
+
+FACILITATOR_SELECTORS = [
+    {"type": "facilitator"},
+    {"type": "task"},
+    {"type": "task", "sql_id": 1},
+    {"type": "task", "sql_id": {"$in": [1, 2]}},
+    {"type": {"$in": ["phase", "task"]}, "sql_id": {"$in": [1, 2]}},
+    {"type": {"$in": ["phase", "task"]}, "order": {"$in": [1, 2]}},
+    {"type": "task", "administrative_level_id": "1"},
+    {"type": "task", "administrative_level_id": "1", "phase_name": "Phase"},
+    {
+        "administrative_level_id": "1",
+        "project_id": "project",
+        "type": "phase",
+        "sql_id": 1,
+    },
+    {
+        "administrative_level_id": "1",
+        "project_id": "project",
+        "phase_id": "phase",
+        "activity_id": "activity",
+        "type": "task",
+        "order": 1,
+    },
+]
+
+
+def get_indexes_by_database(db_names):
+    """
+    Return the list of (database name, indexes, selectors) to provision for the given
+    database names. Databases without registered indexes are left out.
+    """
+    result = []
+    for db_name in db_names:
+        if db_name == "process_design":
+            result.append((db_name, PROCESS_DESIGN_INDEXES, PROCESS_DESIGN_SELECTORS))
+        elif db_name == "administrative_levels":
+            result.append(
+                (
+                    db_name,
+                    ADMINISTRATIVE_LEVELS_INDEXES,
+                    ADMINISTRATIVE_LEVELS_SELECTORS,
+                )
+            )
+        elif db_name == "design" or db_name.startswith(FACILITATOR_DB_PREFIX):
+            result.append((db_name, FACILITATOR_INDEXES, FACILITATOR_SELECTORS))
+    return result
+
+
+def get_design_document_id(index):
+    return f"_design/idx-{index['name']}"
+
+
+def ensure_indexes(nsc, db, indexes):
+    """
+    Create the missing indexes of the database and recreate the ones whose fields
+    changed. Returns a dict index name -> "created", "updated" or "exists".
+    """
+    existing = {}
+    for index in nsc.get_indexes(db):
+        if index.get("ddoc"):
+            existing[index["ddoc"]] = [
+                list(field.keys())[0] for field in index["def"]["fields"]
+            ]
+
+    statuses = {}
+    for index in indexes:
+        ddoc = get_design_document_id(index)
+        if ddoc not in existing:
+            nsc.create_index(db, ddoc, index["name"], index["fields"])
+            statuses[index["name"]] = "created"
+        elif existing[ddoc] != index["fields"]:
+            nsc.delete_index(db, ddoc, index["name"])
+            nsc.create_index(db, ddoc, index["name"], index["fields"])
+            statuses[index["name"]] = "updated"
+        else:
+            statuses[index["name"]] = "exists"
+    return statuses
+
+
+def find_full_scans(nsc, db, selectors):
+    """
+    Return the selectors that CouchDB can only answer by scanning the whole database
+    """
+    return [
+        selector
+        for selector in selectors
+        if nsc.explain(db, selector)["index"]["type"] == "special"
+    ]
@@ -0,0 +1,130 @@
+# Counters and timers of the requests sent to CouchDB.
+# Every response of the shared NoSQLClient session goes through record_response,
+# which adds it to the collector of the current context (a request handled by
+# NoSQLInstrumentationMiddleware, a benchmark, a sync run...) and to the collectors
+# it is nested in. Nothing is recorded outside of collect_no_sql_requests().
+import contextvars
+import json
+import re
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
+_collector = contextvars.ContextVar("no_sql_collector", default=None)
+
+
+def get_shape(value):
+    """
+    Return the selector with its values replaced by "?", so that the queries
+    only differing by their values have the same shape
+    """
+    if isinstance(value, dict):
+        return {k: get_shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        return [get_shape(v) for v in value if isinstance(v, (dict, list))] or "?"
+    return "?"
+
+
+def count_body_bytes(response, call):
+    """
+    Add the bytes of the response body to the call as they are read: the body
+    isn't read yet when the response is recorded, and _find, _all_docs or _changes
+    are sent with a chunked encoding, without a Content-Length
+    """
+    iter_content = response.iter_content
+
+    def counted_iter_content(*args, **kwargs):
+        for chunk in iter_content(*args, **kwargs):
+            call["bytes"] += len(chunk)
+            yield chunk
+
+    response.iter_content = counted_iter_content
+
+
+class NoSQLRequestCollector:
+    def __init__(self):
+        self.calls = []
+        self.parent = None
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def duration(self):
+        return sum(call["duration"] for call in self.calls)
+
+    @property
+    def bytes(self):
+        return sum(call["bytes"] for call in self.calls)
+
+    def record(self, response):
+        request = response.request
+        parts = [
+            unquote(part) for part in urlsplit(request.url).path.split("/") if part
+        ]
+        db = parts[0] if parts else ""
+        if len(parts) < 2:
+            endpoint = ""
+        elif parts[1].startswith("_"):
+            endpoint = parts[1]
+        else:
+            endpoint = "doc"
+
+        body = request.body if isinstance(request.body, (str, bytes)) else None
+        shape = f"{request.method} {endpoint}".strip()
+        if endpoint in ("_find", "_explain") and body:
+            try:
+                selector = json.loads(body).get("selector")
+                shape = json.dumps(get_shape(selector), sort_keys=True)
+            except ValueError:
+                pass
+
+        call = {
+            "method": request.method,
+            "db": db,
+            "endpoint": endpoint,
+            "shape": shape,
+            "status": response.status_code,
+            "duration": response.elapsed.total_seconds() * 1000,
+            "bytes": len(body or b""),
+        }
+        self.calls.append(call)
+        count_body_bytes(response, call)
+
+    def by_shape(self):
+        """
+        Return the calls grouped by (database, shape) with their count and duration,
+        the facilitator databases being grouped together
+        """
+        stats = {}
+        for call in self.calls:
+            db = re.sub(r"^facilitator_.*", "facilitator_*", call["db"])
+            stat = stats.setdefault(
+                (db, call["shape"]),
+                {"db": db, "shape": call["shape"], "count": 0, "duration": 0},
+            )
+            stat["count"] += 1
+            stat["duration"] += call["duration"]
+        return sorted(stats.values(), key=lambda stat: -stat["duration"])
+
+    def repeated_shapes(self, threshold):
+        return [stat for stat in self.by_shape() if stat["count"] > threshold]
+
+
+@contextmanager
+def collect_no_sql_requests(collector=None):
+    collector = collector or NoSQLRequestCollector()
+    collector.parent = _collector.get()
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+
+
+def record_response(response, *args, **kwargs):
+    collector = _collector.get()
+    while collector is not None:
+        collector.record(response)
+        collector = collector.parent
+    return response
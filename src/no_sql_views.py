@@ -0,0 +1,128 @@
+# Map/reduce views of the facilitator databases, used by the completion statistics
+# of the dashboard instead of downloading the task documents. The views live in the
+# "stats" design document of the "design" database, which is replicated to every
+# new facilitator database, and of the existing facilitator databases (see the
+# create_no_sql_indexes command).
+#
+# The task_completion view emits one row per task, keyed by
+# [administrative_level_id, phase_name, activity_name, name] with [1, completed]
+# as value: its _sum gives [tasks, completed tasks] for any group_level, a whole
+# database at group_level 0 and a village at group_level 1.
+#
+# The fake CouchDB of the tests and benchmarks can't run JavaScript: it runs the
+# Python twin of a map function, found in MAP_FUNCTIONS by its source.
+from requests import HTTPError
+
+from no_sql_indexes import FACILITATOR_DB_PREFIX
+
+DESIGN_DOCUMENT_ID = "_design/stats"
+TASK_COMPLETION_VIEW = "task_completion"
+
+TASK_COMPLETION_MAP = """function (doc) {
+  if (doc.type === "task") {
+    var administrative_level_id = doc.administrative_level_id;
+    emit(
+      [
+        administrative_level_id == null ? null : String(administrative_level_id),
+        doc.phase_name || null,
+        doc.activity_name || null,
+        doc.name || null
+      ],
+      [1, doc.completed ? 1 : 0]
+    );
+  }
+}"""
+
+
+def map_task_completion(doc):
+    if doc.get("type") == "task":
+        administrative_level_id = doc.get("administrative_level_id")
+        yield (
+            [
+                None
+                if administrative_level_id is None
+                else str(administrative_level_id),
+                doc.get("phase_name") or None,
+                doc.get("activity_name") or None,
+                doc.get("name") or None,
+            ],
+            [1, 1 if doc.get("completed") else 0],
+        )
+
+
+MAP_FUNCTIONS = {TASK_COMPLETION_MAP: map_task_completion}
+
+FACILITATOR_DESIGN_DOCUMENTS = [
+    {
+        "_id": DESIGN_DOCUMENT_ID,
+        "language": "javascript",
+        "views": {
+            TASK_COMPLETION_VIEW: {"map": TASK_COMPLETION_MAP, "reduce": "_sum"},
+        },
+    },
+]
+
+
+def get_design_documents_by_database(db_names):
+    """
+    Return the list of (database name, design documents) to provision for the
+    given database names. Databases without registered views are left out.
+    """
+    return [
+        (db_name, FACILITATOR_DESIGN_DOCUMENTS)
+        for db_name in db_names
+        if db_name == "design" or db_name.startswith(FACILITATOR_DB_PREFIX)
+    ]
+
+
+def ensure_design_documents(nsc, db, design_documents):
+    """
+    Create the missing design documents of the database and update the ones whose
+    views changed. Returns a dict design document id -> "created", "updated" or
+    "exists".
+    """
+    statuses = {}
+    for design_document in design_documents:
+        current = nsc.get_design_document(db, design_document["_id"])
+        if current is None:
+            nsc.upsert_document(db, dict(design_document))
+            statuses[design_document["_id"]] = "created"
+        elif any(current.get(k) != v for k, v in design_document.items()):
+            nsc.upsert_document(db, {**design_document, "_rev": current["_rev"]})
+            statuses[design_document["_id"]] = "updated"
+        else:
+            statuses[design_document["_id"]] = "exists"
+    return statuses
+
+
+def get_task_completion(nsc, db, group_level=0, **params):
+    """
+    Return [tasks, completed tasks] by key of the given group_level (the empty
+    tuple for group_level 0). A database whose design document is missing gets it
+    first.
+    """
+    try:
+        rows = nsc.get_view(
+            db,
+            DESIGN_DOCUMENT_ID,
+            TASK_COMPLETION_VIEW,
+            group_level=group_level,
+            **params,
+        )
+    except HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        ensure_design_documents(nsc, db, FACILITATOR_DESIGN_DOCUMENTS)
+        rows = nsc.get_view(
+            db,
+            DESIGN_DOCUMENT_ID,
+            TASK_COMPLETION_VIEW,
+            group_level=group_level,
+            **params,
+        )
+    return {tuple(row["key"] or ()): row["value"] for row in rows}
+
+
+def get_percentage(completion):
+    total, completed = completion
+    return ((completed / total) * 100) if total else 0
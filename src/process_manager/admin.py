@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Phase, Project, Activity, Task
+from .models import Phase, Project, Activity, Task, SyncRun, SyncRunDatabase
 
 # Register your models here.
 
@@ -7,3 +7,24 @@ admin.site.register(Project)
 admin.site.register(Phase)
 admin.site.register(Activity)
 admin.site.register(Task)
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = [
+        "started_on",
+        "kind",
+        "status",
+        "synced",
+        "failed",
+        "skipped",
+        "requests",
+    ]
+    list_filter = ["kind", "status"]
+
+
+@admin.register(SyncRunDatabase)
+class SyncRunDatabaseAdmin(admin.ModelAdmin):
+    list_display = ["db_name", "run", "status", "duration", "requests", "bytes"]
+    list_filter = ["status"]
+    search_fields = ["db_name"]
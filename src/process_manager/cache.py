@@ -0,0 +1,117 @@
+# Read-through cache of the process_design documents (projects, phases, activities
+# and tasks) keyed by _id and shared by the threads of a process.
+# The least recently used documents are evicted beyond NO_SQL_DESIGN_CACHE_SIZE
+# entries. The whole cache is dropped when the update_seq of process_design changes
+# (checked at most every NO_SQL_DESIGN_CACHE_CHECK_INTERVAL seconds, so that other
+# processes' writes are seen) and a single document is dropped by the save() and
+# delete() of its model or when it is updated through the cache.
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from no_sql_client import NoSQLClient, merge_fields
+
+
+class ProcessDesignCache:
+    def __init__(self, db_name="process_design", max_size=None, check_interval=None):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._docs = OrderedDict()
+        self._update_seq = None
+        self._checked_at = 0
+
+    def get_db(self):
+        return NoSQLClient().get_db(self.db_name)
+
+    def get(self, doc_id):
+        """
+        Return a copy of the document, or None if it doesn't exist
+        """
+        if not doc_id:
+            return None
+        return self.get_many([doc_id]).get(doc_id)
+
+    def get_many(self, doc_ids):
+        """
+        Return a dict _id -> copy of the document for the existing documents,
+        the missing ones being read in a single request
+        """
+        self._check_update_seq()
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id]
+        docs = {}
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id in self._docs:
+                    self._docs.move_to_end(doc_id)
+                    docs[doc_id] = self._docs[doc_id]
+
+        missing = [doc_id for doc_id in doc_ids if doc_id not in docs]
+        if missing:
+            for doc in NoSQLClient().bulk_get(self.get_db(), missing):
+                docs[doc["_id"]] = doc
+                self._put(doc)
+        return {doc_id: copy.deepcopy(doc) for doc_id, doc in docs.items()}
+
+    def update(self, doc_id, fields: dict):
+        """
+        Write the given fields on the document without reading it first (only the
+        fields are applied on the latest revision in case of conflict). Like
+        NoSQLClient.update_doc, the empty values are left out.
+        """
+        doc = self.get(doc_id)
+        if doc is None:
+            return None
+        fields = {k: v for k, v in fields.items() if v}
+        doc.update(fields)
+        nsc = NoSQLClient()
+        doc["_rev"] = nsc.upsert_document(self.get_db(), doc, merge_fields(*fields))
+        self.invalidate(doc_id)
+        return doc
+
+    def invalidate(self, *doc_ids):
+        """
+        Drop the given documents, or every document if none is given
+        """
+        with self._lock:
+            if not doc_ids:
+                self._docs.clear()
+            for doc_id in doc_ids:
+                self._docs.pop(doc_id, None)
+
+    def _put(self, doc):
+        max_size = self.max_size or settings.NO_SQL_DESIGN_CACHE_SIZE
+        with self._lock:
+            self._docs[doc["_id"]] = doc
+            self._docs.move_to_end(doc["_id"])
+            while len(self._docs) > max_size:
+                self._docs.popitem(last=False)
+
+    def _check_update_seq(self):
+        check_interval = (
+            self.check_interval
+            if self.check_interval is not None
+            else settings.NO_SQL_DESIGN_CACHE_CHECK_INTERVAL
+        )
+        if time.monotonic() - self._checked_at < check_interval:
+            return
+        update_seq = self.get_db().metadata().get("update_seq")
+        with self._lock:
+            if update_seq != self._update_seq:
+                self._docs.clear()
+                self._update_seq = update_seq
+            self._checked_at = time.monotonic()
+
+
+process_design_cache = ProcessDesignCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=process_design_cache.reset)
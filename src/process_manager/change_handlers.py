@@ -0,0 +1,151 @@
+# Handlers of the changes of the facilitator databases, run by the follow_changes
+# command (see process_manager.changes).
+from dashboard.task_progress import update_task_progress
+from no_sql_client import NoSQLClient
+from process_manager.changes import register
+from process_manager.enums import ChangeEventEnum
+
+ATTEMPTS = 3
+
+
+def count_completed_tasks(activity, completions):
+    """
+    Apply the completion states of tasks (task _id -> completed) on the activity
+    document. The document keeps the ids of its completed tasks, so that an event
+    delivered twice isn't counted twice. Returns whether it changed.
+    """
+    completed = set(activity.get("completed_task_ids") or [])
+    for task_id, is_completed in completions.items():
+        if is_completed:
+            completed.add(task_id)
+        else:
+            completed.discard(task_id)
+    if completed == set(activity.get("completed_task_ids") or []) and activity.get(
+        "completed_tasks"
+    ) == len(completed):
+        return False
+    activity["completed_task_ids"] = sorted(completed)
+    activity["completed_tasks"] = len(completed)
+    return True
+
+
+def get_completed_task_ids(nsc, db, activity_ids):
+    """
+    Return the ids of the completed task documents of the activities, by activity
+    """
+    if not activity_ids:
+        return {}
+    completed = {activity_id: [] for activity_id in activity_ids}
+    for task in nsc.find_documents(
+        db,
+        {"type": "task", "activity_id": {"$in": list(activity_ids)}, "completed": True},
+        fields=["_id", "activity_id"],
+    ):
+        completed[task["activity_id"]].append(task["_id"])
+    return completed
+
+
+def get_deleted_completions(nsc, db, task_ids):
+    """
+    Return activity _id -> task _id -> False for the deleted tasks counted as
+    completed by an activity
+    """
+    completions = {}
+    for activity in nsc.find_documents(
+        db,
+        {
+            "type": "activity",
+            "completed_task_ids": {"$elemMatch": {"$in": sorted(task_ids)}},
+        },
+        fields=["_id", "completed_task_ids"],
+    ):
+        completions[activity["_id"]] = {
+            task_id: False
+            for task_id in task_ids.intersection(activity["completed_task_ids"])
+        }
+    return completions
+
+
+@register(ChangeEventEnum.TASK_UPDATED, ChangeEventEnum.DOCUMENT_DELETED)
+def update_completed_tasks(events):
+    """
+    Move the completed_tasks of the activity documents of the facilitator
+    databases by the tasks completed, reopened or deleted on the tablets, with one
+    read and one write of the activities per database. The activities that don't
+    keep the ids of their completed tasks yet (written before this handler, or
+    missed by a checkpoint not at 0) get them from their task documents first.
+    """
+    completions = {}  # db_name -> activity _id -> task _id -> completed
+    deleted = {}  # db_name -> task _ids
+    for event in events:
+        if event.type == ChangeEventEnum.DOCUMENT_DELETED:
+            deleted.setdefault(event.db_name, set()).add(event.doc_id)
+            continue
+        activity_id = event.doc.get("activity_id")
+        if activity_id:
+            completions.setdefault(event.db_name, {}).setdefault(activity_id, {})[
+                event.doc_id
+            ] = bool(event.doc.get("completed"))
+
+    nsc = NoSQLClient()
+    for db_name in {**completions, **deleted}:
+        db = nsc.get_db(db_name)
+        by_activity = completions.get(db_name, {})
+        if db_name in deleted:
+            for activity_id, deletions in get_deleted_completions(
+                nsc, db, deleted[db_name]
+            ).items():
+                by_activity.setdefault(activity_id, {}).update(deletions)
+        pending = list(by_activity)
+        for _ in range(ATTEMPTS):
+            activities = nsc.bulk_get(db, pending)
+            backfilled = get_completed_task_ids(
+                nsc,
+                db,
+                [
+                    activity["_id"]
+                    for activity in activities
+                    if "completed_task_ids" not in activity
+                ],
+            )
+            for activity in activities:
+                if activity["_id"] in backfilled:
+                    activity["completed_task_ids"] = backfilled[activity["_id"]]
+            activities = [
+                activity
+                for activity in activities
+                if count_completed_tasks(activity, by_activity[activity["_id"]])
+                or activity["_id"] in backfilled
+            ]
+            results = nsc.bulk_upsert(db, activities) if activities else []
+            pending = [
+                result["id"] for result in results if result.get("error") == "conflict"
+            ]
+            errors = [
+                result
+                for result in results
+                if result.get("error") and result.get("error") != "conflict"
+            ]
+            if errors:
+                raise RuntimeError(f"{db_name}: {errors}")
+            if not pending:
+                break
+        else:
+            # The batch is delivered again, the checkpoint not being moved
+            raise RuntimeError(f"{db_name}: conflicts on the activities {pending}")
+
+
+@register(ChangeEventEnum.TASK_UPDATED, ChangeEventEnum.DOCUMENT_DELETED)
+def update_task_progress_rollup(events):
+    """
+    Keep the TaskProgress rows of the diagnostics in step with the task documents
+    of the facilitator databases
+    """
+    task_docs = {}  # db_name -> task documents
+    deleted = {}  # db_name -> _ids
+    for event in events:
+        if event.type == ChangeEventEnum.DOCUMENT_DELETED:
+            deleted.setdefault(event.db_name, set()).add(event.doc_id)
+        else:
+            task_docs.setdefault(event.db_name, []).append(event.doc)
+    update_task_progress(task_docs, deleted)
@@ -0,0 +1,230 @@
+# Consumer of the _changes feeds of the facilitator databases.
+# The tablets replicate the tasks they complete into the facilitator_* databases.
+# Instead of rescanning these databases, the follow_changes command reads their
+# _changes feed from the sequence saved in ChangesCheckpoint, turns every changed
+# document into typed events (ChangeEventEnum) and hands them in batches to the
+# handlers registered for their type. _db_updates tells which databases changed.
+#
+# A checkpoint only moves once every handler of the batch returned, so a batch can
+# be delivered again after a failure. The events describe the current state of the
+# document (a completed task gives TASK_COMPLETED on each of its updates), so the
+# handlers must be idempotent.
+#
+# Handlers are declared in a `change_handlers` module of any installed app:
+#
+#     @register(ChangeEventEnum.TASK_COMPLETED)
+#     def update_counters(events):
+#         ...
+import time
+from collections import defaultdict
+
+from django.utils.module_loading import autodiscover_modules
+from requests import RequestException
+
+from no_sql_client import NoSQLClient
+from process_manager.enums import ChangeEventEnum
+from process_manager.models import ChangesCheckpoint
+
+DB_UPDATES = "_db_updates"
+
+_handlers = defaultdict(list)
+
+
+def register(*event_types):
+    """
+    Decorator registering the function as the handler of the given event types.
+    It is called with the list of the events of these types of a batch.
+    """
+
+    def decorator(handler):
+        for event_type in event_types:
+            if handler not in _handlers[event_type]:
+                _handlers[event_type].append(handler)
+        return handler
+
+    return decorator
+
+
+def unregister(handler):
+    for handlers in _handlers.values():
+        if handler in handlers:
+            handlers.remove(handler)
+
+
+def get_handlers(event_type):
+    return list(_handlers.get(event_type, []))
+
+
+def autodiscover():
+    autodiscover_modules("change_handlers")
+
+
+class ChangeEvent:
+    def __init__(self, event_type, db_name, doc_id, seq, doc=None):
+        self.type = event_type
+        self.db_name = db_name
+        self.doc_id = doc_id
+        self.seq = seq
+        self.doc = doc or {}
+
+    def __repr__(self):
+        return f"<ChangeEvent {self.type.value} {self.db_name}/{self.doc_id}>"
+
+
+def get_events(db_name, change):
+    """
+    Return the events of a row of the _changes feed read with include_docs
+    """
+    doc_id = change["id"]
+    seq = change["seq"]
+    doc = change.get("doc") or {}
+    if change.get("deleted"):
+        return [
+            ChangeEvent(ChangeEventEnum.DOCUMENT_DELETED, db_name, doc_id, seq, doc)
+        ]
+    if doc_id.startswith("_design/"):
+        return []
+    if doc.get("type") != "task":
+        return [
+            ChangeEvent(ChangeEventEnum.DOCUMENT_UPDATED, db_name, doc_id, seq, doc)
+        ]
+
+    event_types = [ChangeEventEnum.TASK_UPDATED]
+    if doc.get("completed"):
+        event_types.append(ChangeEventEnum.TASK_COMPLETED)
+    if doc.get("form_response"):
+        event_types.append(ChangeEventEnum.FORM_RESPONSE_UPDATED)
+    if doc.get("_attachments") or any(
+        isinstance(attachment, dict) and attachment.get("url")
+        for attachment in doc.get("attachments") or []
+    ):
+        event_types.append(ChangeEventEnum.ATTACHMENT_ADDED)
+    return [
+        ChangeEvent(event_type, db_name, doc_id, seq, doc) for event_type in event_types
+    ]
+
+
+def dispatch(events):
+    """
+    Call each handler once with all the events of the types it is registered for.
+    Returns the number of handlers called.
+    """
+    events_by_handler = {}
+    for event in events:
+        for handler in _handlers.get(event.type, []):
+            events_by_handler.setdefault(handler, []).append(event)
+    for handler, handler_events in events_by_handler.items():
+        handler(handler_events)
+    return len(events_by_handler)
+
+
+class ChangesConsumer:
+    def __init__(
+        self, prefix="facilitator_", batch_size=500, from_now=False, log=print
+    ):
+        self.nsc = NoSQLClient()
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.from_now = from_now
+        self.log = log
+        self.failed = set()
+
+    def get_db_names(self):
+        return [name for name in self.nsc.get_dbs() if name.startswith(self.prefix)]
+
+    def get_checkpoint(self, db_name):
+        checkpoint, _ = ChangesCheckpoint.objects.get_or_create(
+            db_name=db_name, defaults={"since": "now" if self.from_now else "0"}
+        )
+        return checkpoint
+
+    def consume(self, db_name):
+        """
+        Dispatch the pending changes of the database batch by batch, saving the
+        checkpoint after each one. Returns the number of changes read.
+        """
+        checkpoint = self.get_checkpoint(db_name)
+        try:
+            db = self.nsc.get_db(db_name)
+        except KeyError:
+            checkpoint.delete()
+            return 0
+
+        count = 0
+        while True:
+            result = self.nsc.get_changes(db, checkpoint.since, limit=self.batch_size)
+            events = []
+            for change in result["results"]:
+                events.extend(get_events(db_name, change))
+            dispatch(events)
+            checkpoint.since = result["last_seq"]
+            checkpoint.save()
+            count += len(result["results"])
+            if not result.get("pending") or len(result["results"]) < self.batch_size:
+                return count
+
+    def consume_all(self, db_names):
+        """
+        Consume each database, keeping the ones whose handlers failed to be
+        retried on the next call. Returns the number of changes read.
+        """
+        count = 0
+        for db_name in list(dict.fromkeys([*self.failed, *db_names])):
+            try:
+                count += self.consume(db_name)
+                self.failed.discard(db_name)
+            except Exception as exc:
+                self.failed.add(db_name)
+                self.log(f"{db_name}: {exc}")
+        return count
+
+    def get_updated_db_names(self, timeout):
+        """
+        Return the names of the databases updated since the last call, waiting up
+        to `timeout` seconds for one, or None if _db_updates can't be read.
+        The checkpoints of the deleted databases are removed.
+        """
+        checkpoint, _ = ChangesCheckpoint.objects.get_or_create(
+            db_name=DB_UPDATES, defaults={"since": "now"}
+        )
+        try:
+            result = self.nsc.get_db_updates(
+                checkpoint.since, feed="longpoll", timeout=timeout
+            )
+        except RequestException as exc:
+            self.log(f"{DB_UPDATES}: {exc}")
+            return None
+
+        db_names = []
+        for update in result["results"]:
+            db_name = update["db_name"]
+            if not db_name.startswith(self.prefix):
+                continue
+            if update["type"] == "deleted":
+                ChangesCheckpoint.objects.filter(db_name=db_name).delete()
+            elif db_name not in db_names:
+                db_names.append(db_name)
+        checkpoint.since = result["last_seq"]
+        checkpoint.save()
+        return db_names
+
+    def run(self, once=False, timeout=60, interval=10):
+        """
+        Catch up with every facilitator database, then follow _db_updates to only
+        read the databases that changed (or all of them every `interval` seconds
+        when _db_updates isn't available)
+        """
+        if not once:
+            # Start following the databases before catching up, so that nothing
+            # written during the catch up is missed
+            self.get_updated_db_names(timeout=0)
+        count = self.consume_all(self.get_db_names())
+        self.log(f"{count} change(s) read")
+        while not once:
+            db_names = self.get_updated_db_names(timeout)
+            if db_names is None:
+                time.sleep(interval)
+                db_names = self.get_db_names()
+            count = self.consume_all(db_names)
+            if count:
+                self.log(f"{count} change(s) read")
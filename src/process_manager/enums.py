@@ -62,3 +62,16 @@ class FieldTypeEnum(enum.Enum):
 	Section break. Adds a field set
 	"""
     SECTION_BREAK = "Section Break"
+
+
+class ChangeEventEnum(enum.Enum):
+    """
+    Events read from the _changes feed of the facilitator databases
+    """
+
+    TASK_UPDATED = "task_updated"
+    TASK_COMPLETED = "task_completed"
+    FORM_RESPONSE_UPDATED = "form_response_updated"
+    ATTACHMENT_ADDED = "attachment_added"
+    DOCUMENT_UPDATED = "document_updated"
+    DOCUMENT_DELETED = "document_deleted"
@@ -0,0 +1,44 @@
+# Content fingerprints of the process design rows: a digest of the fields copied
+# into the facilitator documents. Each facilitator database keeps the fingerprint
+# of every task it received (see dashboard.sync_runner), so that a sync only plans
+# the tasks whose fingerprint, or the fingerprint of their project, phase or
+# activity, changed since. The fields copied from the process_design document of a
+# task (attachments...), which aren't in SQL, are part of its fingerprint too.
+import hashlib
+import json
+
+FINGERPRINT_FIELDS = {
+    "project": ["name", "description"],
+    "phase": ["name", "description", "order"],
+    "activity": ["name", "description", "order", "total_tasks"],
+    "task": ["name", "description", "order", "form"],
+}
+
+# Fields of the process_design task document copied into the facilitator tasks
+DESIGN_FINGERPRINT_FIELDS = ["attachments", "support_attachments", "form"]
+
+
+def compute_fingerprint(*values):
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def get_fingerprint(obj, _type):
+    return compute_fingerprint(
+        *[getattr(obj, field) for field in FINGERPRINT_FIELDS[_type]]
+    )
+
+
+def get_task_fingerprint(task, design_doc=None):
+    """
+    Return the fingerprint of everything the documents of the task depend on, its
+    process_design document included
+    """
+    return compute_fingerprint(
+        task.project.fingerprint or task.project.get_fingerprint(),
+        task.phase.fingerprint or task.phase.get_fingerprint(),
+        task.activity.fingerprint or task.activity.get_fingerprint(),
+        task.fingerprint or task.get_fingerprint(),
+        [(design_doc or {}).get(field) for field in DESIGN_FINGERPRINT_FIELDS],
+    )
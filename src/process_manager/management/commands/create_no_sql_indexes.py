@@ -0,0 +1,92 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from no_sql_client import NoSQLClient
+from no_sql_indexes import ensure_indexes, find_full_scans, get_indexes_by_database
+from no_sql_views import ensure_design_documents, get_design_documents_by_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or updates the Mango indexes of the design, process_design, administrative_levels"
+        " and facilitator databases, and the map/reduce views of the design and facilitator"
+        " databases (the missing ones are created, the ones whose definition changed are"
+        " updated and the others are left untouched)"
+    )
+    error_messages = {
+        "no_database": "There is no database with the given name.",
+        "unknown_database": "Unknown database, or database without indexes or views:",
+        "full_scan": "Some selectors are still answered by a full database scan.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            action="append",
+            dest="databases",
+            help="Only provision the given database (can be repeated)",
+        )
+        parser.add_argument(
+            "--explain",
+            action="store_true",
+            help="Check with _explain that the known selectors use an index",
+        )
+
+    def handle(self, *args, **kwargs):
+        nsc = NoSQLClient()
+        db_names = kwargs["databases"] or nsc.get_dbs()
+        if kwargs["databases"]:
+            existing = set(nsc.get_dbs())
+            provisioned = {
+                db_name for db_name, *_ in get_indexes_by_database(db_names)
+            } | {db_name for db_name, _ in get_design_documents_by_database(db_names)}
+            unknown = [
+                db_name
+                for db_name in db_names
+                if db_name not in existing or db_name not in provisioned
+            ]
+            if unknown:
+                raise CommandError(
+                    f'{self.error_messages["unknown_database"]} {", ".join(unknown)}'
+                )
+
+        full_scans = 0
+        for db_name, indexes, selectors in get_indexes_by_database(db_names):
+            try:
+                db = nsc.get_db(db_name)
+            except Exception as e:
+                raise CommandError(f'{self.error_messages["no_database"]} {e}')
+
+            statuses = ensure_indexes(nsc, db, indexes)
+            changed = {k: v for k, v in statuses.items() if v != "exists"}
+            self.stdout.write(
+                f"{db_name}: {len(changed)} index(es) created or updated"
+                + (f" {changed}" if changed else "")
+            )
+
+            if kwargs["explain"]:
+                for selector in find_full_scans(nsc, db, selectors):
+                    full_scans += 1
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"{db_name}: full scan for selector {json.dumps(selector)}"
+                        )
+                    )
+
+        for db_name, design_documents in get_design_documents_by_database(db_names):
+            try:
+                db = nsc.get_db(db_name)
+            except Exception as e:
+                raise CommandError(f'{self.error_messages["no_database"]} {e}')
+
+            statuses = ensure_design_documents(nsc, db, design_documents)
+            changed = {k: v for k, v in statuses.items() if v != "exists"}
+            self.stdout.write(
+                f"{db_name}: {len(changed)} design document(s) created or updated"
+                + (f" {changed}" if changed else "")
+            )
+
+        if full_scans:
+            raise CommandError(self.error_messages["full_scan"])
+        self.stdout.write(self.style.SUCCESS("Successfully provisioned the indexes"))
@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from process_manager.models import OutboxMessage
+from process_manager.outbox import drain
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends to CouchDB the process design writes recorded in the outbox by the"
+        " models, in bulk, retrying the failed ones with a backoff"
+    )
+    error_messages = {
+        "batch_size": "--batch-size must be positive.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the messages due and exit",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.NO_SQL_BULK_SIZE,
+            help="Number of messages sent at once",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=settings.OUTBOX_MAX_ATTEMPTS,
+            help="Number of attempts before a message is left aside",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds between two checks of the outbox when it is empty",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["batch_size"] < 1:
+            raise CommandError(self.error_messages["batch_size"])
+
+        try:
+            while True:
+                sent, failed = drain(kwargs["batch_size"], kwargs["max_attempts"])
+                if sent or failed:
+                    self.stdout.write(f"{sent} sent, {failed} failed")
+                if kwargs["once"] and not sent:
+                    break
+                if not sent:
+                    time.sleep(kwargs["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        abandoned = OutboxMessage.objects.filter(
+            sent_on__isnull=True, attempts__gte=kwargs["max_attempts"]
+        ).count()
+        if abandoned:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{abandoned} message(s) reached the maximum number of attempts"
+                )
+            )
+        self.stdout.write(self.style.SUCCESS("Successfully drained the outbox"))
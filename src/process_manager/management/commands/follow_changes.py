@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from process_manager.changes import ChangesConsumer, autodiscover, get_handlers
+from process_manager.enums import ChangeEventEnum
+
+
+class Command(BaseCommand):
+    help = (
+        "Follows the _changes feed of the facilitator databases from the checkpoints"
+        " saved in SQL and dispatches the task events to the registered handlers"
+    )
+    error_messages = {
+        "batch_size": "--batch-size must be positive.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Read the pending changes of every database and exit",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of changes read and dispatched at once",
+        )
+        parser.add_argument(
+            "--from-now",
+            action="store_true",
+            help="Skip the history of the databases without a checkpoint",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="facilitator_",
+            help="Prefix of the databases to follow",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=60,
+            help="Seconds to wait for a database update in each request to _db_updates",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=10,
+            help="Seconds between two reads of every database when _db_updates isn't available",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["batch_size"] < 1:
+            raise CommandError(self.error_messages["batch_size"])
+
+        autodiscover()
+        handled = [
+            event_type.value
+            for event_type in ChangeEventEnum
+            if get_handlers(event_type)
+        ]
+        if handled:
+            self.stdout.write(f'Handled events: {", ".join(handled)}')
+        else:
+            self.stdout.write(
+                self.style.WARNING(
+                    "No handler is registered, the checkpoints only move forward"
+                )
+            )
+
+        consumer = ChangesConsumer(
+            prefix=kwargs["prefix"],
+            batch_size=kwargs["batch_size"],
+            from_now=kwargs["from_now"],
+            log=self.stdout.write,
+        )
+        try:
+            consumer.run(
+                once=kwargs["once"],
+                timeout=kwargs["timeout"],
+                interval=kwargs["interval"],
+            )
+        except KeyboardInterrupt:
+            pass
+        if consumer.failed:
+            raise CommandError(
+                f'Some databases couldn\'t be consumed: {", ".join(sorted(consumer.failed))}'
+            )
+        self.stdout.write(self.style.SUCCESS("Successfully followed the changes"))
@@ -0,0 +1,330 @@
+import random
+import secrets
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import Facilitator
+from dashboard.task_progress import rebuild_task_progress
+from no_sql_client import NoSQLClient
+from process_manager.models import Activity, Phase, Project, Task
+from process_manager.outbox import flush
+
+ADMINISTRATIVE_LEVEL_TYPES = ["Region", "Prefecture", "Commune", "Canton", "Village"]
+REGION_NAMES = ["SAVANES", "KARA", "CENTRALE", "PLATEAUX", "MARITIME"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds a synthetic dataset to benchmark the dashboard and the sync routines: the"
+        " Region > Prefecture > Commune > Canton > Village hierarchy, the process design and"
+        " facilitators with their own database holding the documents of their villages"
+    )
+    error_messages = {
+        "no_database": "Unable to create the database.",
+        "existing_dataset": "A dataset with the given prefix already exists, use another --prefix.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--facilitators", type=int, default=20, help="Number of facilitators"
+        )
+        parser.add_argument(
+            "--villages-per-facilitator",
+            type=int,
+            default=5,
+            help="Number of villages followed by each facilitator",
+        )
+        parser.add_argument(
+            "--children",
+            type=int,
+            default=3,
+            help="Number of children of each administrative level above the cantons",
+        )
+        parser.add_argument(
+            "--phases", type=int, default=3, help="Number of phases of the project"
+        )
+        parser.add_argument(
+            "--activities", type=int, default=3, help="Number of activities per phase"
+        )
+        parser.add_argument(
+            "--tasks", type=int, default=4, help="Number of tasks per activity"
+        )
+        parser.add_argument(
+            "--completed",
+            type=float,
+            default=0.4,
+            help="Share of the tasks marked as completed",
+        )
+        parser.add_argument("--prefix", default="load", help="Prefix of the names")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    def handle(self, *args, **kwargs):
+        self.random = random.Random(kwargs["seed"])
+        self.prefix = kwargs["prefix"]
+        nsc = NoSQLClient()
+
+        if Facilitator.objects.filter(username__startswith=f"{self.prefix}_").exists():
+            raise CommandError(self.error_messages["existing_dataset"])
+
+        for db_name in ("administrative_levels", "process_design", "design"):
+            try:
+                nsc.create_db(db_name)
+            except Exception as e:
+                raise CommandError(f'{self.error_messages["no_database"]} {e}')
+
+        cantons_needed = -(
+            -kwargs["facilitators"] * kwargs["villages_per_facilitator"] // 4
+        )
+        villages = self.create_administrative_levels(
+            nsc, kwargs["children"], cantons_needed
+        )
+        self.stdout.write(f"{len(villages)} villages")
+
+        tasks = self.create_process_design(
+            kwargs["phases"], kwargs["activities"], kwargs["tasks"]
+        )
+        flush()
+        self.stdout.write(f"{len(tasks)} tasks in the process design")
+
+        design_docs = {
+            doc["_id"]: doc
+            for doc in nsc.bulk_get(
+                nsc.get_db("process_design"),
+                [task.couch_id for task in tasks]
+                + list({task.activity.couch_id for task in tasks})
+                + list({task.phase.couch_id for task in tasks})
+                + [tasks[0].project.couch_id],
+            )
+        }
+
+        documents = 0
+        for i in range(kwargs["facilitators"]):
+            start = i * kwargs["villages_per_facilitator"] % len(villages)
+            facilitator_villages = [
+                villages[(start + j) % len(villages)]
+                for j in range(kwargs["villages_per_facilitator"])
+            ]
+            documents += self.create_facilitator(
+                nsc,
+                i,
+                facilitator_villages,
+                tasks,
+                design_docs,
+                kwargs["completed"],
+            )
+        self.stdout.write(
+            f'{kwargs["facilitators"]} facilitators, {documents} facilitator documents'
+        )
+
+        # The diagnostics read the task progress rollup, like rebuild_task_progress
+        summary = rebuild_task_progress(
+            Facilitator.objects.filter(username__startswith=f"{self.prefix}_")
+        )
+        self.stdout.write(f'{summary["rows"]} task progress rows')
+        self.stdout.write(self.style.SUCCESS("Successfully generated the dataset"))
+
+    def create_administrative_levels(self, nsc, children, cantons_needed):
+        """
+        Create the hierarchy in the administrative_levels database, with 4 villages
+        per canton and numeric administrative ids following the existing ones.
+        Returns the village documents.
+        """
+        db = nsc.get_db("administrative_levels")
+        existing_ids = [
+            int(doc["administrative_id"])
+            for doc in nsc.find_documents(
+                db, {"type": "administrative_level"}, fields=["administrative_id"]
+            )
+            if str(doc.get("administrative_id", "")).isdigit()
+        ]
+        next_id = max(existing_ids, default=0) + 1
+
+        parents = [None]
+        for _type in ADMINISTRATIVE_LEVEL_TYPES:
+            if _type == "Village":
+                count = 4
+            elif _type == "Canton":
+                count = max(-(-cantons_needed // len(parents)), 1)
+            else:
+                count = children
+            docs = []
+            for parent in parents:
+                for i in range(count):
+                    if _type == "Region":
+                        # The diagnostics aggregate the tasks by these region names
+                        name = REGION_NAMES[i % len(REGION_NAMES)]
+                        if i >= len(REGION_NAMES):
+                            name = f"{name} {i}"
+                    else:
+                        name = f"{_type} {parent['administrative_id']}.{i + 1}"
+                    docs.append(
+                        {
+                            "_id": uuid.uuid4().hex,
+                            "administrative_id": str(next_id),
+                            "name": name,
+                            "administrative_level": _type,
+                            "type": "administrative_level",
+                            "parent_id": parent["administrative_id"] if parent else "",
+                            "latitude": round(self.random.uniform(6, 11), 6),
+                            "longitude": round(self.random.uniform(0, 2), 6),
+                        }
+                    )
+                    next_id += 1
+            results = nsc.bulk_upsert(db, docs)
+            for error in nsc.bulk_errors(results):
+                self.stdout.write(self.style.WARNING(str(error)))
+            parents = docs
+        return parents
+
+    def create_process_design(self, phases, activities, tasks):
+        project = Project(
+            name=f"{self.prefix} project", description="Synthetic project"
+        )
+        project.save()
+        created = []
+        for p in range(phases):
+            phase = Phase(
+                name=f"{self.prefix} phase {p + 1}",
+                description="Synthetic phase",
+                project=project,
+                order=p + 1,
+            )
+            phase.save()
+            for a in range(activities):
+                activity = Activity(
+                    name=f"{self.prefix} activity {p + 1}.{a + 1}",
+                    description="Synthetic activity",
+                    project=project,
+                    phase=phase,
+                    total_tasks=tasks,
+                    order=a + 1,
+                )
+                activity.save()
+                for t in range(tasks):
+                    task = Task(
+                        name=f"{self.prefix} task {p + 1}.{a + 1}.{t + 1}",
+                        description="Synthetic task",
+                        project=project,
+                        phase=phase,
+                        activity=activity,
+                        order=t + 1,
+                        form=[
+                            {
+                                "page": 1,
+                                "options": {
+                                    "fields": {
+                                        "participants": {"label": "Participants"},
+                                        "comment": {"label": "Comment"},
+                                    }
+                                },
+                            }
+                        ],
+                    )
+                    task.save()
+                    created.append(task)
+        return created
+
+    def get_code(self):
+        if not hasattr(self, "codes"):
+            self.codes = set(Facilitator.objects.values_list("code", flat=True))
+        code = str(self.random.randint(100000, 999999))
+        while code in self.codes:
+            code = str(self.random.randint(100000, 999999))
+        self.codes.add(code)
+        return code
+
+    def create_facilitator(self, nsc, index, villages, tasks, design_docs, completed):
+        """
+        Create the facilitator like Facilitator.save() does, without waiting a second
+        per facilitator for a unique no_sql_user, and write all the documents of its
+        villages in bulk. Returns the number of documents written.
+        """
+        no_sql_user = f"{self.prefix}{secrets.token_hex(4)}{index}"
+        facilitator = Facilitator(
+            username=f"{self.prefix}_{index}",
+            no_sql_user=no_sql_user,
+            no_sql_pass=secrets.token_urlsafe(13),
+            no_sql_db_name=f"facilitator_{no_sql_user}",
+            code=self.get_code(),
+            password=make_password(f"ChangeItNow{index}", salt=None, hasher="default"),
+            active=True,
+        )
+        nsc.create_user(facilitator.no_sql_user, facilitator.no_sql_pass)
+        db = nsc.create_db(facilitator.no_sql_db_name)
+        nsc.replicate_design_db(db)
+        nsc.add_member_to_database(db, facilitator.no_sql_user)
+        facilitator.simple_save()
+
+        administrative_levels = [
+            {"id": village["administrative_id"], "name": village["name"]}
+            for village in villages
+        ]
+        # The locality filters read the facilitator villages
+        facilitator.set_villages(administrative_levels)
+        docs = [
+            {
+                "type": "facilitator",
+                "name": f"{self.prefix} facilitator {index}",
+                "email": f"{self.prefix}{index}@example.com",
+                "phone": f"90{index:06d}",
+                "sex": self.random.choice(["M.", "Mme"]),
+                "administrative_levels": administrative_levels,
+                "sql_id": facilitator.id,
+                "develop_mode": False,
+                "training_mode": False,
+            }
+        ]
+        project = design_docs[tasks[0].project.couch_id]
+        docs.append({k: v for k, v in project.items() if k != "_rev"})
+        for village in villages:
+            facilitator_ids = {}
+            for task in tasks:
+                for model, parent_fields in (
+                    (task.phase, {}),
+                    (task.activity, {"phase_id": task.phase.couch_id}),
+                ):
+                    if model.couch_id in facilitator_ids:
+                        continue
+                    doc = {
+                        k: v
+                        for k, v in design_docs[model.couch_id].items()
+                        if k not in ("_id", "_rev")
+                    }
+                    doc["_id"] = uuid.uuid4().hex
+                    doc["administrative_level_id"] = village["administrative_id"]
+                    doc["project_id"] = project["_id"]
+                    for field, couch_id in parent_fields.items():
+                        doc[field] = facilitator_ids[couch_id]
+                    facilitator_ids[model.couch_id] = doc["_id"]
+                    docs.append(doc)
+
+                doc = {
+                    k: v
+                    for k, v in design_docs[task.couch_id].items()
+                    if k not in ("_id", "_rev")
+                }
+                doc["administrative_level_id"] = village["administrative_id"]
+                doc["administrative_level_name"] = village["name"]
+                doc["project_id"] = project["_id"]
+                doc["phase_id"] = facilitator_ids[task.phase.couch_id]
+                doc["activity_id"] = facilitator_ids[task.activity.couch_id]
+                date = datetime.now() - timedelta(days=self.random.randint(0, 365))
+                doc["last_updated"] = date.strftime("%Y-%m-%d %H:%M:%S")
+                if self.random.random() < completed:
+                    doc["completed"] = True
+                    doc["completed_date"] = date.strftime("%d-%m-%Y")
+                    doc["form_response"] = [
+                        {
+                            "participants": self.random.randint(5, 200),
+                            "comment": "Lorem ipsum dolor sit amet " * 4,
+                        }
+                    ]
+                docs.append(doc)
+
+        results = nsc.bulk_upsert(db, docs)
+        for error in nsc.bulk_errors(results):
+            self.stdout.write(self.style.WARNING(str(error)))
+        return len(docs)
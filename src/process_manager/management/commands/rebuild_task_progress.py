@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import Facilitator
+from dashboard.task_progress import rebuild_task_progress
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the task progress rollup of the diagnostics from the tasks of the"
+        " facilitator databases. The follow_changes command keeps it current"
+        " afterwards."
+    )
+    error_messages = {
+        "concurrency": "--concurrency must be positive.",
+        "failed": "Some facilitator databases couldn't be read, run the command again to retry them.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.NO_SQL_CONCURRENCY,
+            help="Number of facilitator databases read at the same time",
+        )
+        parser.add_argument(
+            "--facilitator",
+            dest="no_sql_db",
+            help="Only rebuild the rows of the facilitator with the given database name",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["concurrency"] < 1:
+            raise CommandError(self.error_messages["concurrency"])
+
+        facilitators = Facilitator.objects.all()
+        if kwargs["no_sql_db"]:
+            facilitators = facilitators.filter(no_sql_db_name=kwargs["no_sql_db"])
+        summary = rebuild_task_progress(facilitators, kwargs["concurrency"])
+        self.stdout.write(
+            f'{summary["databases"]} rebuilt, {summary["failed"]} failed facilitator'
+            f' database(s); {summary["rows"]} task progress row(s)'
+        )
+        if summary["failed"]:
+            raise CommandError(self.error_messages["failed"])
+        self.stdout.write(self.style.SUCCESS("Successfully rebuilt the task progress"))
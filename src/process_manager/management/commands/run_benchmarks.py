@@ -0,0 +1,250 @@
+import io
+import json
+import os
+import statistics
+import time
+from contextlib import redirect_stdout
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from authentication.models import Facilitator, FacilitatorVillage
+from dashboard.diagnostics.views import GetTasksDiagnosticsView
+from dashboard.facilitators.views import (
+    FacilitatorDetailView,
+    FacilitatorListTableView,
+    FacilitatorTaskListView,
+)
+from dashboard.utils import sync_tasks
+from no_sql_client import NoSQLClient
+from no_sql_instrumentation import collect_no_sql_requests
+from process_manager.models import Task, TaskProgress
+
+
+class Command(BaseCommand):
+    help = (
+        "Times sync_tasks and the dashboard views reading the facilitator databases, counting"
+        " the CouchDB requests and SQL queries of each, and compares them with a baseline"
+        " (run generate_load_dataset first)"
+    )
+    error_messages = {
+        "no_dataset": "There is no deployed facilitator with villages and tasks to benchmark.",
+        "no_rollups": "The task progress or the facilitator villages are empty, run rebuild_task_progress and rebuild_facilitator_villages first.",
+        "no_baseline": "--save-baseline needs a --baseline file.",
+        "missing_baseline": "The --baseline file doesn't exist, run with --save-baseline to write it.",
+        "unknown_benchmark": "Unknown benchmark.",
+        "regression": "Some benchmarks regressed compared to the baseline.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of timed runs of each benchmark, after a warm-up run",
+        )
+        parser.add_argument(
+            "--benchmark",
+            action="append",
+            dest="benchmarks",
+            help="Only run the given benchmark (can be repeated)",
+        )
+        parser.add_argument(
+            "--baseline", help="JSON file of the baseline to compare the results with"
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results to the --baseline file instead of comparing",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative increase of the wall time over the baseline",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["save_baseline"] and not kwargs["baseline"]:
+            raise CommandError(self.error_messages["no_baseline"])
+        if (
+            kwargs["baseline"]
+            and not kwargs["save_baseline"]
+            and not os.path.exists(kwargs["baseline"])
+        ):
+            raise CommandError(
+                f'{self.error_messages["missing_baseline"]} {kwargs["baseline"]}'
+            )
+
+        benchmarks = self.get_benchmarks()
+        names = kwargs["benchmarks"] or list(benchmarks)
+        for name in names:
+            if name not in benchmarks:
+                raise CommandError(
+                    f'{self.error_messages["unknown_benchmark"]} {name} '
+                    f'(one of {", ".join(benchmarks)})'
+                )
+
+        results = {}
+        for name in names:
+            results[name] = self.run(benchmarks[name], kwargs["repeat"])
+            self.stdout.write(
+                f"{name}: {results[name]['wall_ms']} ms, "
+                f"{results[name]['couchdb_requests']} CouchDB requests, "
+                f"{results[name]['sql_queries']} SQL queries"
+            )
+
+        if kwargs["save_baseline"]:
+            with open(kwargs["baseline"], "w") as f:
+                json.dump({"benchmarks": results}, f, indent=2, sort_keys=True)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully saved the baseline {kwargs["baseline"]}'
+                )
+            )
+            return
+
+        if kwargs["baseline"]:
+            with open(kwargs["baseline"]) as f:
+                baseline = json.load(f)["benchmarks"]
+            regressions = self.compare(results, baseline, kwargs["tolerance"])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(self.error_messages["regression"])
+        self.stdout.write(self.style.SUCCESS("Successfully ran the benchmarks"))
+
+    @staticmethod
+    def run(benchmark, repeat):
+        """
+        Run the benchmark once to warm the caches up, then `repeat` times. Returns
+        the median wall time and the highest request and query counts.
+        """
+        runs = []
+        for i in range(repeat + 1):
+            with redirect_stdout(io.StringIO()), collect_no_sql_requests() as requests:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    benchmark()
+                    wall_ms = (time.perf_counter() - start) * 1000
+            if i:
+                runs.append((wall_ms, requests.count, len(queries)))
+        return {
+            "wall_ms": round(statistics.median(run[0] for run in runs), 1),
+            "couchdb_requests": max(run[1] for run in runs),
+            "sql_queries": max(run[2] for run in runs),
+        }
+
+    @staticmethod
+    def compare(results, baseline, tolerance):
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            base = baseline[name]
+            if result["wall_ms"] > base["wall_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {result['wall_ms']} ms instead of {base['wall_ms']} ms"
+                )
+            for metric in ("couchdb_requests", "sql_queries"):
+                if result[metric] > base[metric]:
+                    regressions.append(
+                        f"{name}: {result[metric]} {metric} instead of {base[metric]}"
+                    )
+        return regressions
+
+    def get_benchmarks(self):
+        facilitator = (
+            Facilitator.objects.filter(develop_mode=False, training_mode=False)
+            .order_by("id")
+            .first()
+        )
+        task = Task.objects.order_by("id").first()
+        if not facilitator or not task:
+            raise CommandError(self.error_messages["no_dataset"])
+        # The diagnostics and the locality filters of the facilitator list read
+        # these tables, not the facilitator databases
+        if not TaskProgress.objects.exists() or not FacilitatorVillage.objects.exists():
+            raise CommandError(self.error_messages["no_rollups"])
+
+        nsc = NoSQLClient()
+        facilitator_db = nsc.get_db(facilitator.no_sql_db_name)
+        facilitator_docs = nsc.find_documents(facilitator_db, {"type": "facilitator"})
+        administrative_levels = {
+            doc["administrative_id"]: doc
+            for doc in nsc.find_documents(
+                nsc.get_db("administrative_levels"), {"type": "administrative_level"}
+            )
+        }
+        try:
+            village = administrative_levels[
+                str(facilitator_docs[0]["administrative_levels"][0]["id"])
+            ]
+        except (IndexError, KeyError):
+            raise CommandError(self.error_messages["no_dataset"])
+        localities = {"village": village}
+        for _type in ("canton", "commune", "prefecture", "region"):
+            parent = administrative_levels.get(
+                list(localities.values())[-1].get("parent_id")
+            )
+            if parent is None:
+                break
+            localities[_type] = parent
+
+        factory = RequestFactory()
+        user = get_user_model()(username="benchmark", is_superuser=True, is_staff=True)
+
+        def get(view, params=None, ajax=False, **kwargs):
+            def benchmark():
+                headers = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest"} if ajax else {}
+                request = factory.get("/", params or {}, **headers)
+                request.user = user
+                response = view.as_view()(request, **kwargs)
+                if hasattr(response, "render"):
+                    response.render()
+                if response.status_code != 200:
+                    raise CommandError(
+                        f"{view.__name__} answered {response.status_code}"
+                    )
+
+            return benchmark
+
+        benchmarks = {"sync_tasks": sync_tasks}
+        for _type, obj in (
+            ("phase", task.phase),
+            ("activity", task.activity),
+            ("task", task),
+            *localities.items(),
+        ):
+            benchmarks[f"diagnostics_{_type}"] = get(
+                GetTasksDiagnosticsView,
+                {
+                    "type": _type,
+                    "sql_id": obj["administrative_id"]
+                    if _type in localities
+                    else obj.id,
+                },
+                ajax=True,
+            )
+        for _type in ("region", "village"):
+            if _type in localities:
+                benchmarks[f"facilitator_list_{_type}"] = get(
+                    FacilitatorListTableView,
+                    {
+                        f"id_{_type}": localities[_type]["administrative_id"],
+                        "type_field": _type,
+                    },
+                )
+        benchmarks["facilitator_task_list"] = get(
+            FacilitatorTaskListView,
+            {"index": 0, "offset": 10},
+            ajax=True,
+            id=facilitator.no_sql_db_name,
+        )
+        benchmarks["facilitator_detail"] = get(
+            FacilitatorDetailView, id=facilitator.no_sql_db_name
+        )
+        return benchmarks
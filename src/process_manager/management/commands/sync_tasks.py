@@ -0,0 +1,146 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.sync_runner import run_dry_run, run_sync
+from dashboard.utils import get_facilitators
+from process_manager.models import Task
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the process design tasks into the facilitator databases, several"
+        " databases at a time. The databases already synced with the current design"
+        " are skipped, so the command can be run again after a failure. With"
+        " --dry-run nothing is written and a JSON report of the changes a sync would"
+        " make in each database is output instead."
+    )
+    error_messages = {
+        "concurrency": "--concurrency must be positive.",
+        "failed": "The sync failed for some facilitators, run the command again to retry them.",
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.NO_SQL_CONCURRENCY,
+            help="Number of facilitator databases synced at the same time",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Also sync the databases already synced with the current design",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Plan every task, not only the ones changed since the last sync of each database",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only read the databases and output the JSON report of the changes",
+        )
+        parser.add_argument(
+            "--output",
+            help="File the --dry-run report is written to, instead of the output",
+        )
+        parser.add_argument(
+            "--develop-mode",
+            action="store_true",
+            help="Sync the facilitators in develop mode",
+        )
+        parser.add_argument(
+            "--training-mode",
+            action="store_true",
+            help="Sync the facilitators in training mode",
+        )
+        parser.add_argument(
+            "--facilitator",
+            dest="no_sql_db",
+            help="Only sync the facilitator with the given database name",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["concurrency"] < 1:
+            raise CommandError(self.error_messages["concurrency"])
+
+        tasks = Task.objects.select_related("project", "phase", "activity").order_by(
+            "phase__order", "activity__order", "order"
+        )
+        facilitators = get_facilitators(
+            kwargs["develop_mode"],
+            kwargs["training_mode"],
+            kwargs["no_sql_db"] or False,
+        )
+        total = facilitators.count()
+        done = []
+
+        if kwargs["dry_run"]:
+            return self.dry_run(tasks, facilitators, total, **kwargs)
+
+        def progress(result):
+            done.append(result)
+            message = (
+                f'[{len(done)}/{total}] {result["facilitator"].no_sql_db_name}: '
+                f'{result["created"]} created, {result["updated"]} updated, '
+                f'{result["unchanged"]} unchanged ({result["duration"]} s)'
+            )
+            if result["error"]:
+                self.stdout.write(self.style.WARNING(f'{message} {result["error"]}'))
+            else:
+                self.stdout.write(message)
+
+        summary = run_sync(
+            "process_design",
+            tasks,
+            facilitators,
+            concurrency=kwargs["concurrency"],
+            force=kwargs["force"],
+            incremental=not kwargs["full"],
+            progress=progress,
+        )
+        self.stdout.write(
+            f'{summary["synced"]} synced, {summary["skipped"]} skipped, '
+            f'{summary["failed"]} failed facilitator database(s); '
+            f'{summary["created"]} created, {summary["updated"]} updated, '
+            f'{summary["unchanged"]} unchanged document(s)'
+        )
+        if summary["failed"]:
+            raise CommandError(self.error_messages["failed"])
+        self.stdout.write(self.style.SUCCESS("Successfully synced the tasks"))
+
+    def dry_run(self, tasks, facilitators, total, **kwargs):
+        done = []
+
+        def progress(db_name, report):
+            # The report may be written on the output, so the progress goes to stderr
+            done.append(db_name)
+            if "error" in report:
+                message = f'[{len(done)}/{total}] {db_name}: {report["error"]}'
+                self.stderr.write(self.style.WARNING(message))
+            else:
+                self.stderr.write(
+                    f"[{len(done)}/{total}] {db_name}: "
+                    f'{report["created"]} to create, {report["updated"]} to update, '
+                    f'{len(report["orphaned"])} orphaned'
+                )
+
+        report = run_dry_run(
+            "process_design",
+            tasks,
+            facilitators,
+            concurrency=kwargs["concurrency"],
+            progress=progress,
+        )
+        content = json.dumps(report, indent=2, default=str)
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as f:
+                f.write(content)
+            self.stderr.write(
+                self.style.SUCCESS(f'Report written to {kwargs["output"]}')
+            )
+        else:
+            self.stdout.write(content)
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0008_formtype_formfield"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangesCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("db_name", models.CharField(max_length=255, unique=True)),
+                ("since", models.TextField(default="0")),
+                ("updated_on", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0005_alter_facilitator_code"),
+        ("process_manager", "0009_changescheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacilitatorSyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("design_version", models.CharField(blank=True, max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=20,
+                    ),
+                ),
+                ("created", models.IntegerField(default=0)),
+                ("updated", models.IntegerField(default=0)),
+                ("unchanged", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("started_on", models.DateTimeField(blank=True, null=True)),
+                ("finished_on", models.DateTimeField(blank=True, null=True)),
+                (
+                    "facilitator",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sync_state",
+                        to="authentication.facilitator",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:48
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+# Frozen copy of process_manager.fingerprints.get_fingerprint, so that this migration
+# keeps computing the fingerprints it was written with
+FINGERPRINT_FIELDS = {
+    "project": ["name", "description"],
+    "phase": ["name", "description", "order"],
+    "activity": ["name", "description", "order", "total_tasks"],
+    "task": ["name", "description", "order", "form"],
+}
+
+
+def get_fingerprint(obj, _type):
+    values = [getattr(obj, field) for field in FINGERPRINT_FIELDS[_type]]
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def set_fingerprints(apps, schema_editor):
+    for _type in ("project", "phase", "activity", "task"):
+        model = apps.get_model("process_manager", _type)
+        for obj in model.objects.all():
+            model.objects.filter(id=obj.id).update(
+                fingerprint=get_fingerprint(obj, _type)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0010_facilitatorsyncstate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="phase",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.RunPython(set_fingerprints, migrations.RunPython.noop),
+    ]
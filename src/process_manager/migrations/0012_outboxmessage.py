@@ -0,0 +1,54 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0011_fingerprints"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=255, unique=True)),
+                ("db_name", models.CharField(max_length=255)),
+                ("doc_id", models.CharField(max_length=255)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("create", "Create"), ("update", "Update")],
+                        max_length=20,
+                    ),
+                ),
+                ("data", models.JSONField()),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_on", models.DateTimeField(auto_now_add=True)),
+                (
+                    "next_attempt_on",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("sent_on", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="outboxmessage",
+            index=models.Index(
+                fields=["sent_on", "next_attempt_on"],
+                name="process_man_sent_on_7525a0_idx",
+            ),
+        ),
+    ]
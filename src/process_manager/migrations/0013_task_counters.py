@@ -0,0 +1,44 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:56
+
+import hashlib
+import json
+
+from django.db import migrations
+from django.db.models import Count
+
+# Frozen copy of process_manager.fingerprints.get_fingerprint, so that this migration
+# keeps computing the fingerprints it was written with
+FINGERPRINT_FIELDS = {
+    "activity": ["name", "description", "order", "total_tasks"],
+}
+
+
+def get_fingerprint(obj, _type):
+    values = [getattr(obj, field) for field in FINGERPRINT_FIELDS[_type]]
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def count_tasks(apps, schema_editor):
+    """
+    Start the counters, moved by delta from now on, from the actual counts
+    """
+    Activity = apps.get_model("process_manager", "Activity")
+    for activity in Activity.objects.annotate(count=Count("task")):
+        activity.total_tasks = activity.count
+        Activity.objects.filter(id=activity.id).update(
+            total_tasks=activity.count,
+            fingerprint=get_fingerprint(activity, "activity"),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0012_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.RunPython(count_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,135 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0005_alter_facilitator_code"),
+        ("process_manager", "0013_task_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("sync", "Sync"), ("propagation", "Propagation")],
+                        default="sync",
+                        max_length=20,
+                    ),
+                ),
+                ("design_version", models.CharField(blank=True, max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=20,
+                    ),
+                ),
+                ("synced", models.IntegerField(default=0)),
+                ("skipped", models.IntegerField(default=0)),
+                ("failed", models.IntegerField(default=0)),
+                ("read", models.IntegerField(default=0)),
+                ("created", models.IntegerField(default=0)),
+                ("updated", models.IntegerField(default=0)),
+                ("unchanged", models.IntegerField(default=0)),
+                ("deleted", models.IntegerField(default=0)),
+                ("requests", models.IntegerField(default=0)),
+                ("bytes", models.BigIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("started_on", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_on", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-started_on"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SyncRunDatabase",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("db_name", models.CharField(max_length=255)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="done",
+                        max_length=20,
+                    ),
+                ),
+                ("read", models.IntegerField(default=0)),
+                ("created", models.IntegerField(default=0)),
+                ("updated", models.IntegerField(default=0)),
+                ("unchanged", models.IntegerField(default=0)),
+                ("deleted", models.IntegerField(default=0)),
+                ("requests", models.IntegerField(default=0)),
+                ("bytes", models.BigIntegerField(default=0)),
+                ("duration", models.FloatField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("started_on", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_on", models.DateTimeField(blank=True, null=True)),
+                (
+                    "facilitator",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="sync_runs",
+                        to="authentication.facilitator",
+                    ),
+                ),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="databases",
+                        to="process_manager.syncrun",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="syncrundatabase",
+            index=models.Index(
+                fields=["db_name", "started_on"], name="process_man_db_name_29b5d4_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="syncrundatabase",
+            index=models.Index(
+                fields=["started_on", "duration"], name="process_man_started_239c5a_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0005_alter_facilitator_code"),
+        ("process_manager", "0014_sync_run_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskProgress",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("village_id", models.CharField(max_length=64)),
+                ("canton_id", models.CharField(blank=True, max_length=64)),
+                ("commune_id", models.CharField(blank=True, max_length=64)),
+                ("prefecture_id", models.CharField(blank=True, max_length=64)),
+                ("region_id", models.CharField(blank=True, max_length=64)),
+                ("doc_id", models.CharField(max_length=255)),
+                ("total", models.IntegerField(default=1)),
+                ("completed", models.IntegerField(default=0)),
+                ("updated_on", models.DateTimeField(auto_now=True)),
+                (
+                    "activity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="process_manager.activity",
+                    ),
+                ),
+                (
+                    "facilitator",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="task_progress",
+                        to="authentication.facilitator",
+                    ),
+                ),
+                (
+                    "phase",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="process_manager.phase",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="process_manager.project",
+                    ),
+                ),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="process_manager.task",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["facilitator", "doc_id"], name="process_man_facilit_55435b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["region_id"], name="process_man_region__0f9188_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["prefecture_id"], name="process_man_prefect_a84fe3_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["commune_id"], name="process_man_commune_4fed1a_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["canton_id"], name="process_man_canton__32a8f6_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskprogress",
+            index=models.Index(
+                fields=["village_id"], name="process_man_village_d774e9_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="taskprogress",
+            constraint=models.UniqueConstraint(
+                fields=("facilitator", "village_id", "task"),
+                name="unique_task_progress",
+            ),
+        ),
+    ]
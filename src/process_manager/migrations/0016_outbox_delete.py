@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0015_task_progress"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxmessage",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("create", "Create"),
+                    ("update", "Update"),
+                    ("delete", "Delete"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
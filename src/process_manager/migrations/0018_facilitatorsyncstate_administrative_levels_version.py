@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0016_outbox_delete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="facilitatorsyncstate",
+            name="administrative_levels_version",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("process_manager", "0018_facilitatorsyncstate_administrative_levels_version"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxmessage",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("create", "Create"),
+                    ("update", "Update"),
+                    ("delete", "Delete"),
+                    ("propagate", "Propagate"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
-from no_sql_client import NoSQLClient
+import uuid
+
+from django.db import models, transaction
+from django.utils import timezone
+from process_manager.cache import process_design_cache
 from django.utils.translation import gettext_lazy as _
 from process_manager.enums import FieldTypeEnum
+from process_manager.fingerprints import get_fingerprint
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.auth import get_user_model
@@ -9,6 +13,45 @@ from django.forms.models import model_to_dict
 from rest_framework import serializers
 
 
+# Fields of the process_design documents owned by the SQL rows, written again on
+# every save. The others (attachments, counters...) are left to their own writers.
+UPDATED_FIELDS = [
+    "name",
+    "description",
+    "order",
+    "project_id",
+    "phase_id",
+    "phase_name",
+    "activity_id",
+    "activity_name",
+    "sql_id",
+]
+
+
+def enqueue_save(db_name, doc_id, data, created):
+    """
+    Record the creation of the document of a saved row, or the update of its
+    UPDATED_FIELDS, in the transaction of the row, and drop the cached document
+    """
+    if created:
+        OutboxMessage.enqueue_create(db_name, {"_id": doc_id, **data})
+    else:
+        OutboxMessage.enqueue_update(
+            db_name, doc_id, {k: v for k, v in data.items() if k in UPDATED_FIELDS}
+        )
+    process_design_cache.invalidate(doc_id)
+
+
+def enqueue_delete(db_name, *doc_ids):
+    """
+    Record the deletion of the documents of deleted rows, in their transaction
+    """
+    for doc_id in doc_ids:
+        if doc_id:
+            OutboxMessage.enqueue_delete(db_name, doc_id)
+            process_design_cache.invalidate(doc_id)
+
+
 # Create your models here.
 # The project object on couch looks like this
 # {
@@ -22,11 +65,22 @@ class Project(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     couch_id = models.CharField(max_length=255, blank=True)
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return self.name
 
+    def get_fingerprint(self):
+        return get_fingerprint(self, "project")
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        # The document is created in process_design by the outbox drainer, with the
+        # _id given here
+        created = not self.couch_id
+        if created:
+            self.couch_id = uuid.uuid4().hex
+        self.fingerprint = self.get_fingerprint()
         super().save(*args, **kwargs)
         data = {
             "name": self.name,
@@ -34,18 +88,23 @@ class Project(models.Model):
             "description": self.description,
             "sql_id": self.id,
         }
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": self.couch_id})[0]
-        if not new_document:
-            new_document = nsc.create_document(nsc_database, data)
-            self.couch_id = new_document["_id"]
-            self.save()
+        enqueue_save("process_design", self.couch_id, data, created)
         return self
 
     def simple_save(self, *args, **kwargs):
         return super().save(*args, **kwargs)
 
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        enqueue_delete(
+            "process_design",
+            self.couch_id,
+            *Phase.objects.filter(project=self).values_list("couch_id", flat=True),
+            *Activity.objects.filter(project=self).values_list("couch_id", flat=True),
+            *Task.objects.filter(project=self).values_list("couch_id", flat=True),
+        )
+        return super().delete(*args, **kwargs)
+
 
 # The Phase object on couch looks like this
 # {
@@ -71,11 +130,22 @@ class Phase(models.Model):
     project = models.ForeignKey("Project", on_delete=models.CASCADE)
     couch_id = models.CharField(max_length=255, blank=True)
     order = models.IntegerField()
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return self.name
 
+    def get_fingerprint(self):
+        return get_fingerprint(self, "phase")
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        # The document is created in process_design by the outbox drainer, with the
+        # _id given here
+        created = not self.couch_id
+        if created:
+            self.couch_id = uuid.uuid4().hex
+        self.fingerprint = self.get_fingerprint()
         super().save(*args, **kwargs)
         data = {
             "name": self.name,
@@ -86,18 +156,22 @@ class Phase(models.Model):
             "project_id": self.project.couch_id,
             "sql_id": self.id,
         }
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": self.couch_id})[0]
-        if not new_document:
-            new_document = nsc.create_document(nsc_database, data)
-            self.couch_id = new_document["_id"]
-            self.save()
+        enqueue_save("process_design", self.couch_id, data, created)
         return self
 
     def simple_save(self, *args, **kwargs):
         return super().save(*args, **kwargs)
 
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        enqueue_delete(
+            "process_design",
+            self.couch_id,
+            *Activity.objects.filter(phase=self).values_list("couch_id", flat=True),
+            *Task.objects.filter(phase=self).values_list("couch_id", flat=True),
+        )
+        return super().delete(*args, **kwargs)
+
 
 # The activity object on couch looks like this
 # {
@@ -128,11 +202,32 @@ class Activity(models.Model):
     total_tasks = models.IntegerField()
     order = models.IntegerField()
     couch_id = models.CharField(max_length=255, blank=True)
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return self.phase.name + "-" + self.name
 
+    def get_fingerprint(self):
+        return get_fingerprint(self, "activity")
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        # The document is created in process_design by the outbox drainer, with the
+        # _id given here
+        created = not self.couch_id
+        if created:
+            self.couch_id = uuid.uuid4().hex
+        # The counter is moved by the tasks added and deleted (see add_tasks), the
+        # row is locked so that its value can't be overwritten by a stale one
+        if self._state.adding:
+            self.total_tasks = 0
+        else:
+            self.total_tasks = (
+                Activity.objects.select_for_update()
+                .values_list("total_tasks", flat=True)
+                .get(id=self.id)
+            )
+        self.fingerprint = self.get_fingerprint()
         super().save(*args, **kwargs)
         data = {
             "name": self.name,
@@ -146,15 +241,39 @@ class Activity(models.Model):
             "completed_tasks": 0,
             "sql_id": self.id,
         }
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": self.couch_id})[0]
-        if not new_document:
-            new_document = nsc.create_document(nsc_database, data)
-            self.couch_id = new_document["_id"]
-            self.save()
+        enqueue_save("process_design", self.couch_id, data, created)
         return self
 
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        enqueue_delete(
+            "process_design",
+            self.couch_id,
+            *Task.objects.filter(activity=self).values_list("couch_id", flat=True),
+        )
+        return super().delete(*args, **kwargs)
+
+    @transaction.atomic
+    def add_tasks(self, delta):
+        """
+        Move the task counter of the activity by delta, and record the new total of
+        the activity document in the outbox (the updates of an activity are written
+        at once by the drainer). Returns the activity.
+        """
+        activity = Activity.objects.select_for_update().get(id=self.id)
+        activity.total_tasks += delta
+        activity.fingerprint = activity.get_fingerprint()
+        Activity.objects.filter(id=activity.id).update(
+            total_tasks=activity.total_tasks, fingerprint=activity.fingerprint
+        )
+        OutboxMessage.enqueue_update(
+            "process_design",
+            activity.couch_id,
+            {"total_tasks": activity.total_tasks},
+        )
+        self.total_tasks = activity.total_tasks
+        return activity
+
 
 # The task object on couch looks like this
 # {
@@ -185,11 +304,23 @@ class Task(models.Model):
     order = models.IntegerField()
     form = models.JSONField(null=True, blank=True)
     couch_id = models.CharField(max_length=255, blank=True)
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return self.phase.name + "-" + self.activity.name + "-" + self.name
 
+    def get_fingerprint(self):
+        return get_fingerprint(self, "task")
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        # The document is created in process_design by the outbox drainer, with the
+        # _id given here
+        created = not self.couch_id
+        if created:
+            self.couch_id = uuid.uuid4().hex
+        adding = self._state.adding
+        self.fingerprint = self.get_fingerprint()
         super().save(*args, **kwargs)
         form = []
         if self.form:
@@ -212,27 +343,339 @@ class Task(models.Model):
             "form_response": [],
             "sql_id": self.id,
         }
-        nsc = NoSQLClient()
-        nsc_database = nsc.get_db("process_design")
-        new_document = nsc_database.get_query_result({"_id": self.couch_id})[0]
-        if not new_document:
-            new_document = nsc.create_document(nsc_database, data)
-            self.couch_id = new_document["_id"]
-            activity = Activity.objects.get(id=self.activity_id)
-            activity.total_tasks = (
-                Task.objects.filter(activity_id=activity.id).all().count()
-            )
-            activity.save()
-            docu = {"total_tasks": activity.total_tasks}
-            query_result = nsc_database.get_query_result(
-                {"_id": self.activity.couch_id}
-            )[:]
-            doc = nsc_database[query_result[0]["_id"]]
-            nsc.update_doc(nsc_database, doc["_id"], docu)
-            self.save()
+        enqueue_save("process_design", self.couch_id, data, created)
+        if adding:
+            self.activity.add_tasks(1)
 
         return self
 
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        enqueue_delete("process_design", self.couch_id)
+        result = super().delete(*args, **kwargs)
+        self.activity.add_tasks(-1)
+        return result
+
+
+class ChangesCheckpoint(models.Model):
+    """
+    Last sequence of the _changes feed of a CouchDB database read by the
+    follow_changes command ("_db_updates" for the feed of the databases)
+    """
+
+    db_name = models.CharField(max_length=255, unique=True)
+    since = models.TextField(default="0")
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.db_name
+
+
+class OutboxMessage(models.Model):
+    """
+    CouchDB write recorded in the transaction of the model change it comes from
+    and sent later by the drain_outbox command (see process_manager.outbox). A
+    propagation message carries a structural edit to make in every facilitator
+    database (see dashboard.propagation).
+    """
+
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+    PROPAGATE = "propagate"
+    KINDS = [
+        (CREATE, _("Create")),
+        (UPDATE, _("Update")),
+        (DELETE, _("Delete")),
+        (PROPAGATE, _("Propagate")),
+    ]
+    # The propagations are sent one after the other, in order
+    PROPAGATION_DOC_ID = "propagation"
+
+    key = models.CharField(max_length=255, unique=True)
+    db_name = models.CharField(max_length=255)
+    doc_id = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    data = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["sent_on", "next_attempt_on"])]
+
+    def __str__(self):
+        return f"{self.kind} {self.db_name}/{self.doc_id}"
+
+    @classmethod
+    def enqueue_create(cls, db_name, doc):
+        """
+        Record the creation of the document, which must carry its _id
+        """
+        return cls.objects.get_or_create(
+            key=f"{db_name}:{doc['_id']}:create",
+            defaults={
+                "db_name": db_name,
+                "doc_id": doc["_id"],
+                "kind": cls.CREATE,
+                "data": doc,
+            },
+        )[0]
+
+    @classmethod
+    def enqueue_update(cls, db_name, doc_id, fields, key=None):
+        """
+        Record the fields to set on the document
+        """
+        return cls.objects.get_or_create(
+            key=key or f"{db_name}:{doc_id}:update:{uuid.uuid4().hex}",
+            defaults={
+                "db_name": db_name,
+                "doc_id": doc_id,
+                "kind": cls.UPDATE,
+                "data": fields,
+            },
+        )[0]
+
+    @classmethod
+    def enqueue_delete(cls, db_name, doc_id):
+        """
+        Record the deletion of the document
+        """
+        return cls.objects.get_or_create(
+            key=f"{db_name}:{doc_id}:delete",
+            defaults={
+                "db_name": db_name,
+                "doc_id": doc_id,
+                "kind": cls.DELETE,
+                "data": {},
+            },
+        )[0]
+
+    @classmethod
+    def enqueue_propagation(cls, data):
+        """
+        Record the propagation of a structural edit to the facilitator databases
+        """
+        return cls.objects.create(
+            key=f"propagation:{uuid.uuid4().hex}",
+            db_name="",
+            doc_id=cls.PROPAGATION_DOC_ID,
+            kind=cls.PROPAGATE,
+            data=data,
+        )
+
+
+class FacilitatorSyncState(models.Model):
+    """
+    Outcome of the last sync of the process design tasks into the database of a
+    facilitator. The facilitators whose sync is done with the current design
+    version and administrative levels are skipped by the sync_tasks command.
+    """
+
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    ]
+
+    facilitator = models.OneToOneField(
+        "authentication.Facilitator",
+        on_delete=models.CASCADE,
+        related_name="sync_state",
+    )
+    design_version = models.CharField(max_length=64, blank=True)
+    administrative_levels_version = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=RUNNING)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.facilitator} {self.status}"
+
+    def is_current(self, design_version, administrative_levels_version):
+        return (
+            self.status == self.DONE
+            and self.design_version == design_version
+            and self.administrative_levels_version == administrative_levels_version
+        )
+
+
+class SyncRun(models.Model):
+    """
+    Run of a sync of the process design into the facilitator databases (sync_tasks
+    or the propagation of a structural edit), with the totals of its databases
+    (see SyncRunDatabase)
+    """
+
+    SYNC = "sync"
+    PROPAGATION = "propagation"
+    KINDS = [
+        (SYNC, _("Sync")),
+        (PROPAGATION, _("Propagation")),
+    ]
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    ]
+    COUNTERS = [
+        "read",
+        "created",
+        "updated",
+        "unchanged",
+        "deleted",
+        "requests",
+        "bytes",
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS, default=SYNC)
+    design_version = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=RUNNING)
+    synced = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    read = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    requests = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_on = models.DateTimeField(default=timezone.now)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-started_on"]
+
+    def __str__(self):
+        return f"{self.kind} {self.started_on:%Y-%m-%d %H:%M} {self.status}"
+
+    @property
+    def duration(self):
+        if self.finished_on:
+            return (self.finished_on - self.started_on).total_seconds()
+
+    def add(self, database):
+        """
+        Save the outcome of a database and add it to the totals of the run
+        """
+        database.run = self
+        database.save()
+        if database.status == self.FAILED:
+            self.failed += 1
+        else:
+            self.synced += 1
+        for counter in self.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(database, counter))
+
+    def finish(self, error=""):
+        self.error = error
+        self.status = self.FAILED if error or self.failed else self.DONE
+        self.finished_on = timezone.now()
+        self.save()
+
+
+class SyncRunDatabase(models.Model):
+    """
+    Outcome of a facilitator database in a sync run, with the CouchDB requests it
+    took
+    """
+
+    run = models.ForeignKey(SyncRun, on_delete=models.CASCADE, related_name="databases")
+    facilitator = models.ForeignKey(
+        "authentication.Facilitator",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="sync_runs",
+    )
+    db_name = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=20, choices=SyncRun.STATUSES, default=SyncRun.DONE
+    )
+    read = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    requests = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    duration = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    started_on = models.DateTimeField(default=timezone.now)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["db_name", "started_on"]),
+            models.Index(fields=["started_on", "duration"]),
+        ]
+
+    def __str__(self):
+        return f"{self.db_name} {self.status}"
+
+
+class TaskProgress(models.Model):
+    """
+    Copy of a task in a village of a facilitator database, with the administrative
+    levels above the village, kept in step with the databases by the
+    follow_changes command (see dashboard.task_progress). The diagnostics add
+    them up with aggregate queries instead of reading the facilitator databases.
+    The project, phase and activity are the ones of the task.
+    """
+
+    facilitator = models.ForeignKey(
+        "authentication.Facilitator",
+        on_delete=models.CASCADE,
+        related_name="task_progress",
+    )
+    village_id = models.CharField(max_length=64)
+    canton_id = models.CharField(max_length=64, blank=True)
+    commune_id = models.CharField(max_length=64, blank=True)
+    prefecture_id = models.CharField(max_length=64, blank=True)
+    region_id = models.CharField(max_length=64, blank=True)
+    project = models.ForeignKey("Project", on_delete=models.CASCADE)
+    phase = models.ForeignKey("Phase", on_delete=models.CASCADE)
+    activity = models.ForeignKey("Activity", on_delete=models.CASCADE)
+    task = models.ForeignKey("Task", on_delete=models.CASCADE)
+    doc_id = models.CharField(max_length=255)
+    total = models.IntegerField(default=1)
+    completed = models.IntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["facilitator", "village_id", "task"],
+                name="unique_task_progress",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["facilitator", "doc_id"]),
+            models.Index(fields=["region_id"]),
+            models.Index(fields=["prefecture_id"]),
+            models.Index(fields=["commune_id"]),
+            models.Index(fields=["canton_id"]),
+            models.Index(fields=["village_id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.facilitator} {self.village_id} {self.task_id}"
+
 
 User = get_user_model()
 
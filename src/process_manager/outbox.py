@@ -0,0 +1,170 @@
+# Transactional outbox of the CouchDB writes of the process_manager models.
+# save() records the document to create (or the fields to set) in an
+# OutboxMessage in the same SQL transaction as the row, instead of calling CouchDB
+# inside the request. drain() later reads the documents of a batch of messages
+# with one _all_docs request per database, applies the messages in order and
+# writes the documents with chunked _bulk_docs requests. A failed message is
+# retried with an exponential backoff, and the messages of its document after it
+# wait for it.
+#
+# Replaying a message is harmless: a create is skipped when the document already
+# exists (its _id, generated with the row, is the idempotency key), an update
+# sets absolute values and a delete of a missing document does nothing. The key
+# of a message makes enqueueing it twice a no-op (see OutboxMessage.enqueue_create,
+# enqueue_update and enqueue_delete).
+#
+# The propagations of the structural edits to the facilitator databases
+# (OutboxMessage.enqueue_propagation) are made in order by the same drain, a failed
+# one holding the next ones back. Replaying one is harmless as well.
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from no_sql_client import NoSQLClient
+from process_manager.models import OutboxMessage
+
+
+def get_batch(batch_size, max_attempts):
+    """
+    Return the oldest messages due, leaving out the documents with a message
+    waiting for a retry
+    """
+    now = timezone.now()
+    pending = OutboxMessage.objects.filter(
+        sent_on__isnull=True, attempts__lt=max_attempts
+    )
+    waiting = pending.filter(next_attempt_on__gt=now).values("doc_id")
+    return list(
+        pending.filter(next_attempt_on__lte=now)
+        .exclude(doc_id__in=waiting)
+        .order_by("id")[:batch_size]
+    )
+
+
+def apply_messages(doc, messages):
+    """
+    Return the document once the messages are applied on it (None if it doesn't
+    exist yet, a _deleted stub if it is deleted), and the messages that couldn't
+    be applied
+    """
+    failed = []
+    for message in messages:
+        if failed:
+            failed.append(message)
+        elif doc is not None and doc.get("_deleted"):
+            continue
+        elif message.kind == OutboxMessage.CREATE:
+            if doc is None:
+                doc = dict(message.data)
+        elif message.kind == OutboxMessage.DELETE:
+            if doc is not None:
+                # A document created in the same batch was never written
+                doc = (
+                    {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+                    if "_rev" in doc
+                    else None
+                )
+        elif doc is None:
+            failed.append(message)
+        else:
+            doc = {**doc, **message.data}
+    return doc, failed
+
+
+def drain(batch_size=None, max_attempts=None):
+    """
+    Send a batch of the pending messages. Returns the number of messages sent and
+    failed.
+    """
+    batch_size = batch_size or settings.NO_SQL_BULK_SIZE
+    max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+    messages = get_batch(batch_size, max_attempts)
+
+    grouped = {}
+    propagations = []
+    for message in messages:
+        if message.kind == OutboxMessage.PROPAGATE:
+            propagations.append(message)
+            continue
+        grouped.setdefault(message.db_name, {}).setdefault(message.doc_id, []).append(
+            message
+        )
+
+    nsc = NoSQLClient()
+    sent = []
+    failed = {}  # message -> error
+    for db_name, by_doc in grouped.items():
+        try:
+            db = nsc.get_db(db_name)
+            latest = {doc["_id"]: doc for doc in nsc.bulk_get(db, by_doc)}
+        except Exception as e:
+            for doc_messages in by_doc.values():
+                failed.update({message: str(e) for message in doc_messages})
+            continue
+
+        docs = []
+        for doc_id, doc_messages in by_doc.items():
+            doc, not_applied = apply_messages(latest.get(doc_id), doc_messages)
+            failed.update({message: "missing document" for message in not_applied})
+            applied = [
+                message for message in doc_messages if message not in not_applied
+            ]
+            if doc is not None and doc != latest.get(doc_id):
+                docs.append((doc, applied))
+            else:
+                sent.extend(applied)
+
+        results = nsc.bulk_upsert(db, [doc for doc, _ in docs]) if docs else []
+        for (doc, applied), result in zip(docs, results):
+            if result.get("error"):
+                failed.update(
+                    {
+                        message: result.get("reason") or result["error"]
+                        for message in applied
+                    }
+                )
+            else:
+                sent.extend(applied)
+
+    if propagations:
+        # Imported here since dashboard.propagation depends on this module
+        from dashboard.propagation import propagate_message
+
+        for message in propagations:
+            if failed.keys() & set(propagations):
+                failed[message] = "waiting for a failed propagation"
+                continue
+            try:
+                error = propagate_message(message.data)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            if error:
+                failed[message] = error
+            else:
+                sent.append(message)
+
+    now = timezone.now()
+    OutboxMessage.objects.filter(id__in=[message.id for message in sent]).update(
+        sent_on=now, error=""
+    )
+    for message, error in failed.items():
+        message.attempts += 1
+        message.error = error
+        message.next_attempt_on = now + timedelta(
+            seconds=min(2**message.attempts, settings.OUTBOX_MAX_BACKOFF)
+        )
+        message.save(update_fields=["attempts", "error", "next_attempt_on"])
+    return len(sent), len(failed)
+
+
+def flush(batch_size=None, max_attempts=None):
+    """
+    Send the messages due until none is left or a batch fails entirely
+    """
+    total = 0
+    while True:
+        sent, failed = drain(batch_size, max_attempts)
+        total += sent
+        if not sent:
+            return total
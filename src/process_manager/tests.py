@@ -1,3 +1,342 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from administrativelevels.tree import administrative_level_tree
+from authentication.models import Facilitator
+from fake_couchdb import FakeCouchDB
+from no_sql_client import NoSQLClient, merge_fields
+from process_manager.cache import process_design_cache
+from process_manager.change_handlers import update_completed_tasks
+from process_manager.changes import ChangeEvent
+from process_manager.enums import ChangeEventEnum
+from process_manager.models import Activity, OutboxMessage, Phase, Project, Task
+from process_manager.outbox import apply_messages, flush
+
+
+class FakeCouchDBTestCase(TestCase):
+    """
+    Test case run against a new in-memory fake CouchDB (see fake_couchdb) for each
+    test, with the process_design and administrative_levels databases
+    """
+
+    def setUp(self):
+        super().setUp()
+        couch = FakeCouchDB(latency=0).start()
+        self.addCleanup(couch.stop)
+        settings_override = override_settings(NO_SQL_URL=couch.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.nsc = NoSQLClient()
+        for db_name in ("process_design", "administrative_levels"):
+            self.nsc.create_db(db_name)
+        process_design_cache.reset()
+        administrative_level_tree.reset()
+
+    def get_doc(self, db_name, doc_id):
+        docs = self.nsc.bulk_get(self.nsc.get_db(db_name), [doc_id])
+        return docs[0] if docs else None
+
+    def create_process(self, tasks=1):
+        project = Project(name="Project", description="Project")
+        project.save()
+        phase = Phase(name="Phase", description="Phase", project=project, order=1)
+        phase.save()
+        activity = Activity(
+            name="Activity",
+            description="Activity",
+            project=project,
+            phase=phase,
+            order=1,
+            total_tasks=0,
+        )
+        activity.save()
+        for i in range(tasks):
+            Task(
+                name=f"Task {i + 1}",
+                description="Task",
+                project=project,
+                phase=phase,
+                activity=activity,
+                order=i + 1,
+            ).save()
+        return project, phase, activity
+
+    def create_facilitator(self, name="facilitator", administrative_levels=()):
+        """
+        Create the facilitator with its database and facilitator document, like
+        generate_load_dataset does
+        """
+        facilitator = Facilitator(
+            username=name,
+            no_sql_user=name,
+            no_sql_pass=name,
+            no_sql_db_name=f"facilitator_{name}",
+            code=str(100000 + Facilitator.objects.count()),
+            password=name,
+        )
+        facilitator.simple_save()
+        db = self.nsc.create_db(facilitator.no_sql_db_name)
+        self.nsc.bulk_upsert(
+            db,
+            [
+                {
+                    "type": "facilitator",
+                    "administrative_levels": list(administrative_levels),
+                    "sql_id": facilitator.id,
+                }
+            ],
+        )
+        return facilitator, db
+
+
+class TestFakeCouchDB(FakeCouchDBTestCase):
+    def test_find_pages_with_bookmarks(self):
+        db = self.nsc.get_db("process_design")
+        self.nsc.bulk_upsert(db, [{"type": "task", "order": i} for i in range(25)])
+        self.nsc.bulk_upsert(db, [{"type": "phase"}])
+
+        with self.settings(NO_SQL_BULK_SIZE=10):
+            docs = self.nsc.find_documents(db, {"type": "task"})
+        self.assertEqual(sorted(doc["order"] for doc in docs), list(range(25)))
+
+    def test_bulk_docs_conflict(self):
+        db = self.nsc.get_db("process_design")
+        (result,) = self.nsc.bulk_upsert(db, [{"_id": "a", "name": "A"}])
+        self.assertTrue(result["ok"])
+
+        results = self.nsc.bulk_upsert(
+            db,
+            [
+                {"_id": "a", "name": "Stale"},
+                {"_id": "a", "_rev": result["rev"], "name": "B"},
+            ],
+        )
+        self.assertEqual(results[0]["error"], "conflict")
+        self.assertTrue(results[1]["ok"])
+        self.assertEqual(self.get_doc("process_design", "a")["name"], "B")
+
+    def test_deleted_documents_are_left_out(self):
+        db = self.nsc.get_db("process_design")
+        (result,) = self.nsc.bulk_upsert(db, [{"_id": "a", "type": "task"}])
+        self.nsc.bulk_upsert(
+            db, [{"_id": "a", "_rev": result["rev"], "_deleted": True}]
+        )
+
+        self.assertIsNone(self.get_doc("process_design", "a"))
+        self.assertEqual(self.nsc.find_documents(db, {"type": "task"}), [])
+
+
+class TestBulkDocuments(FakeCouchDBTestCase):
+    def test_chunks_by_count(self):
+        docs = [{"order": i} for i in range(5)]
+        chunks = list(NoSQLClient._bulk_chunks(docs, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+    def test_chunks_by_size(self):
+        doc_bytes = len(json.dumps({"name": "x" * 100}))
+        docs = [{"name": "x" * 100}] * 3 + [{"name": "x" * 1000}]
+        with self.settings(NO_SQL_BULK_MAX_BYTES=2 * doc_bytes):
+            chunks = list(NoSQLClient._bulk_chunks(docs, chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1, 1])
+
+    def test_upsert_get_delete(self):
+        db = self.nsc.get_db("process_design")
+        results = self.nsc.bulk_upsert(
+            db, [{"_id": str(i), "order": i} for i in range(5)], chunk_size=2
+        )
+        self.assertEqual(self.nsc.bulk_errors(results), [])
+
+        docs = self.nsc.bulk_get(db, ["0", "3", "missing"], chunk_size=2)
+        self.assertEqual([doc["order"] for doc in docs], [0, 3])
+
+        results = self.nsc.bulk_delete(db, docs)
+        self.assertEqual(self.nsc.bulk_errors(results), [])
+        self.assertEqual(len(self.nsc.bulk_get(db, [str(i) for i in range(5)])), 3)
+
+    def test_errors(self):
+        db = self.nsc.get_db("process_design")
+        self.nsc.bulk_upsert(db, [{"_id": "a"}])
+
+        results = self.nsc.bulk_upsert(db, [{"_id": "a"}, {"_id": "b"}])
+        errors = self.nsc.bulk_errors(results)
+        self.assertEqual(
+            [(error["id"], error["error"]) for error in errors], [("a", "conflict")]
+        )
+
+
+class TestUpsertDocument(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.nsc.get_db("process_design")
+        (result,) = self.nsc.bulk_upsert(
+            self.db, [{"_id": "a", "name": "A", "order": 1}]
+        )
+        self.rev = result["rev"]
+
+    def test_update(self):
+        rev = self.nsc.upsert_document(
+            self.db, {"_id": "a", "_rev": self.rev, "name": "B"}
+        )
+        self.assertEqual(self.get_doc("process_design", "a")["_rev"], rev)
+        self.assertNotIn("order", self.get_doc("process_design", "a"))
+
+    def test_create_without_id(self):
+        rev = self.nsc.upsert_document(self.db, {"name": "C"})
+        (doc,) = self.nsc.find_documents(self.db, {"name": "C"})
+        self.assertEqual(doc["_rev"], rev)
+
+    def test_conflict_is_merged_on_the_latest_revision(self):
+        self.nsc.upsert_document(self.db, {"_id": "a", "name": "B"})
+        doc = self.get_doc("process_design", "a")
+        self.assertEqual((doc["name"], doc["order"]), ("B", 1))
+
+    def test_conflict_with_merge_fields(self):
+        self.nsc.upsert_document(
+            self.db,
+            {"_id": "a", "name": "B", "order": 2},
+            merge_fields("order"),
+        )
+        doc = self.get_doc("process_design", "a")
+        self.assertEqual((doc["name"], doc["order"]), ("A", 2))
+
+    def test_update_doc_reads_the_document(self):
+        doc = self.nsc.update_doc(self.nsc.get_db("process_design"), "a", {"name": "B"})
+        self.assertEqual(doc["name"], "B")
+        self.assertEqual(self.get_doc("process_design", "a")["_rev"], doc["_rev"])
+        self.assertEqual(self.get_doc("process_design", "a")["order"], 1)
+
+
+class TestOutbox(FakeCouchDBTestCase):
+    def test_update_before_drain(self):
+        _, _, activity = self.create_process()
+        activity = Activity.objects.get(id=activity.id)
+        activity.name = "Edited"
+        activity.save()
+
+        flush()
+        doc = self.get_doc("process_design", activity.couch_id)
+        self.assertEqual(doc["name"], "Edited")
+        self.assertEqual(doc["total_tasks"], 1)
+        self.assertFalse(OutboxMessage.objects.filter(sent_on__isnull=True).exists())
+
+    def test_updates_in_order(self):
+        _, _, activity = self.create_process()
+        flush()
+        for name in ("First", "Second"):
+            activity.name = name
+            activity.save()
+
+        flush()
+        self.assertEqual(
+            self.get_doc("process_design", activity.couch_id)["name"], "Second"
+        )
+
+    def test_delete_before_drain(self):
+        _, _, activity = self.create_process()
+        task = Task.objects.get(activity=activity)
+        task.delete()
+
+        flush()
+        self.assertIsNone(self.get_doc("process_design", task.couch_id))
+        self.assertEqual(
+            self.get_doc("process_design", activity.couch_id)["total_tasks"], 0
+        )
+
+    def test_delete_cascade(self):
+        project, phase, activity = self.create_process(tasks=2)
+        task_ids = list(Task.objects.values_list("couch_id", flat=True))
+        flush()
+        phase.delete()
+
+        flush()
+        for doc_id in [phase.couch_id, activity.couch_id, *task_ids]:
+            self.assertIsNone(self.get_doc("process_design", doc_id))
+        self.assertIsNotNone(self.get_doc("process_design", project.couch_id))
+
+    def test_apply_messages(self):
+        messages = [
+            OutboxMessage(kind=OutboxMessage.UPDATE, data={"name": "Edited"}),
+            OutboxMessage(kind=OutboxMessage.CREATE, data={"_id": "a", "name": "A"}),
+        ]
+        doc, failed = apply_messages(None, messages)
+        self.assertIsNone(doc)
+        self.assertEqual(failed, messages)
+
+        doc, failed = apply_messages(None, messages[::-1])
+        self.assertEqual(doc, {"_id": "a", "name": "Edited"})
+        self.assertEqual(failed, [])
+
+        delete = OutboxMessage(kind=OutboxMessage.DELETE, data={})
+        doc, failed = apply_messages({"_id": "a", "_rev": "1-a"}, [delete, *messages])
+        self.assertEqual(doc, {"_id": "a", "_rev": "1-a", "_deleted": True})
+        self.assertEqual(failed, [])
+
+
+class TestCompletedTasksHandler(FakeCouchDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.nsc.create_db("facilitator_test")
+        # Written before the handler: no completed_task_ids
+        self.nsc.bulk_upsert(
+            self.db,
+            [{"_id": "activity", "type": "activity", "completed_tasks": 2}]
+            + [
+                {
+                    "_id": f"task{i}",
+                    "type": "task",
+                    "activity_id": "activity",
+                    "completed": i < 3,
+                }
+                for i in range(4)
+            ],
+        )
+
+    def get_event(self, event_type, doc_id):
+        return ChangeEvent(
+            event_type, "facilitator_test", doc_id, "1", self.get_doc_or_stub(doc_id)
+        )
+
+    def get_doc_or_stub(self, doc_id):
+        return self.get_doc("facilitator_test", doc_id) or {
+            "_id": doc_id,
+            "_deleted": True,
+        }
+
+    def get_activity(self):
+        return self.get_doc("facilitator_test", "activity")
+
+    def test_existing_completions_are_backfilled(self):
+        update_completed_tasks([self.get_event(ChangeEventEnum.TASK_UPDATED, "task2")])
+        activity = self.get_activity()
+        self.assertEqual(activity["completed_tasks"], 3)
+        self.assertEqual(activity["completed_task_ids"], ["task0", "task1", "task2"])
+
+    def test_event_delivered_twice(self):
+        event = self.get_event(ChangeEventEnum.TASK_UPDATED, "task2")
+        update_completed_tasks([event])
+        rev = self.get_activity()["_rev"]
+
+        update_completed_tasks([event, event])
+        activity = self.get_activity()
+        self.assertEqual(activity["completed_tasks"], 3)
+        self.assertEqual(activity["_rev"], rev)
+
+    def test_reopened_task(self):
+        doc = self.get_doc("facilitator_test", "task0")
+        doc["completed"] = False
+        self.nsc.bulk_upsert(self.db, [doc])
+
+        update_completed_tasks([self.get_event(ChangeEventEnum.TASK_UPDATED, "task0")])
+        self.assertEqual(self.get_activity()["completed_tasks"], 2)
+
+    def test_deleted_task(self):
+        update_completed_tasks([self.get_event(ChangeEventEnum.TASK_UPDATED, "task2")])
+        self.nsc.delete_document(self.db, "task0")
+
+        event = self.get_event(ChangeEventEnum.DOCUMENT_DELETED, "task0")
+        update_completed_tasks([event, event])
+        activity = self.get_activity()
+        self.assertEqual(activity["completed_tasks"], 2)
+        self.assertEqual(activity["completed_task_ids"], ["task1", "task2"])